@@ -1,10 +1,21 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import google.generativeai as genai
+import numpy as np
 import os
-import json
-from datetime import datetime
+import time
+from store import StationStore, ConflictError
+from views import StationFrame
+from search import SearchIndex, tokenize
+from calc import (DesignCalcEngine, item_currents, required_ah, battery_sweep, fleet_battery_plan,
+                  BATTERY_CAPACITIES, DEFAULT_EFFICIENCY)
+from sync import sync_calc_to_cost, sync_cost_to_inventory, bulk_sync, changed
+from stock import InventoryIndex
+from racks import RackIndex, rack_summary, place_equipment
+from spatial import SpatialIndex, viewport
+from bulk_io import import_file, export_bytes, error_report_csv, detect_format, SCHEMAS, KIND_LABELS
+from assistant import (ContextBuilder, AssistantService, fleet_aggregates, make_backend,
+                       DEFAULT_CONTEXT_TOKENS, AI_BACKEND)
+from profiling import Profiler, span, profiled
 
 # --- CẤU HÌNH TRANG ---
 st.set_page_config(
@@ -14,6 +25,13 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Đo thời gian từng lượt chạy lại: bộ đo dùng chung cho mọi phiên, mỗi lượt là một run
+@st.cache_resource
+def get_profiler():
+    return Profiler()
+
+get_profiler().begin()
+
 # --- CSS TÙY CHỈNH (Mô phỏng giao diện Tailwind) ---
 st.markdown("""
 <style>
@@ -35,76 +53,191 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- KHỞI TẠO DỮ LIỆU (MOCK DATA TỪ constants.ts) ---
-def init_data():
-    if 'stations' not in st.session_state:
-        # Dữ liệu giả lập ban đầu
-        st.session_state['stations'] = [
-            {
-                "id": "1", "code": "QNHW002", "name": "Móng Cái", "region": "Miền Bắc", "status": "PLANNED",
-                "province": "Quảng Ninh", "buildYear": "2026", "power": 60, "racks": 12,
-                "manager": "Nguyễn Văn Quyền", "branchManager": "Nguyễn Văn Linh",
-                "buildingType": "Cont", "category": "Quốc tế",
-                "coordinates": {"lat": 21.521187, "lng": 107.961813},
-                "designData": {
-                    "racks": [{"id": "r1", "name": "Rack 1 (Nguồn)", "totalU": 42}],
-                    "equipments": [
-                        {"id": "eq1", "rackId": "r1", "name": "Nguồn Emerson 701", "model": "Netsure 701", "type": "DC", "powerW": 200, "startU": 1, "uHeight": 5, "color": "#3B82F6"}
-                    ],
-                    "calcItems": [],
-                    "costEstimateItems": [], # Dữ liệu dự toán
-                    "roomParams": {"width": 3, "length": 5, "height": 3, "tempInside": 25, "tempOutside": 40, "equipmentHeatW": 0},
-                    "batteryParams": {"dcLoadW": 0, "targetBackupTime": 8, "batteryVoltage": 48, "batteryAh": 100, "efficiency": 0.9},
-                    "rectParams": {"dcLoadW": 0, "batteryAh": 0, "rectifierModuleSize": 3000}
-                },
-                "inventory": [
-                    {"id": "inv1", "itemCode": "MPD-100", "itemName": "Máy phát điện Cummins 100kVA", "quantity": 1, "ratedPower": 40, "type": "OFFLINE", "unit": "Cái", "location1": "Sân trạm", "transfer": {"isTransferred": False}}
-                ]
+# Một kho dùng chung cho mọi phiên trong tiến trình; phiên chỉ giữ id/phiên bản.
+@st.cache_resource
+def get_store():
+    store = StationStore()
+    # Dữ liệu giả lập ban đầu (chỉ nạp khi kho còn trống)
+    store.seed_if_empty([
+        {
+            "id": "1", "code": "QNHW002", "name": "Móng Cái", "region": "Miền Bắc", "status": "PLANNED",
+            "province": "Quảng Ninh", "buildYear": "2026", "power": 60, "racks": 12,
+            "manager": "Nguyễn Văn Quyền", "branchManager": "Nguyễn Văn Linh",
+            "buildingType": "Cont", "category": "Quốc tế",
+            "coordinates": {"lat": 21.521187, "lng": 107.961813},
+            "designData": {
+                "racks": [{"id": "r1", "name": "Rack 1 (Nguồn)", "totalU": 42}],
+                "equipments": [
+                    {"id": "eq1", "rackId": "r1", "name": "Nguồn Emerson 701", "model": "Netsure 701", "type": "DC", "powerW": 200, "startU": 1, "uHeight": 5, "color": "#3B82F6"}
+                ],
+                "calcItems": [],
+                "costEstimateItems": [], # Dữ liệu dự toán
+                "roomParams": {"width": 3, "length": 5, "height": 3, "tempInside": 25, "tempOutside": 40, "equipmentHeatW": 0},
+                "batteryParams": {"dcLoadW": 0, "targetBackupTime": 8, "batteryVoltage": 48, "batteryAh": 100, "efficiency": 0.9},
+                "rectParams": {"dcLoadW": 0, "batteryAh": 0, "rectifierModuleSize": 3000}
             },
-            {
-                "id": "2", "code": "NBHW001", "name": "Nam Định", "region": "Miền Bắc", "status": "ACTIVE",
-                "province": "Ninh Bình", "buildYear": "2013", "power": 15, "racks": 5,
-                "manager": "Nguyễn Văn Quyền", "branchManager": "Nguyễn Đình Dương",
-                "buildingType": "Cont", "category": "Repeater",
-                "coordinates": {"lat": 20.42027, "lng": 106.16459},
-                "designData": {}, "inventory": []
-            },
-            # ... Thêm các trạm khác tương tự file constants.ts
-             {
-                "id": "3", "code": "QNIW001", "name": "Ngọc Hồi", "region": "Miền Trung", "status": "ACTIVE",
-                "province": "Quảng Ngãi", "buildYear": "2014", "power": 12, "racks": 5,
-                "buildingType": "Cont", "category": "Repeater",
-                "coordinates": {"lat": 14.704680, "lng": 107.685551},
-                "designData": {}, "inventory": []
-            }
-        ]
-    
+            "inventory": [
+                {"id": "inv1", "itemCode": "MPD-100", "itemName": "Máy phát điện Cummins 100kVA", "quantity": 1, "ratedPower": 40, "type": "OFFLINE", "unit": "Cái", "location1": "Sân trạm", "transfer": {"isTransferred": False}}
+            ]
+        },
+        {
+            "id": "2", "code": "NBHW001", "name": "Nam Định", "region": "Miền Bắc", "status": "ACTIVE",
+            "province": "Ninh Bình", "buildYear": "2013", "power": 15, "racks": 5,
+            "manager": "Nguyễn Văn Quyền", "branchManager": "Nguyễn Đình Dương",
+            "buildingType": "Cont", "category": "Repeater",
+            "coordinates": {"lat": 20.42027, "lng": 106.16459},
+            "designData": {}, "inventory": []
+        },
+        # ... Thêm các trạm khác tương tự file constants.ts
+         {
+            "id": "3", "code": "QNIW001", "name": "Ngọc Hồi", "region": "Miền Trung", "status": "ACTIVE",
+            "province": "Quảng Ngãi", "buildYear": "2014", "power": 12, "racks": 5,
+            "buildingType": "Cont", "category": "Repeater",
+            "coordinates": {"lat": 14.704680, "lng": 107.685551},
+            "designData": {}, "inventory": []
+        }
+    ])
+    return store
+
+def init_data():
     if 'chat_history' not in st.session_state:
         st.session_state['chat_history'] = [{"role": "model", "parts": ["Xin chào! Tôi là trợ lý ảo PMB. Tôi có thể giúp gì cho bạn về dữ liệu hạ tầng?"]}]
 
-init_data()
+with span("init_data"):
+    init_data()
 
 # --- HÀM TIỆN ÍCH ---
 def get_station_by_id(station_id):
-    return next((s for s in st.session_state['stations'] if s['id'] == station_id), None)
+    return get_store().get(station_id)
+
+def update_station_data(station_id, key, value, expected_revision=None):
+    return get_store().update_field(station_id, key, value, expected_revision)
+
+# Bảng trạm dạng cột dùng chung, vá tăng dần theo phiên bản kho
+@st.cache_resource
+def get_station_frame():
+    return StationFrame()
+
+@profiled("view.station_frame")
+def station_frame():
+    return get_station_frame().refresh(get_store())
+
+@st.cache_resource
+def get_search_index():
+    return SearchIndex()
+
+@profiled("view.search_index")
+def search_index():
+    return get_search_index().refresh(get_store())
+
+@st.cache_resource
+def get_context_builder():
+    return ContextBuilder()
 
-def update_station_data(station_id, key, value):
-    for s in st.session_state['stations']:
-        if s['id'] == station_id:
-            s[key] = value
-            break
+@profiled("view.context_builder")
+def context_builder():
+    return get_context_builder().refresh(get_store())
+
+# Một client/executor cho mỗi API key, dùng lại qua các lượt chat và các phiên
+@st.cache_resource
+def get_assistant(backend_name, api_key):
+    return AssistantService(make_backend(backend_name, api_key))
+
+@st.cache_resource
+def get_spatial_index():
+    return SpatialIndex()
+
+@profiled("view.spatial_index")
+def spatial_index():
+    return get_spatial_index().refresh(get_store())
+
+@st.cache_resource
+def get_rack_index():
+    return RackIndex()
+
+@profiled("view.rack_index")
+def rack_index():
+    return get_rack_index().refresh(get_store())
+
+@st.cache_resource
+def get_inventory_index():
+    return InventoryIndex()
+
+@profiled("view.inventory_index")
+def inventory_index():
+    return get_inventory_index().refresh(get_store())
+
+@st.cache_resource
+def get_calc_engine():
+    return DesignCalcEngine()
+
+@profiled("view.calc_engine")
+def calc_engine():
+    return get_calc_engine().refresh(get_store())
+
+# Kết quả định cỡ ắc quy được nhớ theo tham số: kéo lại thanh trượt về giá trị cũ không tính lại
+@st.cache_data(show_spinner=False, max_entries=64)
+def battery_what_if(loads, times, capacity, voltage, eff):
+    sweep = battery_sweep(loads, times, [capacity], voltage, eff)
+    return pd.DataFrame(
+        sweep['strings'][:, :, 0].astype(int),
+        index=pd.Index(loads, name="Tải DC (W)"),
+        columns=[f"{t:g} h" for t in times],
+    )
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def fleet_battery_table(revision, backup_time, capacities):
+    return fleet_battery_plan(calc_engine().results(), backup_time, list(capacities))
+
+# Phiên bản trạm tại thời điểm phiên bắt đầu sửa (optimistic concurrency)
+def get_edit_revision(station):
+    key = f"edit_rev_{station['id']}"
+    if key not in st.session_state:
+        st.session_state[key] = station['revision']
+    return st.session_state[key]
+
+def save_station_data(station, key, value):
+    try:
+        revision = update_station_data(station['id'], key, value, get_edit_revision(station))
+    except ConflictError:
+        st.error("Dữ liệu trạm vừa được người khác cập nhật. Hãy tải lại để xem bản mới nhất trước khi lưu.")
+        return False
+    st.session_state[f"edit_rev_{station['id']}"] = revision
+    return True
+
+def reload_station(station_id):
+    # Bỏ trạng thái sửa dở của phiên để nhận dữ liệu mới nhất
+    st.session_state.pop(f"edit_rev_{station_id}", None)
+    for editor_key in (f"power_editor_{station_id}", f"cost_editor_{station_id}"):
+        st.session_state.pop(editor_key, None)
 
 # --- 1. DASHBOARD ---
+# Biểu đồ chỉ dựng lại khi phiên bản dữ liệu thay đổi; plotly chỉ được nạp khi mở trang này.
+# st.plotly_chart chỉ đọc figure nên có thể dùng chung giữa các phiên.
+@st.cache_resource(show_spinner=False, max_entries=4)
+def dashboard_figures(revision):
+    import plotly.express as px
+
+    agg = station_frame().aggregates()
+    region_df = pd.DataFrame(list(agg['region_counts'].items()), columns=['region', 'count'])
+    fig = px.pie(region_df, names='region', values='count', title='Tỷ lệ trạm theo vùng', hole=0.4, color_discrete_sequence=px.colors.qualitative.Prism)
+    status_df = pd.DataFrame(list(agg['status_counts'].items()), columns=['status', 'count']).sort_values('count', ascending=False)
+    fig2 = px.bar(status_df, x='status', y='count', 
+                  title="Số lượng trạm theo trạng thái", labels={'count': 'Số lượng', 'status': 'Trạng thái'},
+                  color='status')
+    return fig, fig2
+
+@profiled()
 def render_dashboard():
     st.markdown('<div class="main-header">Tổng quan hệ thống PMB</div>', unsafe_allow_html=True)
-    stations = st.session_state['stations']
-    df = pd.DataFrame(stations)
+    agg = station_frame().aggregates()
 
     # Metrics
-    total = len(stations)
-    active = len(df[df['status'] == 'ACTIVE'])
-    planned = len(df[df['status'] == 'PLANNED'])
-    offline = len(df[df['status'] == 'OFFLINE'])
-    total_power = sum([float(s.get('power', 0)) for s in stations])
+    total = agg['total']
+    active = agg['status_counts'].get('ACTIVE', 0)
+    planned = agg['status_counts'].get('PLANNED', 0)
+    offline = agg['status_counts'].get('OFFLINE', 0)
+    total_power = agg['total_power']
 
     c1, c2, c3, c4 = st.columns(4)
     c1.metric("Tổng số trạm", total, "Trạm")
@@ -113,61 +246,177 @@ def render_dashboard():
     c4.metric("Tổng công suất", f"{total_power} kW")
 
     # Charts
+    if total:
+        with span("dashboard.figures"):
+            fig, fig2 = dashboard_figures(get_store().revision)
     col_chart1, col_chart2 = st.columns(2)
     with col_chart1:
         st.subheader("Phân bố theo Khu vực")
-        if not df.empty:
-            fig = px.pie(df, names='region', title='Tỷ lệ trạm theo vùng', hole=0.4, color_discrete_sequence=px.colors.qualitative.Prism)
-            st.plotly_chart(fig, use_container_width=True)
+        if total:
+            with span("dashboard.plotly_chart"):
+                st.plotly_chart(fig, use_container_width=True)
     
     with col_chart2:
         st.subheader("Trạng thái trạm")
-        if not df.empty:
-            fig2 = px.bar(df['status'].value_counts().reset_index(), x='status', y='count', 
-                          title="Số lượng trạm theo trạng thái", labels={'count': 'Số lượng', 'status': 'Trạng thái'},
-                          color='status')
-            st.plotly_chart(fig2, use_container_width=True)
+        if total:
+            with span("dashboard.plotly_chart"):
+                st.plotly_chart(fig2, use_container_width=True)
 
 # --- 2. DANH SÁCH TRẠM ---
+SORT_COLUMNS = {
+    "": "Mức độ khớp / mặc định", "code": "Mã trạm", "name": "Tên trạm", "province": "Tỉnh/TP",
+    "region": "Khu vực", "status": "Trạng thái", "power": "Công suất", "buildYear": "Năm xây dựng",
+}
+
+# Chỉ gửi một trang dữ liệu lên trình duyệt; trả về (offset, limit)
+def page_controls(total, key, sizes=(25, 50, 100, 200)):
+    c_size, c_page, c_info = st.columns([1, 1, 2])
+    size = c_size.selectbox("Số dòng/trang", sizes, index=1, key=f"{key}_size")
+    pages = max(1, -(-total // size))
+    page = c_page.number_input("Trang", 1, pages, 1, key=f"{key}_page_{size}_{pages}")
+    c_info.caption(f"Trang {page}/{pages} · {total:,} dòng")
+    return (page - 1) * size, size
+
+def inventory_table(station_id, key):
+    # Vật tư của một trạm, đọc từng trang từ kho thay vì nạp cả danh sách
+    store = get_store()
+    total = store.inventory_count(station_id)
+    if not total:
+        st.info("Trạm này chưa có dữ liệu vật tư.")
+        return
+    offset, limit = page_controls(total, key)
+    st.dataframe(pd.DataFrame(store.inventory_page(station_id, offset, limit)))
+
+def pick_station(label, key):
+    # Chọn trạm qua ô tìm kiếm: chỉ đưa tối đa 50 lựa chọn vào selectbox
+    frame = station_frame()
+    query = st.text_input("Tìm trạm", key=f"{key}_query", placeholder="Mã, tên trạm, tỉnh...")
+    # Từ khóa không có chữ/số (vd. "(") coi như chưa tìm
+    if tokenize(query):
+        ids = search_index().search(query, limit=50)
+    else:
+        ids = frame.page(sort_by='code', limit=50)[0].index.tolist()
+    labels = frame.df.loc[[i for i in ids if i in frame.df.index], ['code', 'name']]
+    if labels.empty:
+        st.info("Không tìm thấy trạm phù hợp.")
+        return None
+    return st.selectbox(label, labels.index.tolist(), key=key,
+                        format_func=lambda x: f"{labels.at[x, 'code']} - {labels.at[x, 'name']}")
+
+def station_details(station_id):
+    # designData và vật tư chỉ được đọc khi người dùng mở một trạm
+    store = get_store()
+    design = store.get_design_data(station_id)
+    calc = calc_engine().station(station_id)
+    st.subheader(f"Chi tiết trạm {station_frame().df.at[station_id, 'code']}")
+    tab_design, tab_inv = st.tabs(["📐 Thiết kế", "📦 Vật tư"])
+    with tab_design:
+        counts = {"Rack": 'racks', "Thiết bị": 'equipments', "Bảng CS": 'calcItems', "Dự toán": 'costEstimateItems'}
+        cols = st.columns(len(counts) + 1)
+        for col, (label, section) in zip(cols, counts.items()):
+            col.metric(label, len(design.get(section) or []))
+        if calc is not None:
+            cols[-1].metric("Tổng tải", f"{calc['totalLoadW']:,.0f} W")
+        equipments = design.get('equipments') or []
+        if equipments:
+            st.dataframe(pd.DataFrame(equipments).reindex(columns=['name', 'model', 'type', 'powerW', 'rackId', 'startU', 'uHeight']),
+                         use_container_width=True, hide_index=True)
+    with tab_inv:
+        inventory_table(station_id, f"detail_inv_{station_id}")
+
+@profiled()
 def render_station_list():
     st.markdown('<div class="main-header">Danh sách trạm tuyến trục</div>', unsafe_allow_html=True)
-    df = pd.DataFrame(st.session_state['stations'])
-    
+    frame = station_frame()
+
     # Filter
-    c1, c2, c3 = st.columns([2, 1, 1])
-    search = c1.text_input("Tìm kiếm (Tên, Mã trạm, Tỉnh)", placeholder="Nhập từ khóa...")
-    region_filter = c2.selectbox("Khu vực", ["Tất cả"] + list(df['region'].unique()) if not df.empty else [])
-    
-    # Apply Filter
-    if not df.empty:
-        if search:
-            df = df[df['name'].str.contains(search, case=False) | df['code'].str.contains(search, case=False) | df['province'].str.contains(search, case=False)]
-        if region_filter != "Tất cả":
-            df = df[df['region'] == region_filter]
+    c1, c2, c3, c4 = st.columns([2, 1, 1, 1])
+    search = c1.text_input("Tìm kiếm (Tên, Mã trạm, Tỉnh, Nhân sự, Vật tư)", placeholder="Nhập từ khóa, không cần dấu...",
+                           help="Từ khóa 1-2 ký tự đứng riêng chỉ khớp nguyên từ; từ 3 ký tự khớp theo tiền tố.")
+    region_filter = c2.selectbox("Khu vực", ["Tất cả"] + list(frame.aggregates()['region_counts']))
+    sort_by = c3.selectbox("Sắp xếp theo", list(SORT_COLUMNS), format_func=SORT_COLUMNS.get)
+    descending = c4.toggle("Giảm dần", disabled=not sort_by)
 
-        st.dataframe(
-            df[['code', 'name', 'province', 'region', 'status', 'power', 'buildingType', 'manager']],
-            column_config={
-                "code": "Mã trạm", "name": "Tên trạm", "province": "Tỉnh/TP",
-                "region": "Khu vực", "status": "Trạng thái", "power": st.column_config.NumberColumn("Công suất (kW)"),
-                "buildingType": "Loại nhà", "manager": "Nhân sự PMB"
-            },
-            use_container_width=True,
-            hide_index=True
-        )
-    else:
+    if frame.df.empty:
         st.info("Chưa có dữ liệu trạm.")
+        return
+
+    # Lọc/sắp xếp trên bảng trạm tại máy chủ, chỉ cắt đúng trang đang xem
+    with span("station_list.filter"):
+        region = None if region_filter == "Tất cả" else region_filter
+        # Chỉ coi là đang tìm khi từ khóa có chữ/số: "(" hay "--" hiện toàn bộ trạm
+        searching = bool(tokenize(search))
+        ranked = searching and not sort_by
+        if ranked:
+            # Xếp theo độ khớp: đếm riêng, chỉ xếp hạng tới hết trang đang xem
+            index = search_index()
+            where = None
+            if region is not None:
+                where = set(frame.df.index[(frame.df['region'] == region).to_numpy()]).__contains__
+            total = index.count(search, where)
+        else:
+            ids = search_index().matches(search) if searching else None
+            _, total = frame.page(ids, region, sort_by or None, not descending, limit=0)
+    offset, limit = page_controls(total, "stations")
+    with span("station_list.page"):
+        if ranked:
+            page, _ = frame.page(index.search(search, offset + limit, where)[offset:], limit=limit)
+        else:
+            page, _ = frame.page(ids, region, sort_by or None, not descending, offset, limit)
+
+    event = st.dataframe(
+        page[['code', 'name', 'province', 'region', 'status', 'power', 'buildingType', 'manager']],
+        column_config={
+            "code": "Mã trạm", "name": "Tên trạm", "province": "Tỉnh/TP",
+            "region": "Khu vực", "status": "Trạng thái", "power": st.column_config.NumberColumn("Công suất (kW)"),
+            "buildingType": "Loại nhà", "manager": "Nhân sự PMB"
+        },
+        use_container_width=True,
+        hide_index=True,
+        on_select="rerun",
+        selection_mode="single-row",
+        # Dòng chọn là vị trí trong trang: đổi trang/lọc/sắp xếp thì bảng mới, bỏ chọn cũ
+        key=f"station_table_{search}_{region}_{sort_by}_{descending}_{offset}_{limit}",
+    )
+    rows = [r for r in (event.selection.rows if event else []) if r < len(page)]
+    if rows:
+        with span("station_list.details"):
+            station_details(page.index[rows[0]])
+    else:
+        st.caption("Chọn một dòng để xem thiết kế và vật tư của trạm.")
 
 # --- 3. TÍNH TOÁN THIẾT KẾ (FEATURE CHÍNH) ---
+@profiled()
 def render_design_calculations():
     st.markdown('<div class="main-header">Tính toán thiết kế & Dự toán</div>', unsafe_allow_html=True)
 
+    # Thiếu hụt công suất toàn mạng (tính sẵn cho mọi trạm, chỉ cập nhật trạm thay đổi)
+    engine = calc_engine()
+    with span("design.shortfalls"):
+        shortfalls = engine.shortfalls()
+    with st.expander(f"📊 Trạm thiếu công suất toàn mạng: {len(shortfalls)}"):
+        if shortfalls.empty:
+            st.caption("Chưa có trạm nào có tổng tải vượt công suất danh định.")
+        else:
+            labels = station_frame().df.reindex(shortfalls.index)
+            view = shortfalls.assign(code=labels['code'], name=labels['name'])
+            st.dataframe(
+                view[['code', 'name', 'ratedPowerKW', 'totalLoadW', 'shortfallKW', 'rectifierModules', 'coolingBTU']],
+                column_config={
+                    "code": "Mã trạm", "name": "Tên trạm", "ratedPowerKW": "P danh định (kW)",
+                    "totalLoadW": "Tổng tải (W)", "shortfallKW": "Thiếu hụt (kW)",
+                    "rectifierModules": "Module CL (N+1)", "coolingBTU": "Tải lạnh (BTU/h)"
+                },
+                use_container_width=True,
+                hide_index=True
+            )
+
     # Chọn trạm
-    stations = st.session_state['stations']
-    station_options = {s['id']: f"{s['code']} - {s['name']}" for s in stations}
-    selected_id = st.selectbox("Chọn trạm làm việc:", options=list(station_options.keys()), format_func=lambda x: station_options[x])
+    selected_id = pick_station("Chọn trạm làm việc:", "design_station")
+    if selected_id is None: return
     
-    station = get_station_by_id(selected_id)
+    with span("design.load_station"):
+        station = get_station_by_id(selected_id)
     if not station: return
 
     # Init data if missing
@@ -175,6 +424,14 @@ def render_design_calculations():
         station['designData'] = {}
     
     design_data = station['designData']
+
+    # Trạm đã được phiên khác cập nhật kể từ lúc bắt đầu sửa
+    if station['revision'] != get_edit_revision(station):
+        c_warn, c_reload = st.columns([4, 1])
+        c_warn.warning("Trạm này vừa được cập nhật ở phiên khác. Tải lại để làm việc trên bản mới nhất.")
+        if c_reload.button("🔄 Tải lại", key=f"reload_{selected_id}"):
+            reload_station(selected_id)
+            st.rerun()
     
     # Tabs
     tab_layout, tab_power, tab_battery, tab_cost = st.tabs(["🏗️ Bố trí Rack", "⚡ Tính Công suất", "🔋 Tính Ắc quy", "💰 Dự toán"])
@@ -182,12 +439,61 @@ def render_design_calculations():
     # --- TAB: BỐ TRÍ RACK (Simplified) ---
     with tab_layout:
         st.info("Chức năng bố trí Rack trực quan (Drag & Drop) được hỗ trợ tốt nhất trên phiên bản React. Dưới đây là danh sách thiết bị hiện tại.")
+        rack_df, rack_issues = rack_summary(design_data)
+        for issue in rack_issues:
+            st.error(issue['message'])
+        if not rack_df.empty:
+            st.dataframe(
+                rack_df.drop(columns=['rackId']),
+                column_config={
+                    "name": "Rack", "totalU": "Tổng U", "usedU": "Đã dùng (U)", "freeU": "Còn trống (U)",
+                    "largestFreeU": "Trống liên tiếp lớn nhất (U)", "freeRanges": "Các đoạn trống"
+                },
+                use_container_width=True, hide_index=True
+            )
         equipments = design_data.get('equipments', [])
         if equipments:
-            st.dataframe(pd.DataFrame(equipments)[['name', 'model', 'type', 'powerW', 'rackId', 'startU']])
+            st.dataframe(pd.DataFrame(equipments).reindex(columns=['name', 'model', 'type', 'powerW', 'rackId', 'startU', 'uHeight']))
         else:
             st.warning("Chưa có thiết bị trong Rack.")
 
+        # Gợi ý vị trí lắp thiết bị mới trong trạm này
+        c_u, c_mode = st.columns(2)
+        new_u = c_u.number_input("Chiều cao thiết bị mới (U)", 1, 48, 2, key=f"new_u_{selected_id}")
+        mode = c_mode.radio("Cách xếp", ["best", "first"], horizontal=True, key=f"fit_{selected_id}",
+                            format_func=lambda m: "Vừa khít nhất" if m == "best" else "Vị trí thấp nhất")
+        spot = place_equipment(design_data, int(new_u), mode)
+        if spot:
+            rack_names = dict(zip(rack_df['rackId'], rack_df['name']))
+            st.success(f"Có thể lắp tại {rack_names.get(spot[0], spot[0])}, từ U{spot[1]} đến U{spot[1] + int(new_u) - 1}.")
+        elif not rack_df.empty:
+            st.warning(f"Không rack nào còn {int(new_u)}U trống liên tiếp.")
+
+        # Expander chỉ chạy nội dung khi đang mở: chỉ mục rack toàn mạng chỉ dựng khi cần
+        with st.expander("🔎 Tìm trạm còn chỗ lắp thiết bị (toàn mạng)", key="fleet_rack_search", on_change="rerun") as fleet_rack:
+            if fleet_rack.open:
+                f1, f2 = st.columns(2)
+                need_u = f1.number_input("Chiều cao (U)", 1, 48, 4, key="fleet_need_u")
+                need_w = f2.number_input("Công suất thiết bị (W)", 0.0, 100000.0, 300.0, step=50.0, key="fleet_need_w")
+                index = rack_index()
+                found, total = index.candidates(int(need_u), need_w, calc_engine(), limit=200)
+                st.caption(f"{total:,} trạm còn rack trống {int(need_u)}U liên tiếp và dư ≥ {need_w:g} W "
+                           "(công suất danh định trừ tổng tải, chỉ xét trạm đã có bảng công suất). "
+                           "Trạm có chỗ vừa khít nhất lên trước.")
+                if total:
+                    st.dataframe(
+                        found,
+                        column_config={
+                            "code": "Mã trạm", "name": "Tên trạm", "rack": "Rack", "startU": "Lắp từ U",
+                            "largestFreeU": "Trống liên tiếp lớn nhất (U)",
+                            "spareKW": st.column_config.NumberColumn("CS dư (kW)", format="%.2f")
+                        },
+                        use_container_width=True, hide_index=True
+                    )
+                issues = index.stations_with_issues()
+                if issues:
+                    st.warning(f"{len(issues):,} trạm có thiết bị chồng lấn hoặc vượt khỏi rack.")
+
     # --- TAB: TÍNH CÔNG SUẤT ---
     with tab_power:
         st.subheader("Bảng tính toán công suất trạm")
@@ -207,43 +513,51 @@ def render_design_calculations():
             df_calc = pd.DataFrame(calc_items)
 
         # Editor
-        edited_power_df = st.data_editor(
-            df_calc,
-            num_rows="dynamic",
-            column_config={
-                "name": st.column_config.TextColumn("Tên thiết bị", width="medium"),
-                "quantity": st.column_config.NumberColumn("SL", min_value=0, step=1),
-                "powerRatedW": st.column_config.NumberColumn("P danh định (W)", min_value=0),
-                "voltage": st.column_config.NumberColumn("U (V)", min_value=0),
-                "current": st.column_config.NumberColumn("I (A)", disabled=True), # Auto calc
-                "wireSection": "Tiết diện dây (mm2)",
-                "wireType": st.column_config.SelectboxColumn("Loại dây", options=[
-                    "1 pha 2 dây: 2x... mm2 - Cu/PVC",
-                    "1 pha 1 dây 1 x ... mm2 - Cu/PVC",
-                    "3 pha 3 dây: 3x ... mm2- Cu/PVC/PVC",
-                    "3 pha 4 dây 3x... + 1x... mm2 -Cu/PVC/PVC"
-                ], width="large"),
-                "type": st.column_config.SelectboxColumn("Loại", options=["DC", "AC", "PASSIVE"]),
-                "note": "Ghi chú"
-            },
-            key=f"power_editor_{selected_id}"
-        )
+        with span("design.power_editor"):
+            edited_power_df = st.data_editor(
+                df_calc,
+                num_rows="dynamic",
+                column_config={
+                    "name": st.column_config.TextColumn("Tên thiết bị", width="medium"),
+                    "quantity": st.column_config.NumberColumn("SL", min_value=0, step=1),
+                    "powerRatedW": st.column_config.NumberColumn("P danh định (W)", min_value=0),
+                    "voltage": st.column_config.NumberColumn("U (V)", min_value=0),
+                    "current": st.column_config.NumberColumn("I (A)", disabled=True), # Auto calc
+                    "wireSection": "Tiết diện dây (mm2)",
+                    "wireType": st.column_config.SelectboxColumn("Loại dây", options=[
+                        "1 pha 2 dây: 2x... mm2 - Cu/PVC",
+                        "1 pha 1 dây 1 x ... mm2 - Cu/PVC",
+                        "3 pha 3 dây: 3x ... mm2- Cu/PVC/PVC",
+                        "3 pha 4 dây 3x... + 1x... mm2 -Cu/PVC/PVC"
+                    ], width="large"),
+                    "type": st.column_config.SelectboxColumn("Loại", options=["DC", "AC", "PASSIVE"]),
+                    "note": "Ghi chú"
+                },
+                key=f"power_editor_{selected_id}"
+            )
 
         # Logic tính toán tự động & Lưu
         if not edited_power_df.empty:
             # Calculate Current I = P / U
-            edited_power_df['current'] = edited_power_df.apply(
-                lambda x: round(x['powerRatedW'] / x['voltage'], 2) if x['voltage'] > 0 else 0, axis=1
-            )
+            edited_power_df['current'] = item_currents(edited_power_df['powerRatedW'], edited_power_df['voltage'])
             
             # Tính tổng
             total_load = (edited_power_df['quantity'] * edited_power_df['powerRatedW']).sum()
             
             st.success(f"⚡ TỔNG CÔNG SUẤT TRẠM: **{total_load:,.0f} W**")
+
+            saved = engine.station(selected_id)
+            if saved is not None:
+                st.caption(
+                    f"Theo dữ liệu đã lưu: tải DC {saved['dcLoadW']:,.0f} W · "
+                    f"{saved['rectifierModules']} module chỉnh lưu (N+1) · "
+                    f"tải lạnh {saved['coolingLoadW']:,.0f} W ({saved['coolingBTU']:,.0f} BTU/h)"
+                )
             
             if st.button("Lưu bảng công suất"):
                 design_data['calcItems'] = edited_power_df.to_dict('records')
-                st.toast("Đã lưu dữ liệu công suất!")
+                if save_station_data(station, 'designData', design_data):
+                    st.toast("Đã lưu dữ liệu công suất!")
 
     # --- TAB: TÍNH ẮC QUY ---
     with tab_battery:
@@ -255,23 +569,65 @@ def render_design_calculations():
             dc_load = st.number_input("Tải DC (W)", value=float(batt_params.get('dcLoadW', 0)))
             backup_time = st.number_input("Thời gian backup mong muốn (h)", value=float(batt_params.get('targetBackupTime', 4)))
         with c2:
-            batt_ah = st.selectbox("Dung lượng 1 tổ (Ah)", [50, 100, 150, 200], index=1)
-            voltage = st.number_input("Điện áp hệ thống (V)", value=48, disabled=True)
-            eff = 0.9 # Hiệu suất
+            stored_ah = batt_params.get('batteryAh', 100)
+            batt_ah = st.selectbox("Dung lượng 1 tổ (Ah)", BATTERY_CAPACITIES,
+                                   index=BATTERY_CAPACITIES.index(stored_ah) if stored_ah in BATTERY_CAPACITIES else 1)
+            voltage = st.number_input("Điện áp hệ thống (V)", value=int(batt_params.get('batteryVoltage', 48)), disabled=True)
+            eff = float(batt_params.get('efficiency', DEFAULT_EFFICIENCY)) # Hiệu suất
 
         if st.button("Tính toán & Lưu cấu hình Ắc quy"):
             # Công thức: Ah = (P * t) / (V * eff)
-            ah_req = (dc_load * backup_time) / (voltage * eff)
+            ah_req = float(required_ah(dc_load, backup_time, voltage, eff))
             n_strings = ah_req / batt_ah
             
-            design_data['batteryParams'] = {"dcLoadW": dc_load, "targetBackupTime": backup_time, "batteryAh": batt_ah}
-            
-            st.info(f"""
-            **Kết quả tính toán:**
-            - Dung lượng yêu cầu: `{ah_req:.2f} Ah`
-            - Số tổ ắc quy ({batt_ah}Ah) cần thiết: `{n_strings:.2f}` tổ
-            - **Khuyến nghị:** Trang bị **{int(n_strings) + 1}** tổ.
-            """)
+            design_data['batteryParams'] = {**batt_params, "dcLoadW": dc_load, "targetBackupTime": backup_time, "batteryAh": batt_ah}
+            # Xung đột phiên bản: save_station_data đã báo lỗi, không hiện kết quả như đã lưu
+            if save_station_data(station, 'designData', design_data):
+                st.info(f"""
+                **Kết quả tính toán (đã lưu):**
+                - Dung lượng yêu cầu: `{ah_req:.2f} Ah`
+                - Số tổ ắc quy ({batt_ah}Ah) cần thiết: `{n_strings:.2f}` tổ
+                - **Khuyến nghị:** Trang bị **{int(np.ceil(n_strings))}** tổ.
+                """)
+
+        # What-if: số tổ cần thiết theo dải tải và thời gian backup
+        with st.expander("📈 Bảng what-if (tải DC × thời gian backup)"):
+            w1, w2 = st.columns(2)
+            load_max = w1.slider("Tải DC tối đa (W)", 1000, 20000, int(min(max(dc_load * 2, 4000), 20000)), step=1000)
+            load_step = w2.select_slider("Bước tải (W)", options=[250, 500, 1000, 2000], value=1000)
+            loads = tuple(float(x) for x in range(load_step, load_max + 1, load_step))
+            times = (2.0, 4.0, 6.0, 8.0, 10.0, 12.0)
+            st.caption(f"Số tổ {batt_ah}Ah cần trang bị")
+            st.dataframe(battery_what_if(loads, times, batt_ah, float(voltage), eff), use_container_width=True)
+
+        # Định cỡ cho toàn mạng trong một lượt vector hóa
+        with st.expander("🔋 Định cỡ ắc quy toàn mạng", key="fleet_battery", on_change="rerun") as fleet_battery:
+            if fleet_battery.open:
+                f1, f2 = st.columns(2)
+                fleet_time = f1.selectbox("Thời gian backup (h)", ["Theo cấu hình từng trạm", 2, 4, 6, 8, 10, 12])
+                fleet_caps = f2.multiselect("Dung lượng tổ được phép (Ah)", BATTERY_CAPACITIES, default=BATTERY_CAPACITIES)
+                if fleet_caps:
+                    plan = fleet_battery_table(
+                        get_store().revision,
+                        None if isinstance(fleet_time, str) else float(fleet_time),
+                        tuple(sorted(fleet_caps)),
+                    )
+                    plan = plan[plan['dcLoadW'] > 0]
+                    m1, m2 = st.columns(2)
+                    m1.metric("Tổng số tổ ắc quy", f"{int(plan['strings'].sum()):,}")
+                    m2.metric("Chi phí tối ưu", f"{plan['cost'].sum():,.0f} VNĐ")
+                    st.dataframe(
+                        plan.assign(code=station_frame().df['code'].reindex(plan.index))[
+                            ['code', 'dcLoadW', 'backupTimeH', 'requiredAh', 'bestCapacityAh', 'strings', 'cost']
+                        ],
+                        column_config={
+                            "code": "Mã trạm", "dcLoadW": "Tải DC (W)", "backupTimeH": "Backup (h)",
+                            "requiredAh": "Ah yêu cầu", "bestCapacityAh": "Dung lượng tổ (Ah)",
+                            "strings": "Số tổ", "cost": st.column_config.NumberColumn("Chi phí (VNĐ)", format="%d đ")
+                        },
+                        use_container_width=True,
+                        hide_index=True
+                    )
 
     # --- TAB: DỰ TOÁN (Yêu cầu mới) ---
     with tab_cost:
@@ -279,27 +635,17 @@ def render_design_calculations():
         
         # 1. Sync Logic (Đồng bộ từ Layout/Power sang Dự toán)
         if st.button("🔄 Đồng bộ từ Bảng Công suất / Rack"):
-            existing_cost = design_data.get('costEstimateItems', [])
-            
-            # Giả lập lấy từ Calc Items để đưa vào dự toán
-            calc_items = design_data.get('calcItems', [])
-            new_items = []
-            for item in calc_items:
-                # Kiểm tra trùng lặp đơn giản
-                if not any(c['itemName'] == item['name'] for c in existing_cost):
-                    new_items.append({
-                        "category": "MAIN", # Vật tư chính
-                        "itemCode": "",
-                        "itemName": item['name'],
-                        "unit": "Cái",
-                        "quantity": item['quantity'],
-                        "unitPrice": 0,
-                        "condition": "Mới",
-                        "note": "Đồng bộ từ bảng CS"
-                    })
-            
-            design_data['costEstimateItems'] = existing_cost + new_items
-            st.success(f"Đã đồng bộ thêm {len(new_items)} mục vào dự toán.")
+            with span("design.sync_calc_to_cost"):
+                cost_items, stats = sync_calc_to_cost(design_data)
+            if changed(stats):
+                design_data['costEstimateItems'] = cost_items
+                if save_station_data(station, 'designData', design_data):
+                    # Bảng dự toán đang mở phải nhận dữ liệu vừa đồng bộ
+                    st.session_state.pop(f"cost_editor_{selected_id}", None)
+                    st.success(f"Đã đồng bộ: thêm {stats['added']}, cập nhật {stats['updated']}, xóa {stats['removed']}, "
+                               f"giữ nguyên {stats['unchanged']} mục dự toán.")
+            else:
+                st.info(f"Dự toán đã khớp với bảng công suất ({stats['unchanged']} mục).")
 
         # 2. Table Editor
         cost_items = design_data.get('costEstimateItems', [])
@@ -315,21 +661,23 @@ def render_design_calculations():
 
         st.caption("Phân loại: MAIN (Vật tư chính), AUX (Vật tư phụ). Nhập giá để tính thành tiền.")
         
-        edited_cost_df = st.data_editor(
-            df_cost,
-            num_rows="dynamic",
-            column_config={
-                "category": st.column_config.SelectboxColumn("Phân loại", options=["MAIN", "AUX"], required=True),
-                "itemCode": "Mã VT",
-                "itemName": st.column_config.TextColumn("Tên vật tư", width="large"),
-                "unit": st.column_config.TextColumn("Đơn vị", width="small"),
-                "quantity": st.column_config.NumberColumn("SL", min_value=1),
-                "unitPrice": st.column_config.NumberColumn("Đơn giá (VNĐ)", format="%d đ"),
-                "condition": st.column_config.SelectboxColumn("Tình trạng", options=["Mới", "Sử dụng lại"]),
-                "note": "Ghi chú"
-            },
-            key=f"cost_editor_{selected_id}"
-        )
+        with span("design.cost_editor"):
+            edited_cost_df = st.data_editor(
+                df_cost,
+                num_rows="dynamic",
+                column_config={
+                    "category": st.column_config.SelectboxColumn("Phân loại", options=["MAIN", "AUX"], required=True),
+                    "itemCode": "Mã VT",
+                    "itemName": st.column_config.TextColumn("Tên vật tư", width="large"),
+                    "unit": st.column_config.TextColumn("Đơn vị", width="small"),
+                    "quantity": st.column_config.NumberColumn("SL", min_value=1),
+                    "unitPrice": st.column_config.NumberColumn("Đơn giá (VNĐ)", format="%d đ"),
+                    "condition": st.column_config.SelectboxColumn("Tình trạng", options=["Mới", "Sử dụng lại"]),
+                    "note": "Ghi chú",
+                    "syncedFrom": None,  # dấu dòng do đồng bộ tạo, không cho sửa
+                },
+                key=f"cost_editor_{selected_id}"
+            )
 
         if not edited_cost_df.empty:
             # Tính thành tiền
@@ -345,42 +693,66 @@ def render_design_calculations():
                     # Lưu lại, bỏ cột thành tiền (vì là tính toán)
                     save_df = edited_cost_df.drop(columns=['totalAmount'], errors='ignore')
                     design_data['costEstimateItems'] = save_df.to_dict('records')
-                    st.toast("Đã lưu dự toán!")
+                    if save_station_data(station, 'designData', design_data):
+                        st.toast("Đã lưu dự toán!")
             
             with col_btn2:
                 if st.button("➡️ Đồng bộ sang 'Vật tư thiết bị'"):
-                    # Logic chuyển sang Inventory tab
-                    current_inventory = station.get('inventory', [])
-                    count_added = 0
-                    for _, row in edited_cost_df.iterrows():
-                        # Tạo Inventory Item từ Cost Item
-                        new_inv = {
-                            "id": f"sync_{datetime.now().timestamp()}_{row['itemName']}",
-                            "itemCode": row['itemCode'],
-                            "itemName": row['itemName'],
-                            "quantity": row['quantity'],
-                            "unit": row['unit'],
-                            "type": "OFFLINE",
-                            "status": "PLANNED",
-                            "note": f"Đồng bộ từ Dự toán. {row['note']}",
-                            "transfer": {"isTransferred": False}
-                        }
-                        current_inventory.append(new_inv)
-                        count_added += 1
-                    
-                    station['inventory'] = current_inventory
-                    st.success(f"Đã chuyển {count_added} thiết bị sang danh sách Quản lý vật tư!")
+                    # Chỉ upsert/xóa các dòng PLANNED do đồng bộ tạo ra: bấm lại không nhân đôi, vật tư thật giữ nguyên
+                    with span("design.sync_cost_to_inventory"):
+                        inventory, stats = sync_cost_to_inventory(
+                            station.get('inventory', []), edited_cost_df.to_dict('records')
+                        )
+                    if not changed(stats):
+                        st.info(f"Danh sách vật tư đã khớp với dự toán ({stats['unchanged']} mục).")
+                    elif save_station_data(station, 'inventory', inventory):
+                        st.success(f"Đã đồng bộ sang Quản lý vật tư: thêm {stats['added']}, cập nhật {stats['updated']}, "
+                                   f"xóa {stats['removed']}, giữ nguyên {stats['unchanged']} thiết bị.")
+
+        # 3. Đồng bộ hàng loạt nhiều trạm
+        with st.expander("🔁 Đồng bộ hàng loạt nhiều trạm"):
+            bulk_codes = [c.strip() for c in st.text_area(
+                "Mã trạm cần đồng bộ, cách nhau bởi dấu phẩy hoặc xuống dòng", key="bulk_codes"
+            ).replace(",", "\n").splitlines() if c.strip()]
+            found = get_store().ids_by_code(bulk_codes) if bulk_codes else {}
+            missing = [c for c in bulk_codes if c not in found]
+            if missing:
+                st.warning(f"Không tìm thấy {len(missing)} mã trạm: {', '.join(missing[:20])}" + (" ..." if len(missing) > 20 else ""))
+            bulk_ids = list(dict.fromkeys(found[c] for c in bulk_codes if c in found))
+            # Toàn mạng phải được chọn rõ ràng, không còn là mặc định khi để trống
+            whole_fleet = st.checkbox(f"Đồng bộ toàn mạng ({station_frame().aggregates()['total']:,} trạm)",
+                                      key="bulk_all", disabled=bool(bulk_codes))
+            b1, b2 = st.columns(2)
+            to_cost = b1.checkbox("Công suất → Dự toán", value=True)
+            to_inventory = b2.checkbox("Dự toán → Vật tư", value=True)
+            targets = bulk_ids if bulk_codes else (station_frame().df.index.tolist() if whole_fleet else [])
+            if st.button("Chạy đồng bộ hàng loạt", disabled=not (to_cost or to_inventory) or not targets):
+                with span("design.bulk_sync"):
+                    totals = bulk_sync(get_store(), targets, to_cost, to_inventory)
+                reload_station(selected_id)
+                st.success(
+                    f"Đã cập nhật {totals['stations']} trạm: thêm {totals['added']}, "
+                    f"cập nhật {totals['updated']}, xóa {totals['removed']}, giữ nguyên {totals['unchanged']} mục."
+                )
+                if totals['conflicts']:
+                    codes = station_frame().df['code'].reindex(totals['conflicts']).fillna('').tolist()
+                    st.warning(
+                        f"{len(codes)} trạm vừa được phiên khác cập nhật nên chưa đồng bộ, hãy chạy lại: "
+                        + ", ".join(codes[:20]) + (" ..." if len(codes) > 20 else "")
+                    )
 
 # --- 4. TRỢ LÝ AI (GEMINI) ---
+@profiled()
 def render_ai_assistant():
     st.markdown('<div class="main-header">Trợ lý ảo AI (Gemini)</div>', unsafe_allow_html=True)
     
     api_key = os.getenv("API_KEY")
-    if not api_key:
+    if not api_key and AI_BACKEND != "fake":
         api_key = st.text_input("Nhập Google API Key để kích hoạt AI:", type="password")
     
-    if api_key:
-        genai.configure(api_key=api_key)
+    if api_key or AI_BACKEND == "fake":
+        budget = st.sidebar.number_input("Giới hạn ngữ cảnh AI (token)", min_value=500, max_value=100000,
+                                         value=DEFAULT_CONTEXT_TOKENS, step=500)
         
         # Display chat history
         for msg in st.session_state['chat_history']:
@@ -391,48 +763,308 @@ def render_ai_assistant():
             st.chat_message("user").markdown(prompt)
             st.session_state['chat_history'].append({"role": "user", "parts": [prompt]})
             
-            # Prepare context
-            stations_json = json.dumps(st.session_state['stations'], default=lambda o: '<not serializable>')
-            context = f"Bạn là trợ lý PMB. Dữ liệu các trạm hiện tại: {stations_json}. Hãy trả lời ngắn gọn."
+            # Prepare context: chỉ các trạm được nhắc tới + số liệu tổng hợp
+            with span("ai.context"):
+                engine = calc_engine()
+                data_context, n_stations, n_omitted = context_builder().build(
+                    prompt, get_store(), fleet_aggregates(station_frame().aggregates(), engine), engine, budget
+                )
+            context = f"Bạn là trợ lý PMB. {data_context} Hãy trả lời ngắn gọn."
+            st.caption(f"Ngữ cảnh gửi kèm: {n_stations} trạm liên quan" + (f", lược bớt {n_omitted}" if n_omitted else ""))
             
             try:
-                model = genai.GenerativeModel('gemini-1.5-flash')
-                response = model.generate_content([context, prompt])
-                st.chat_message("model").markdown(response.text)
-                st.session_state['chat_history'].append({"role": "model", "parts": [response.text]})
+                # Hiển thị dần từng đoạn; câu hỏi lặp lại trên cùng dữ liệu lấy từ bộ nhớ đệm
+                with span("ai.answer"):
+                    assistant = get_assistant(AI_BACKEND, api_key)
+                    answer = st.chat_message("model").write_stream(assistant.ask(context, prompt, get_store().revision))
+                st.session_state['chat_history'].append({"role": "model", "parts": [answer]})
             except Exception as e:
                 st.error(f"Lỗi AI: {e}")
 
 # --- 5. VẬT TƯ THIẾT BỊ ---
+@profiled()
 def render_inventory():
     st.markdown('<div class="main-header">Quản lý Vật tư thiết bị</div>', unsafe_allow_html=True)
-    
-    stations = st.session_state['stations']
-    station_names = {s['id']: s['name'] for s in stations}
-    s_id = st.selectbox("Chọn trạm:", list(station_names.keys()), format_func=lambda x: station_names[x], key="inv_select")
-    
-    station = get_station_by_id(s_id)
-    inventory = station.get('inventory', [])
-    
-    if inventory:
-        st.dataframe(pd.DataFrame(inventory))
+    tab_station, tab_fleet = st.tabs(["🏠 Theo trạm", "🌐 Toàn mạng"])
+
+    with tab_station:
+        s_id = pick_station("Chọn trạm:", "inv_select")
+        if s_id is not None:
+            inventory_table(s_id, f"inv_{s_id}")
+
+    # Tổng hợp lấy từ chỉ mục vật tư toàn mạng, không mở từng trạm
+    with tab_fleet:
+        index = inventory_index()
+        transfer = index.transfer_summary()
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Tổng số dòng vật tư", f"{transfer[True][0] + transfer[False][0]:,}")
+        c2.metric("Chờ điều chuyển", f"{transfer[False][0]:,} dòng", f"{transfer[False][1]:,.0f} đơn vị", delta_color="off")
+        c3.metric("Đã điều chuyển", f"{transfer[True][0]:,} dòng", f"{transfer[True][1]:,.0f} đơn vị", delta_color="off")
+
+        types, statuses = index.options()
+        f1, f2, f3 = st.columns(3)
+        item_type = f1.selectbox("Loại", ["Tất cả"] + types, format_func=lambda x: x or "(trống)", key="stock_type")
+        status = f2.selectbox("Trạng thái", ["Tất cả"] + statuses, format_func=lambda x: x or "(trống)", key="stock_status")
+        moved = f3.selectbox("Điều chuyển", ["Tất cả", "Chưa điều chuyển", "Đã điều chuyển"], key="stock_transfer")
+        totals = index.item_totals(
+            None if item_type == "Tất cả" else item_type,
+            None if status == "Tất cả" else status,
+            None if moved == "Tất cả" else moved == "Đã điều chuyển",
+        )
+        if totals.empty:
+            st.info("Không có vật tư phù hợp.")
+            return
+        st.dataframe(
+            totals,
+            column_config={
+                "itemCode": "Mã VT", "itemName": "Tên vật tư", "unit": "ĐVT", "stations": "Số trạm có",
+                "lines": "Số dòng", "quantity": "Số lượng", "pendingQuantity": "SL chờ điều chuyển"
+            },
+            use_container_width=True, hide_index=True
+        )
+
+        item_code = st.selectbox("Vật tư đang ở đâu?", totals['itemCode'].tolist(), key="stock_item")
+        holders = index.holder_count(item_code)
+        st.caption(f"{item_code} có tại {holders:,} trạm" + (", hiển thị 500 trạm nhiều nhất." if holders > 500 else "."))
+        c_loc, c_region = st.columns([2, 1])
+        c_loc.dataframe(
+            index.locations(item_code, limit=500),
+            column_config={"code": "Mã trạm", "name": "Tên trạm", "province": "Tỉnh/TP", "region": "Khu vực",
+                           "lines": "Số dòng", "quantity": "Số lượng"},
+            use_container_width=True, hide_index=True
+        )
+        c_region.dataframe(
+            index.region_totals(item_code).drop(columns=['itemCode']),
+            column_config={"region": "Khu vực", "lines": "Số dòng", "quantity": "Số lượng"},
+            use_container_width=True, hide_index=True
+        )
+
+        with st.expander(f"Danh sách chờ điều chuyển ({transfer[False][0]:,} dòng)"):
+            st.dataframe(
+                index.pending_transfers(limit=1000).drop(columns=['id']),
+                column_config={"code": "Mã trạm", "name": "Tên trạm", "region": "Khu vực", "itemCode": "Mã VT",
+                               "type": "Loại", "status": "Trạng thái", "quantity": "Số lượng"},
+                use_container_width=True, hide_index=True
+            )
+            if transfer[False][0] > 1000:
+                st.caption("Hiển thị 1.000 dòng đầu tiên.")
+
+# --- 6. NHẬP / XUẤT DỮ LIỆU ---
+@st.cache_data(show_spinner=False, max_entries=8)
+def export_file(revision, kind, fmt):
+    return export_bytes(get_store(), kind, fmt)
+
+@profiled()
+def render_data_io():
+    st.markdown('<div class="main-header">Nhập / Xuất dữ liệu</div>', unsafe_allow_html=True)
+    tab_import, tab_export = st.tabs(["📥 Nhập dữ liệu", "📤 Xuất dữ liệu"])
+
+    with tab_import:
+        kind = st.selectbox("Loại dữ liệu", list(KIND_LABELS), format_func=lambda k: KIND_LABELS[k], key="import_kind")
+        columns = ", ".join(f"`{c}`" for c in SCHEMAS[kind])
+        if kind == "stations":
+            st.caption(f"Các cột: {columns}. Trạm trùng `id` chỉ được cập nhật các cột có giá trị trong file, các cột khác giữ nguyên.")
+        else:
+            st.caption(f"Các cột: `stationCode` hoặc `stationId`, {columns}.")
+        uploaded = st.file_uploader("Chọn file CSV / Excel / Parquet", type=["csv", "xlsx", "parquet"])
+        replace = st.checkbox("Thay thế dữ liệu cũ của các trạm có trong file", disabled=kind == "stations")
+
+        if uploaded is not None and st.button("Nhập dữ liệu"):
+            status = st.empty()
+            try:
+                report = import_file(
+                    get_store(), uploaded, kind, detect_format(uploaded.name), replace=replace,
+                    progress=lambda r: status.caption(f"Đã xử lý {r['rows']:,} dòng, lỗi {r['errorCount']:,}...")
+                )
+            except (ValueError, ImportError) as e:
+                st.error(f"Không nhập được file: {e}")
+            else:
+                status.empty()
+                st.session_state['import_report'] = report
+
+        report = st.session_state.get('import_report')
+        if report:
+            c1, c2, c3, c4 = st.columns(4)
+            c1.metric("Số dòng", f"{report['rows']:,}")
+            c2.metric("Đã nhập", f"{report['imported']:,}")
+            c3.metric("Dòng lỗi", f"{report['errorCount']:,}")
+            c4.metric("Thời gian", f"{report['seconds']} s")
+            if report['errors']:
+                st.dataframe(pd.DataFrame(report['errors'][:1000]), use_container_width=True, hide_index=True)
+                st.download_button("Tải báo cáo lỗi (CSV)", error_report_csv(report),
+                                   file_name=f"loi_nhap_{report['kind']}.csv", mime="text/csv")
+
+    with tab_export:
+        c1, c2 = st.columns(2)
+        export_kind = c1.selectbox("Loại dữ liệu", list(KIND_LABELS), format_func=lambda k: KIND_LABELS[k], key="export_kind")
+        fmt = c2.selectbox("Định dạng", ["parquet", "csv"])
+        if st.button("Chuẩn bị file xuất"):
+            st.session_state['export_file'] = (export_kind, fmt, export_file(get_store().revision, export_kind, fmt))
+        prepared = st.session_state.get('export_file')
+        if prepared:
+            p_kind, p_fmt, data = prepared
+            st.download_button(f"Tải {KIND_LABELS[p_kind]} ({p_fmt}, {len(data) / 1024:,.0f} KB)", data,
+                               file_name=f"pmb_{p_kind}.{p_fmt}",
+                               mime="text/csv" if p_fmt == "csv" else "application/octet-stream")
+
+# --- 7. BẢN ĐỒ TRẠM ---
+MAP_COLORS = {"ACTIVE": [16, 185, 129], "PLANNED": [59, 130, 246], "OFFLINE": [239, 68, 68], "CLUSTER": [245, 158, 11]}
+
+def station_table(index, found, extra=None):
+    rows = []
+    for item in found:
+        code, name, status = index.label(item[0])
+        row = {"Mã trạm": code, "Tên trạm": name, "Trạng thái": status, "Khoảng cách (km)": round(item[1], 2)}
+        if extra:
+            row[extra] = round(item[2], 2)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+@profiled()
+def render_map():
+    import pydeck as pdk
+
+    st.markdown('<div class="main-header">Bản đồ trạm</div>', unsafe_allow_html=True)
+    index = spatial_index()
+    df = station_frame().df.dropna(subset=['lat', 'lng'])
+    if df.empty:
+        st.info("Chưa có trạm nào có tọa độ.")
+        return
+
+    # Tâm bản đồ: toàn mạng hoặc trung bình tọa độ của một tỉnh
+    centers = {"Toàn mạng": (df['lat'].mean(), df['lng'].mean(), 5)}
+    for province, grp in df.groupby('province', observed=True):
+        centers[province] = (grp['lat'].mean(), grp['lng'].mean(), 9)
+    c1, c2 = st.columns([3, 1])
+    center = c1.selectbox("Khu vực hiển thị", list(centers))
+    c_lat, c_lng, c_zoom = centers[center]
+    zoom = c2.slider("Mức zoom", 4, 14, c_zoom, key=f"map_zoom_{center}")
+
+    with st.expander("📍 Tìm trạm quanh điểm sự cố", expanded=True):
+        q1, q2, q3, q4, q5 = st.columns(5)
+        f_lat = q1.number_input("Vĩ độ", -90.0, 90.0, float(c_lat), format="%.5f", key=f"fault_lat_{center}")
+        f_lng = q2.number_input("Kinh độ", -180.0, 180.0, float(c_lng), format="%.5f", key=f"fault_lng_{center}")
+        radius = q3.number_input("Bán kính (km)", 1.0, 1000.0, 20.0)
+        top_n = q4.number_input("Số trạm gần nhất", 1, 50, 5)
+        min_spare = q5.number_input("CS dư tối thiểu (kW)", 0.0, 1000.0, 1.0)
+
+        nearest = index.nearest(f_lat, f_lng, int(top_n))
+        within = index.within(f_lat, f_lng, radius)
+        spare = index.nearest_with_spare(f_lat, f_lng, calc_engine(), min_spare, n=3)
+        t1, t2, t3 = st.tabs([f"Gần nhất ({len(nearest)})", f"Trong {radius:g} km ({len(within)})", "Còn dư công suất"])
+        with t1:
+            st.dataframe(station_table(index, nearest), use_container_width=True, hide_index=True)
+        with t2:
+            if within:
+                st.dataframe(station_table(index, within[:500]), use_container_width=True, hide_index=True)
+                if len(within) > 500:
+                    st.caption(f"Hiển thị 500/{len(within):,} trạm gần nhất.")
+            else:
+                st.info("Không có trạm nào trong bán kính này.")
+        with t3:
+            if spare:
+                st.dataframe(station_table(index, spare, "Công suất dư (kW)"), use_container_width=True, hide_index=True)
+            else:
+                st.info("Không tìm thấy trạm đã có bảng công suất còn dư đủ công suất.")
+
+    # Chỉ gửi điểm trong vùng nhìn; nhiều điểm thì gom cụm theo ô lưới tại máy chủ
+    points = index.clusters(viewport(c_lat, c_lng, zoom), zoom)
+    points['color'] = [MAP_COLORS.get(s, [107, 114, 128]) for s in points['status']]
+    points['radius'] = 6 + 4 * np.log2(points['count'])
+    highlight = pd.DataFrame(
+        [{"lat": f_lat, "lng": f_lng, "code": "Điểm sự cố", "color": [0, 0, 0]}]
+        + [{"lat": loc[0], "lng": loc[1], "code": index.label(sid)[0], "color": [124, 58, 237]}
+           for sid, loc in ((sid, index.location(sid)) for sid, _ in nearest) if loc is not None]
+    )
+    layers = [
+        pdk.Layer("ScatterplotLayer", points, get_position=["lng", "lat"], get_fill_color="color",
+                  get_radius="radius", radius_units="pixels", opacity=0.8, pickable=True),
+        pdk.Layer("TextLayer", points[points['count'] > 1], get_position=["lng", "lat"],
+                  get_text="count", get_size=12, get_color=[255, 255, 255]),
+        pdk.Layer("ScatterplotLayer", highlight, get_position=["lng", "lat"], get_fill_color="color",
+                  get_radius=5, radius_units="pixels", stroked=True, get_line_color=[255, 255, 255], pickable=True),
+    ]
+    st.pydeck_chart(pdk.Deck(
+        layers=layers, map_style=None,
+        initial_view_state=pdk.ViewState(latitude=c_lat, longitude=c_lng, zoom=zoom),
+        tooltip={"text": "{code} {name}"},
+    ))
+    clustered = (points['count'] > 1).any()
+    st.caption(f"{int(points['count'].sum()):,} trạm trong vùng nhìn"
+               + (f", gom thành {len(points):,} cụm." if clustered else "."))
+
+# --- 8. HIỆU NĂNG ---
+def render_profiler(run):
+    profiler = get_profiler()
+    # tracemalloc làm chậm mọi phiên: chỉ quản trị viên (PMB_PROFILE_MEMORY=1) được bật/tắt
+    if profiler.memory_allowed():
+        memory = st.checkbox("Đo cấp phát bộ nhớ (tracemalloc, chậm hơn)", value=profiler.memory_enabled(), key="profile_memory")
+        if memory != profiler.memory_enabled():
+            profiler.set_memory(memory)
     else:
-        st.info("Trạm này chưa có dữ liệu vật tư.")
+        st.caption("Đo cấp phát bộ nhớ: khởi động với `PMB_PROFILE_MEMORY=1`.")
+
+    # Lượt vừa chạy của phiên này, các đoạn con thụt vào theo độ sâu
+    if run is not None:
+        st.caption(f"Lượt vừa chạy: **{run.seconds * 1000:,.0f} ms**"
+                   + (f" · cấp phát {run.alloc_kb:,.0f} KB, đỉnh {run.peak_kb:,.0f} KB" if run.alloc_kb is not None else "")
+                   + (" · chạy song song với phiên khác, không tách được bộ nhớ" if run.overlapped and profiler.memory_enabled() else ""))
+        st.dataframe(
+            pd.DataFrame(
+                [("\u2003" * depth + name, seconds * 1000, alloc) for name, depth, _, seconds, alloc in run.spans],
+                columns=["span", "ms", "KB"],
+            ),
+            column_config={"ms": st.column_config.NumberColumn(format="%.1f"), "KB": st.column_config.NumberColumn(format="%.0f")},
+            use_container_width=True, hide_index=True,
+        )
+
+    runs = profiler.runs()
+    summary = pd.DataFrame(
+        [(page, s['runs'], s['p50'] * 1000, s['p95'] * 1000, s['max'] * 1000) for page, s in profiler.summary().items()],
+        columns=["Trang", "Lượt", "p50 ms", "p95 ms", "max ms"],
+    )
+    st.caption(f"{len(runs)} lượt gần nhất (mọi phiên)")
+    st.dataframe(summary.round(1), use_container_width=True, hide_index=True)
+    st.dataframe(
+        pd.DataFrame(
+            [(time.strftime('%H:%M:%S', time.localtime(r.started)), r.page, r.seconds * 1000, r.alloc_kb) for r in reversed(runs)],
+            columns=["Lúc", "Trang", "ms", "KB"],
+        ).round(1),
+        use_container_width=True, hide_index=True, height=200,
+    )
+    c1, c2 = st.columns(2)
+    c1.download_button("JSON lines", profiler.to_jsonl(), "pmb_profile.jsonl", "application/jsonl")
+    c2.download_button("Prometheus", profiler.prometheus_text(), "pmb_metrics.prom", "text/plain")
 
 # --- NAVIGATION ---
 with st.sidebar:
     st.title("PMB Manager")
-    menu = st.radio("Menu", ["Tổng quan", "Danh sách trạm", "Vật tư thiết bị", "Tính toán thiết kế", "Trợ lý AI"])
+    menu = st.radio("Menu", ["Tổng quan", "Danh sách trạm", "Vật tư thiết bị", "Tính toán thiết kế", "Trợ lý AI", "Bản đồ trạm", "Nhập/Xuất dữ liệu"])
     st.divider()
+    show_profile = st.toggle("⏱️ Hiệu năng từng lượt chạy", key="show_profile")
+    # Bảng hiệu năng được vẽ sau khi trang chạy xong để có cả lượt hiện tại
+    profile_panel = st.container()
     st.caption("Phiên bản Python v1.0")
 
-if menu == "Tổng quan":
-    render_dashboard()
-elif menu == "Danh sách trạm":
-    render_station_list()
-elif menu == "Tính toán thiết kế":
-    render_design_calculations()
-elif menu == "Vật tư thiết bị":
-    render_inventory()
-elif menu == "Trợ lý AI":
-    render_ai_assistant()
+# Lượt bị ngắt bởi st.rerun()/st.stop() vẫn được ghi lại
+try:
+    if menu == "Tổng quan":
+        render_dashboard()
+    elif menu == "Danh sách trạm":
+        render_station_list()
+    elif menu == "Tính toán thiết kế":
+        render_design_calculations()
+    elif menu == "Vật tư thiết bị":
+        render_inventory()
+    elif menu == "Trợ lý AI":
+        render_ai_assistant()
+    elif menu == "Bản đồ trạm":
+        render_map()
+    elif menu == "Nhập/Xuất dữ liệu":
+        render_data_io()
+finally:
+    run = get_profiler().end(menu)
+
+if show_profile:
+    with profile_panel:
+        render_profiler(run)
@@ -0,0 +1,322 @@
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from search import tokenize
+from views import IncrementalView
+
+# --- NGỮ CẢNH CHO TRỢ LÝ AI ---
+# Thay vì gửi toàn bộ dữ liệu, chỉ chọn các trạm được nhắc tới trong câu hỏi
+# (mã, tên, tỉnh, khu vực, trạng thái) kèm số liệu tổng hợp toàn mạng, rồi
+# tuần tự hóa gọn trong giới hạn token.
+
+DEFAULT_CONTEXT_TOKENS = int(os.getenv("PMB_AI_CONTEXT_TOKENS", "4000"))
+AI_BACKEND = os.getenv("PMB_AI_BACKEND", "gemini")   # "gemini" hoặc "fake" (chạy offline)
+AI_MODEL = os.getenv("PMB_AI_MODEL", "gemini-1.5-flash")
+AI_TIMEOUT = float(os.getenv("PMB_AI_TIMEOUT", "60"))
+MAX_PHRASE_WORDS = 4
+
+# Trọng số khi câu hỏi nhắc tới: mã trạm cụ thể nhất, khu vực chung nhất
+MENTION_WEIGHTS = {"code": 8, "name": 4, "province": 2, "status": 1, "region": 1}
+STATUS_ALIASES = {
+    "ACTIVE": ["active", "dang hoat dong", "hoat dong"],
+    "PLANNED": ["planned", "dang trien khai", "trien khai", "quy hoach"],
+    "OFFLINE": ["offline", "mat ket noi", "ngung hoat dong"],
+}
+STATUS_PHRASES = {alias for aliases in STATUS_ALIASES.values() for alias in aliases}
+SUMMARY_FIELDS = ['code', 'name', 'province', 'region', 'status', 'power', 'racks', 'buildingType', 'manager', 'buildYear']
+CALC_FIELDS = ['totalLoadW', 'dcLoadW', 'shortfallKW', 'rectifierModules', 'coolingBTU']
+MAX_INVENTORY_LINES = 20
+
+
+def estimate_tokens(text):
+    # Ước lượng thô, thiên về an toàn cho tiếng Việt có dấu
+    return len(text) // 3 + 1
+
+
+def compact_json(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def _phrase(text):
+    return " ".join(tokenize(text or ''))
+
+
+class ContextBuilder(IncrementalView):
+    def __init__(self):
+        super().__init__()
+        self._phrases = {}    # cụm từ đã chuẩn hóa -> {id trạm: trọng số}
+        self._stations = {}   # id trạm -> (thông tin tóm tắt, các cụm từ đã đăng ký)
+        self._snapshots = {}  # id trạm -> chuỗi JSON gọn, hủy khi trạm đổi
+
+    def _size(self):
+        return len(self._stations)
+
+    def _station_phrases(self, station):
+        phrases = {}
+        for field in ('code', 'name', 'province', 'region'):
+            phrase = _phrase(station.get(field))
+            if phrase:
+                phrases[phrase] = max(phrases.get(phrase, 0), MENTION_WEIGHTS[field])
+        for alias in STATUS_ALIASES.get(station.get('status'), []):
+            phrases.setdefault(alias, MENTION_WEIGHTS['status'])
+        return phrases
+
+    def _rebuild(self, stations):
+        self._phrases = {}
+        self._stations = {}
+        self._snapshots = {}
+        for station in stations:
+            self._upsert(station)
+
+    def _upsert(self, station):
+        station_id = station['id']
+        self._remove(station_id)
+        phrases = self._station_phrases(station)
+        for phrase, weight in phrases.items():
+            self._phrases.setdefault(phrase, {})[station_id] = weight
+        self._stations[station_id] = (station, phrases)
+
+    def _remove(self, station_id):
+        self._snapshots.pop(station_id, None)
+        entry = self._stations.pop(station_id, None)
+        if entry is None:
+            return
+        for phrase in entry[1]:
+            posting = self._phrases.get(phrase)
+            if posting is not None:
+                posting.pop(station_id, None)
+                if not posting:
+                    del self._phrases[phrase]
+
+    def mentions(self, question):
+        # Các trạm được nhắc tới, xếp theo mức độ cụ thể của cụm từ khớp
+        # Cụm dài khớp trước và "tiêu" các từ của nó: "ngung hoat dong" không còn khớp
+        # thêm "hoat dong" (ACTIVE). Bí danh trạng thái vẫn tiêu từ kể cả khi chưa trạm
+        # nào mang trạng thái đó.
+        words = tokenize(question)
+        used = [False] * len(words)
+        scores = {}
+        with self._lock:
+            for n in range(MAX_PHRASE_WORDS, 0, -1):
+                for i in range(len(words) - n + 1):
+                    if any(used[i:i + n]):
+                        continue
+                    phrase = " ".join(words[i:i + n])
+                    posting = self._phrases.get(phrase)
+                    if not posting and phrase not in STATUS_PHRASES:
+                        continue
+                    used[i:i + n] = [True] * n
+                    for station_id, weight in (posting or {}).items():
+                        scores[station_id] = scores.get(station_id, 0) + weight
+            codes = {sid: self._stations[sid][0].get('code') or '' for sid in scores}
+        return sorted(scores, key=lambda sid: (-scores[sid], codes[sid]))
+
+    def snapshot(self, store, engine, station_id):
+        # Bản tóm tắt gọn của một trạm, tính một lần cho mỗi phiên bản trạm
+        with self._lock:
+            cached = self._snapshots.get(station_id)
+        if cached is not None:
+            return cached
+        station = store.get(station_id)
+        if station is None:
+            return None
+        data = {k: station[k] for k in SUMMARY_FIELDS if station.get(k) not in (None, "")}
+        calc = engine.station(station_id) if engine is not None else None
+        if calc is not None:
+            data['calc'] = {k: round(float(calc[k]), 2) for k in CALC_FIELDS}
+        design = station.get('designData') or {}
+        counts = {k: len(design.get(k) or []) for k in ('racks', 'equipments', 'calcItems', 'costEstimateItems')}
+        data['design'] = {k: v for k, v in counts.items() if v}
+        cost_total = sum(
+            float(c.get('quantity') or 0) * float(c.get('unitPrice') or 0) for c in design.get('costEstimateItems') or []
+        )
+        if cost_total:
+            data['design']['costTotal'] = cost_total
+        inventory = station.get('inventory') or []
+        if inventory:
+            data['inventory'] = [
+                f"{i.get('itemCode') or ''} {i.get('itemName') or ''} x{i.get('quantity', '')}".strip()
+                for i in inventory[:MAX_INVENTORY_LINES]
+            ]
+            if len(inventory) > MAX_INVENTORY_LINES:
+                data['inventory'].append(f"... +{len(inventory) - MAX_INVENTORY_LINES} mục")
+        text = compact_json(data)
+        with self._lock:
+            self._snapshots[station_id] = text
+        return text
+
+    def build(self, question, store, aggregates, engine=None, budget_tokens=DEFAULT_CONTEXT_TOKENS):
+        # Trả về (chuỗi ngữ cảnh, số trạm đưa vào, số trạm liên quan bị lược bớt)
+        header = f"Tổng quan toàn mạng: {compact_json(aggregates)}."
+        used = estimate_tokens(header)
+        picked = []
+        matched = self.mentions(question)
+        for station_id in matched:
+            text = self.snapshot(store, engine, station_id)
+            if text is None:
+                continue
+            cost = estimate_tokens(text) + 1
+            if used + cost > budget_tokens:
+                break
+            picked.append(text)
+            used += cost
+        context = header
+        if picked:
+            context += f" Trạm liên quan: [{','.join(picked)}]."
+        omitted = len(matched) - len(picked)
+        if omitted > 0:
+            context += f" (Còn {omitted} trạm khớp khác không đưa vào do giới hạn ngữ cảnh.)"
+        return context, len(picked), omitted
+
+
+def fleet_aggregates(frame_aggregates, engine=None):
+    # Số liệu tổng hợp gửi kèm mọi câu hỏi (đã tính sẵn, không quét dữ liệu)
+    agg = {
+        "tongSoTram": frame_aggregates['total'],
+        "theoTrangThai": frame_aggregates['status_counts'],
+        "theoKhuVuc": frame_aggregates['region_counts'],
+        "tongCongSuatKW": round(float(frame_aggregates['total_power']), 2),
+    }
+    if engine is not None:
+        agg["soTramThieuCongSuat"] = len(engine.shortfalls())
+    return agg
+
+
+# --- BACKEND MÔ HÌNH ---
+# Backend chỉ cần hàm stream(parts, cancel) trả về từng đoạn văn bản;
+# `cancel` là threading.Event, backend nên dừng sớm khi nó được bật.
+class GeminiBackend:
+    # Mỗi backend có client riêng gắn với API key của nó. Không dùng genai.configure():
+    # khóa đó là toàn cục, các backend lưu theo từng key sẽ dùng chung key cấu hình sau cùng
+    def __init__(self, api_key, model_name=AI_MODEL, timeout=AI_TIMEOUT):
+        from google.ai import generativelanguage as glm
+        self._glm = glm
+        self.name = f"gemini:{model_name}"
+        self.timeout = timeout
+        self._model = model_name if model_name.startswith("models/") else f"models/{model_name}"
+        self._client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+
+    def _request(self, parts):
+        glm = self._glm
+        content = glm.Content(role="user", parts=[glm.Part(text=str(part)) for part in parts])
+        return glm.GenerateContentRequest(model=self._model, contents=[content])
+
+    def stream(self, parts, cancel):
+        response = self._client.stream_generate_content(self._request(parts), timeout=self.timeout)
+        for chunk in response:
+            if cancel.is_set():
+                break
+            text = "".join(part.text for candidate in chunk.candidates[:1] for part in candidate.content.parts)
+            if text:
+                yield text
+
+
+class FakeBackend:
+    # Trả lời giả lập để chạy thử/benchmark toàn bộ luồng mà không cần mạng
+    def __init__(self, chunk_delay=0.0, words_per_chunk=3):
+        self.name = "fake"
+        self.chunk_delay = chunk_delay
+        self.words_per_chunk = words_per_chunk
+        self.calls = 0
+
+    def stream(self, parts, cancel):
+        self.calls += 1
+        context, prompt = parts[0], parts[-1]
+        words = (f"[Mô phỏng] Câu hỏi: {prompt}. Ngữ cảnh nhận được khoảng "
+                 f"{estimate_tokens(context)} token.").split()
+        for i in range(0, len(words), self.words_per_chunk):
+            if cancel.is_set():
+                break
+            if self.chunk_delay:
+                time.sleep(self.chunk_delay)
+            yield " ".join(words[i:i + self.words_per_chunk]) + " "
+
+
+def make_backend(name=AI_BACKEND, api_key=None):
+    if name == "fake":
+        return FakeBackend()
+    return GeminiBackend(api_key)
+
+
+# --- GỌI MÔ HÌNH: LUỒNG, HẾT GIỜ, HỦY, BỘ NHỚ ĐỆM ---
+_DONE = object()
+
+
+class AssistantService:
+    def __init__(self, backend, timeout=AI_TIMEOUT, cache_size=128, max_workers=4):
+        self.backend = backend
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pmb-ai")
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def _key(self, context, prompt, revision):
+        # Cùng câu hỏi trên cùng phiên bản dữ liệu (và cùng ngữ cảnh) -> cùng câu trả lời
+        return (self.backend.name, prompt.strip(), revision, context)
+
+    def cached(self, context, prompt, revision):
+        with self._lock:
+            key = self._key(context, prompt, revision)
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        return None
+
+    def _remember(self, key, text):
+        with self._lock:
+            self._cache[key] = text
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def _produce(self, parts, chunks, cancel):
+        try:
+            for text in self.backend.stream(parts, cancel):
+                if cancel.is_set():
+                    return
+                chunks.put(text)
+        except Exception as e:
+            chunks.put(e)
+        finally:
+            chunks.put(_DONE)
+
+    def ask(self, context, prompt, revision):
+        # Sinh từng đoạn câu trả lời. Mô hình chạy trên executor; quá `timeout`
+        # giây thì báo TimeoutError, còn khi người dùng rời trang (generator bị
+        # đóng) thì yêu cầu backend dừng.
+        cached = self.cached(context, prompt, revision)
+        if cached is not None:
+            yield cached
+            return
+        key = self._key(context, prompt, revision)
+        chunks = queue.Queue()
+        cancel = threading.Event()
+        self._executor.submit(self._produce, [context, prompt], chunks, cancel)
+        deadline = time.monotonic() + self.timeout
+        parts = []
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Mô hình không phản hồi sau {self.timeout:g} giây")
+                try:
+                    item = chunks.get(timeout=remaining)
+                except queue.Empty:
+                    continue
+                if item is _DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                parts.append(item)
+                yield item
+        finally:
+            cancel.set()
+        self._remember(key, "".join(parts))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
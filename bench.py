@@ -0,0 +1,268 @@
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows: không đo được bộ nhớ đỉnh của tiến trình
+    resource = None
+
+# --- BENCHMARK KHÔNG GIAO DIỆN ---
+# Chạy app.py bằng Streamlit AppTest trên kho giả lập N trạm, đo thời gian và bộ nhớ
+# đỉnh (RSS cao nhất của tiến trình tính đến hết bước) của từng trang và các nút đồng
+# bộ, rồi so với baseline đã lưu. Không dùng tracemalloc vì nó làm chậm mỗi lượt
+# chạy nhiều lần và bỏ sót bộ nhớ của SQLite.
+# Mỗi cỡ N chạy trong một tiến trình riêng để cache_resource/bộ nhớ không lẫn nhau.
+#
+#   python bench.py                          # 100, 10k, 100k trạm, so với bench_baseline.json
+#   python bench.py --sizes 100 10000        # chỉ các cỡ được chọn
+#   python bench.py --update-baseline        # ghi kết quả lần này làm baseline mới
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(ROOT, "app.py")
+BASELINE_PATH = os.path.join(ROOT, "bench_baseline.json")
+OUTPUT_PATH = os.path.join(ROOT, "bench_output.txt")
+DEFAULT_SIZES = [100, 10_000, 100_000]
+RESULT_MARK = "BENCH_RESULT "
+
+PAGES = [
+    ("dashboard", "Tổng quan"),
+    ("station_list", "Danh sách trạm"),
+    ("design", "Tính toán thiết kế"),
+    ("inventory", "Vật tư thiết bị"),
+]
+SYNC_BUTTONS = [
+    ("sync_calc_to_cost", "🔄 Đồng bộ từ Bảng Công suất / Rack"),
+    ("sync_cost_to_inventory", "➡️ Đồng bộ sang 'Vật tư thiết bị'"),
+    ("sync_bulk", "Chạy đồng bộ hàng loạt"),
+]
+
+# Mục tiêu tuyệt đối cho các lượt chạy lại khi view đã dựng (không phụ thuộc baseline);
+# lượt mở đầu tiên gồm cả dựng chỉ mục một lần cho tiến trình nên không đặt mục tiêu
+TARGETS = {
+    "dashboard.rerun": 1.0,
+    "station_list.rerun": 0.5,
+    "design.rerun": 0.5,
+    "inventory.rerun": 0.5,
+}
+# Số span chậm nhất (theo profiling.py) ghi kèm mỗi bước, in ra khi bước chậm hơn ngưỡng
+TOP_SPANS = 3
+SLOW_STEP_SECONDS = 0.5
+
+# Chênh lệch tuyệt đối tối thiểu để tính là chậm/tốn bộ nhớ hơn (tránh nhiễu ở bước rất nhanh)
+MIN_SECONDS_DELTA = 0.05
+MIN_MB_DELTA = 2.0
+
+
+# --- ĐO TRONG TIẾN TRÌNH CON ---
+def peak_rss_mb():
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux báo KB, macOS báo byte
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def _slowest_spans(profile_log, offset):
+    # Các span có thời gian riêng lớn nhất trong những lượt chạy app ghi vào PMB_PROFILE_LOG kể từ offset
+    if not profile_log or not os.path.exists(profile_log):
+        return []
+    with open(profile_log, "rb") as f:
+        f.seek(offset)
+        runs = [json.loads(line) for line in f if line.strip()]
+    totals = {}
+    for run in runs:
+        # Thời gian riêng của mỗi span = thời gian của nó trừ các span con trực tiếp
+        # (span cha luôn đứng trước các span con trong danh sách)
+        spans = run["spans"]
+        own = [span["seconds"] for span in spans]
+        stack = []
+        for i, span in enumerate(spans):
+            while stack and spans[stack[-1]]["depth"] >= span["depth"]:
+                stack.pop()
+            if stack:
+                own[stack[-1]] -= span["seconds"]
+            stack.append(i)
+        for span, seconds in zip(spans, own):
+            totals[span["name"]] = totals.get(span["name"], 0.0) + seconds
+    ranked = sorted(((n, s) for n, s in totals.items() if s >= 0.001), key=lambda x: -x[1])
+    return [[name, round(seconds, 4)] for name, seconds in ranked[:TOP_SPANS]]
+
+
+class Recorder:
+    def __init__(self, profile_log=None):
+        self.steps = {}
+        self.profile_log = profile_log
+
+    def measure(self, name, fn):
+        offset = os.path.getsize(self.profile_log) if self.profile_log and os.path.exists(self.profile_log) else 0
+        start = time.perf_counter()
+        result = fn()
+        seconds = time.perf_counter() - start
+        self.steps[name] = {"seconds": round(seconds, 4), "peak_mb": round(peak_rss_mb(), 1),
+                            "spans": _slowest_spans(self.profile_log, offset)}
+        return result
+
+
+def _button(at, label):
+    for button in at.button:
+        if button.label == label:
+            return button
+    raise LookupError(f"Không tìm thấy nút '{label}'")
+
+
+def _check(at, step):
+    if at.exception:
+        raise RuntimeError(f"{step}: {at.exception[0].value}")
+
+
+def run_worker(size, template_path, work_path, seed):
+    # store.DB_PATH và profiling đọc biến môi trường lúc import
+    os.environ["PMB_DB_PATH"] = work_path
+    profile_log = os.path.splitext(work_path)[0] + ".profile.jsonl"
+    os.environ["PMB_PROFILE_LOG"] = profile_log
+    if os.path.exists(profile_log):
+        os.remove(profile_log)
+    sys.path.insert(0, ROOT)
+    from store import StationStore
+    from synthetic import populate
+
+    # Kho mẫu được sinh một lần (có thể giữ lại qua --db-dir); mỗi lượt chạy trên bản
+    # sao để các nút đồng bộ luôn bắt đầu từ cùng một dữ liệu
+    recorder = Recorder(profile_log)
+    template = StationStore(template_path)
+    if template.count() != size:
+        recorder.measure("populate", lambda: populate(template, size, seed))
+    with sqlite3.connect(template_path) as src, sqlite3.connect(work_path) as dst:
+        src.backup(dst)
+    template.close()
+
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=3600)
+    # Lượt đầu: dựng kho, các view dùng chung và trang Tổng quan
+    recorder.measure("cold_start", at.run)
+    _check(at, "cold_start")
+    if at.metric[0].value != str(size):
+        raise RuntimeError(f"App đang đọc kho khác: {at.metric[0].value} trạm thay vì {size}")
+    for name, label in PAGES:
+        at.sidebar.radio[0].set_value(label)
+        recorder.measure(f"{name}.open", at.run)
+        _check(at, name)
+        recorder.measure(f"{name}.rerun", at.run)
+        _check(at, name)
+
+    # Các nút đồng bộ trên trang thiết kế (trạm đầu tiên; đồng bộ hàng loạt chọn toàn mạng)
+    at.sidebar.radio[0].set_value("Tính toán thiết kế")
+    at.run()
+    at.checkbox(key="bulk_all").check()
+    for name, label in SYNC_BUTTONS:
+        _button(at, label).click()
+        recorder.measure(name, at.run)
+        _check(at, name)
+
+    return {"size": size, "steps": recorder.steps}
+
+
+# --- ĐIỀU PHỐI VÀ SO SÁNH ---
+def run_size(size, db_dir, work_dir, seed):
+    template_path = os.path.join(db_dir, f"bench_{size}_{seed}.db")
+    work_path = os.path.join(work_dir, f"run_{size}.db")
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--worker", str(size), "--db", template_path,
+         "--work-db", work_path, "--seed", str(seed)],
+        capture_output=True, text=True, cwd=ROOT,
+    )
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith(RESULT_MARK):
+            return json.loads(line[len(RESULT_MARK):])
+    raise RuntimeError(f"Benchmark {size} trạm lỗi (mã {proc.returncode}):\n{proc.stderr[-4000:]}")
+
+
+def compare(results, baseline, tolerance, mem_tolerance):
+    # Trả về (các dòng báo cáo, danh sách bước bị chậm/tốn bộ nhớ hơn baseline)
+    lines, regressions = [], []
+    for size, result in results.items():
+        base_steps = baseline.get("sizes", {}).get(size, {}).get("steps", {})
+        lines.append(f"== {int(size):,} trạm ==")
+        lines.append(f"{'bước':<28}{'giây':>10}{'baseline':>10}{'MB đỉnh':>10}{'baseline':>10}  ")
+        for step, value in result["steps"].items():
+            base = base_steps.get(step)
+            flags = []
+            if base:
+                if value["seconds"] > base["seconds"] * tolerance and value["seconds"] - base["seconds"] > MIN_SECONDS_DELTA:
+                    flags.append("CHẬM HƠN")
+                if value["peak_mb"] > base["peak_mb"] * mem_tolerance and value["peak_mb"] - base["peak_mb"] > MIN_MB_DELTA:
+                    flags.append("TỐN BỘ NHỚ HƠN")
+            target = TARGETS.get(step)
+            if target is not None and value["seconds"] > target:
+                flags.append(f"VƯỢT MỤC TIÊU {target:g}s")
+            if flags:
+                regressions.append(f"{size}/{step}: {', '.join(flags)}")
+            lines.append(
+                f"{step:<28}{value['seconds']:>10.3f}{(base['seconds'] if base else float('nan')):>10.3f}"
+                f"{value['peak_mb']:>10.1f}{(base['peak_mb'] if base else float('nan')):>10.1f}  {' '.join(flags)}"
+            )
+            # Bước chậm: ghi kèm các đoạn tốn thời gian nhất để biết cần xem ở đâu
+            if value.get("spans") and (flags or value["seconds"] >= SLOW_STEP_SECONDS):
+                lines.append("    ↳ " + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in value["spans"]))
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark app.py không giao diện trên dữ liệu giả lập")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--db-dir", default=None, help="Giữ kho giả lập ở đây để lần sau khỏi sinh lại")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="Cho phép chậm hơn baseline bao nhiêu lần")
+    parser.add_argument("--mem-tolerance", type=float, default=1.3)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    parser.add_argument("--work-db", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker is not None:
+        print(RESULT_MARK + json.dumps(run_worker(args.worker, args.db, args.work_db, args.seed)))
+        return 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_dir = args.db_dir or tmp
+        os.makedirs(db_dir, exist_ok=True)
+        results = {}
+        for size in args.sizes:
+            print(f"Đang chạy {size:,} trạm...", flush=True)
+            results[str(size)] = run_size(size, db_dir, tmp, args.seed)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    lines, regressions = compare(results, baseline, args.tolerance, args.mem_tolerance)
+    if regressions:
+        lines += ["", "Kém hơn baseline:"] + [f"  - {r}" for r in regressions]
+    report = "\n".join(lines)
+    print(report)
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.write(report + "\n")
+
+    if args.update_baseline:
+        baseline.setdefault("sizes", {}).update(results)
+        baseline["seed"] = args.seed
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"Đã cập nhật baseline: {args.baseline}")
+        return 0
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
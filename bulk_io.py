@@ -0,0 +1,333 @@
+import io
+import json
+import os
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+# --- NHẬP / XUẤT DỮ LIỆU HÀNG LOẠT ---
+# File được đọc theo từng khối (CSV/Excel/Parquet), mỗi khối kiểm tra theo lược
+# đồ bằng phép toán trên cột rồi ghi vào kho trong một giao dịch; không giữ cả
+# file trong bộ nhớ. Lỗi được ghi lại theo từng dòng.
+
+DEFAULT_CHUNK_ROWS = 20000
+MAX_ERRORS = 10000
+
+# Lược đồ: trường -> (kiểu, bắt buộc). Kiểu là "str", "int", "float", "bool"
+# hoặc danh sách giá trị hợp lệ.
+STATION_SCHEMA = {
+    "id": ("str", True), "code": ("str", True), "name": ("str", False), "region": ("str", False),
+    "status": (["ACTIVE", "PLANNED", "OFFLINE"], False), "province": ("str", False),
+    "buildYear": ("str", False), "power": ("float", False), "racks": ("int", False),
+    "manager": ("str", False), "branchManager": ("str", False), "buildingType": ("str", False),
+    "category": ("str", False), "lat": ("float", False), "lng": ("float", False),
+}
+CALC_ITEM_SCHEMA = {
+    "name": ("str", True), "model": ("str", False), "quantity": ("int", False),
+    "powerRatedW": ("float", False), "voltage": ("float", False), "current": ("float", False),
+    "wireSection": ("str", False), "wireType": ("str", False), "note": ("str", False),
+    "type": (["DC", "AC", "PASSIVE"], False),
+}
+COST_ITEM_SCHEMA = {
+    "category": (["MAIN", "AUX"], True), "itemCode": ("str", False), "itemName": ("str", True),
+    "unit": ("str", False), "quantity": ("int", False), "unitPrice": ("float", False),
+    "condition": (["Mới", "Sử dụng lại"], False), "note": ("str", False),
+}
+INVENTORY_SCHEMA = {
+    "id": ("str", False), "itemCode": ("str", False), "itemName": ("str", True),
+    "quantity": ("float", False), "ratedPower": ("float", False), "type": ("str", False),
+    "unit": ("str", False), "location1": ("str", False), "status": ("str", False),
+    "note": ("str", False), "isTransferred": ("bool", False),
+}
+
+SCHEMAS = {
+    "stations": STATION_SCHEMA,
+    "calcItems": CALC_ITEM_SCHEMA,
+    "costEstimateItems": COST_ITEM_SCHEMA,
+    "inventory": INVENTORY_SCHEMA,
+}
+KIND_LABELS = {
+    "stations": "Trạm",
+    "calcItems": "Bảng công suất (calcItems)",
+    "costEstimateItems": "Dự toán (costEstimateItems)",
+    "inventory": "Vật tư thiết bị (inventory)",
+}
+# Dòng con tham chiếu trạm qua một trong hai cột này
+STATION_REF_COLUMNS = ["stationCode", "stationId"]
+
+TRUE_VALUES = {"true", "1", "yes", "y", "x", "có", "co"}
+FALSE_VALUES = {"false", "0", "no", "n", "không", "khong"}
+
+
+# --- ĐỌC FILE THEO KHỐI ---
+def detect_format(filename):
+    ext = os.path.splitext(filename.lower())[1]
+    if ext in (".csv", ".txt"):
+        return "csv"
+    if ext in (".xlsx", ".xlsm"):
+        return "excel"
+    if ext in (".parquet", ".pq"):
+        return "parquet"
+    raise ValueError(f"Định dạng file không hỗ trợ: {ext or filename}")
+
+
+def iter_chunks(source, fmt, chunksize=DEFAULT_CHUNK_ROWS):
+    if fmt == "csv":
+        yield from pd.read_csv(source, dtype=str, chunksize=chunksize, keep_default_na=False, encoding="utf-8-sig")
+    elif fmt == "parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    elif fmt == "excel":
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ImportError("Cần cài openpyxl để nhập file Excel (pip install openpyxl)")
+        workbook = load_workbook(source, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(h).strip() if h is not None else "" for h in next(rows, [])]
+            buffer = []
+            for row in rows:
+                buffer.append(row)
+                if len(buffer) >= chunksize:
+                    yield pd.DataFrame(buffer, columns=header)
+                    buffer = []
+            if buffer:
+                yield pd.DataFrame(buffer, columns=header)
+        finally:
+            workbook.close()
+    else:
+        raise ValueError(f"Định dạng file không hỗ trợ: {fmt}")
+
+
+# --- KIỂM TRA THEO LƯỢC ĐỒ ---
+def validate_chunk(df, schema, first_row=1):
+    # Trả về ({trường: (mảng giá trị, mảng có dữ liệu)}, mảng dòng hợp lệ, danh sách lỗi).
+    # first_row: số thứ tự (tính từ 1) của dòng dữ liệu đầu tiên trong khối.
+    n = len(df)
+    ok = np.ones(n, dtype=bool)
+    errors = []
+    values = {}
+
+    def fail(mask, field, message):
+        for i in np.flatnonzero(mask):
+            errors.append({"row": first_row + int(i), "field": field, "error": message})
+        ok[mask] = False
+
+    for field, (kind, required) in schema.items():
+        if field in df.columns:
+            raw = df[field].astype("string").str.strip()
+        else:
+            raw = pd.Series(pd.NA, index=df.index, dtype="string")
+        present = (raw.notna() & (raw != "")).to_numpy(dtype=bool)
+        if required:
+            fail(~present, field, "Thiếu giá trị bắt buộc")
+        if kind in ("int", "float"):
+            parsed = pd.to_numeric(raw.where(present), errors="coerce").to_numpy(dtype=float)
+            bad = present & np.isnan(parsed)
+            fail(bad, field, "Không phải số")
+            if kind == "int":
+                fail(present & ~bad & (np.mod(parsed, 1) != 0), field, "Phải là số nguyên")
+            values[field] = (parsed, present)
+        elif kind == "bool":
+            lowered = raw.str.lower()
+            is_true = lowered.isin(TRUE_VALUES).to_numpy(dtype=bool)
+            is_false = lowered.isin(FALSE_VALUES).to_numpy(dtype=bool)
+            fail(present & ~is_true & ~is_false, field, "Giá trị đúng/sai không hợp lệ")
+            values[field] = (is_true, present)
+        elif isinstance(kind, list):
+            fail(present & ~raw.isin(kind).to_numpy(dtype=bool), field, f"Phải là một trong {', '.join(kind)}")
+            values[field] = (raw.to_numpy(dtype=object), present)
+        else:
+            values[field] = (raw.to_numpy(dtype=object), present)
+    return values, ok, errors
+
+
+def _records(values, schema, rows):
+    # Ghép dict cho các dòng hợp lệ, bỏ trường trống như dữ liệu gốc trong app
+    records = []
+    for i in rows:
+        record = {}
+        for field, (kind, _) in schema.items():
+            column, present = values[field]
+            if not present[i]:
+                continue
+            value = column[i]
+            if kind == "int":
+                value = int(value)
+            elif kind == "float":
+                value = float(value)
+                value = int(value) if value.is_integer() and field == "quantity" else value
+            elif kind == "bool":
+                value = bool(value)
+            record[field] = value
+        records.append(record)
+    return records
+
+
+# --- NHẬP VÀO KHO ---
+def _station_record(record):
+    lat, lng = record.pop("lat", None), record.pop("lng", None)
+    if lat is not None and lng is not None:
+        record["coordinates"] = {"lat": lat, "lng": lng}
+    return record
+
+
+def _inventory_record(record):
+    record.setdefault("id", f"imp_{uuid.uuid4().hex[:12]}")
+    record["transfer"] = {"isTransferred": record.pop("isTransferred", False)}
+    return record
+
+
+def _resolve_stations(store, df, ok, errors, first_row):
+    # Cột stationCode/stationId -> id trạm trong kho; dòng không khớp bị ghi lỗi
+    station_ids = [None] * len(df)
+    if "stationId" in df.columns:
+        raw = df["stationId"].astype("string").str.strip().fillna("").tolist()
+        known = store.existing_ids({v for v in raw if v})
+        station_ids = [v if v in known else None for v in raw]
+    if "stationCode" in df.columns:
+        raw = df["stationCode"].astype("string").str.strip().fillna("").tolist()
+        by_code = store.ids_by_code({v for v in raw if v})
+        station_ids = [sid if sid is not None else by_code.get(code) for sid, code in zip(station_ids, raw)]
+    missing = np.asarray([v is None for v in station_ids], dtype=bool) & ok
+    for i in np.flatnonzero(missing):
+        errors.append({"row": first_row + int(i), "field": "/".join(STATION_REF_COLUMNS), "error": "Không tìm thấy trạm"})
+    ok &= ~missing
+    return station_ids
+
+
+def _write_children(store, kind, items_by_station, replace):
+    if kind == "inventory":
+        store.append_inventory(items_by_station, replace)
+    else:
+        store.append_design_items(kind, items_by_station, replace)
+
+
+def import_file(store, source, kind, fmt, chunksize=DEFAULT_CHUNK_ROWS, replace=False, progress=None):
+    # replace=True: dòng con thay thế dữ liệu cũ của các trạm có trong file
+    schema = SCHEMAS[kind]
+    started = time.perf_counter()
+    report = {"kind": kind, "rows": 0, "imported": 0, "errorCount": 0, "errors": []}
+    replaced = set()
+    first_row = 1
+    for chunk in iter_chunks(source, fmt, chunksize):
+        chunk = chunk.rename(columns=lambda c: str(c).strip())
+        values, ok, errors = validate_chunk(chunk, schema, first_row)
+        if kind == "stations":
+            records = [_station_record(r) for r in _records(values, schema, np.flatnonzero(ok))]
+            if records:
+                # Chỉ ghi các cột có trong file, không xóa dữ liệu trạm đang có
+                store.merge_stations(records)
+        else:
+            if not any(c in chunk.columns for c in STATION_REF_COLUMNS):
+                raise ValueError("File cần cột stationCode hoặc stationId để gắn dòng với trạm")
+            station_ids = _resolve_stations(store, chunk, ok, errors, first_row)
+            rows = np.flatnonzero(ok)
+            records = _records(values, schema, rows)
+            if kind == "inventory":
+                records = [_inventory_record(r) for r in records]
+            fresh, existing = {}, {}
+            for i, record in zip(rows, records):
+                station_id = station_ids[i]
+                target = fresh if replace and station_id not in replaced else existing
+                target.setdefault(station_id, []).append(record)
+            replaced.update(fresh)
+            if fresh:
+                _write_children(store, kind, fresh, replace=True)
+            if existing:
+                _write_children(store, kind, existing, replace=False)
+        report["rows"] += len(chunk)
+        report["imported"] += len(records)
+        report["errorCount"] += len(errors)
+        room = MAX_ERRORS - len(report["errors"])
+        if room > 0:
+            report["errors"].extend(sorted(errors, key=lambda e: e["row"])[:room])
+        first_row += len(chunk)
+        if progress is not None:
+            progress(report)
+    report["seconds"] = round(time.perf_counter() - started, 2)
+    return report
+
+
+def error_report_csv(report):
+    return pd.DataFrame(report["errors"], columns=["row", "field", "error"]).to_csv(index=False).encode("utf-8-sig")
+
+
+# --- XUẤT DỮ LIỆU ---
+def _export_columns(kind):
+    refs = [] if kind == "stations" else ["stationCode", "stationId"]
+    return refs + list(SCHEMAS[kind])
+
+
+def _typed_frame(rows, kind):
+    df = pd.DataFrame(rows, columns=_export_columns(kind))
+    for field, (field_kind, _) in SCHEMAS[kind].items():
+        if field_kind in ("int", "float"):
+            df[field] = pd.to_numeric(df[field], errors="coerce").astype("float64")
+        elif field_kind == "bool":
+            df[field] = df[field].astype("boolean")
+        else:
+            df[field] = df[field].astype("string")
+    for ref in ("stationCode", "stationId"):
+        if ref in df.columns:
+            df[ref] = df[ref].astype("string")
+    return df
+
+
+def iter_export_frames(store, kind, batch_size=DEFAULT_CHUNK_ROWS):
+    if kind == "stations":
+        rows = []
+        for station in store.list_stations():
+            coords = station.get("coordinates") or {}
+            rows.append({**station, "lat": coords.get("lat"), "lng": coords.get("lng")})
+            if len(rows) >= batch_size:
+                yield _typed_frame(rows, kind)
+                rows = []
+        if rows:
+            yield _typed_frame(rows, kind)
+    elif kind == "inventory":
+        for batch in store.iter_inventory_rows(batch_size):
+            rows = []
+            for code, station_id, payload in batch:
+                item = json.loads(payload)
+                item["isTransferred"] = bool((item.get("transfer") or {}).get("isTransferred"))
+                rows.append({**item, "stationCode": code, "stationId": station_id})
+            yield _typed_frame(rows, kind)
+    else:
+        rows = []
+        for batch in store.iter_design_rows(kind):
+            for code, station_id, payload in batch:
+                for item in json.loads(payload) or []:
+                    rows.append({**item, "stationCode": code, "stationId": station_id})
+            if len(rows) >= batch_size:
+                yield _typed_frame(rows, kind)
+                rows = []
+        if rows:
+            yield _typed_frame(rows, kind)
+
+
+def export_bytes(store, kind, fmt):
+    # Ghi từng khối vào bộ đệm: Parquet qua ParquetWriter, CSV nối tiếp sau dòng tiêu đề
+    buffer = io.BytesIO()
+    if fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        empty = _typed_frame([], kind)
+        schema = pa.Schema.from_pandas(empty, preserve_index=False)
+        with pq.ParquetWriter(buffer, schema) as writer:
+            for frame in iter_export_frames(store, kind):
+                writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+    elif fmt == "csv":
+        text = io.StringIO()
+        text.write("\ufeff")
+        _typed_frame([], kind).to_csv(text, index=False)
+        for frame in iter_export_frames(store, kind):
+            frame.to_csv(text, index=False, header=False)
+        buffer.write(text.getvalue().encode("utf-8"))
+    else:
+        raise ValueError(f"Định dạng xuất không hỗ trợ: {fmt}")
+    return buffer.getvalue()
@@ -0,0 +1,276 @@
+import numpy as np
+import pandas as pd
+
+from views import IncrementalView
+
+# --- ĐỘNG CƠ TÍNH TOÁN THIẾT KẾ (VECTOR HÓA) ---
+# Gom calcItems của nhiều trạm thành mảng phẳng rồi tính một lượt bằng NumPy:
+# tổng tải, dòng điện từng thiết bị, số module chỉnh lưu và tải lạnh phòng máy.
+
+DESIGN_SECTIONS = ['calcItems', 'equipments', 'rectParams', 'roomParams', 'batteryParams']
+
+DEFAULT_VOLTAGE = 48.0          # Điện áp hệ thống DC (V)
+DEFAULT_MODULE_SIZE = 3000.0    # Công suất 1 module chỉnh lưu (W)
+CHARGE_RATE = 0.1               # Dòng nạp ắc quy 0.1C
+ENVELOPE_U = 1.0                # Hệ số truyền nhiệt vỏ phòng/container (W/m2.K)
+W_TO_BTU = 3.412
+DEFAULT_BACKUP_TIME = 4.0       # Thời gian backup mặc định (h)
+DEFAULT_EFFICIENCY = 0.9
+
+# Dung lượng 1 tổ ắc quy 48V (Ah) và đơn giá tham khảo (VNĐ/tổ)
+BATTERY_CAPACITIES = [50, 100, 150, 200]
+BATTERY_STRING_PRICES = {50: 18_000_000, 100: 32_000_000, 150: 46_000_000, 200: 58_000_000}
+
+RESULT_COLUMNS = [
+    'totalLoadW', 'dcLoadW', 'acLoadW', 'dcCurrentA', 'acCurrentA', 'rectifierLoadW', 'rectifierModules',
+    'equipmentHeatW', 'envelopeHeatW', 'coolingLoadW', 'coolingBTU', 'ratedPowerKW', 'shortfallKW',
+    'batteryLoadW', 'backupTimeH', 'batteryVoltage', 'batteryEfficiency', 'batteryAh',
+]
+
+
+def _num(values):
+    return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').fillna(0).to_numpy(dtype=float)
+
+
+def item_currents(power_w, voltage):
+    # I = P / U cho từng dòng, 0 nếu chưa nhập điện áp
+    power_w = _num(power_w)
+    voltage = _num(voltage)
+    safe_voltage = np.where(voltage > 0, voltage, 1.0)
+    return np.where(voltage > 0, np.round(power_w / safe_voltage, 2), 0.0)
+
+
+def compute_designs(stations):
+    # stations: danh sách dict có 'id', 'power' (kW danh định) và 'designData'
+    n = len(stations)
+    ids = [s['id'] for s in stations]
+    if n == 0:
+        return pd.DataFrame(columns=RESULT_COLUMNS, index=pd.Index([], name='id'))
+
+    # Làm phẳng calcItems / thiết bị trong rack
+    item_idx, qty, power, volt, kind = [], [], [], [], []
+    eq_idx, eq_power, eq_kind = [], [], []
+    module_size, batt_ah, sys_voltage, rated = [], [], [], []
+    batt_load, backup_time, efficiency, string_ah = [], [], [], []
+    room = {k: [] for k in ('width', 'length', 'height', 'tempInside', 'tempOutside', 'equipmentHeatW')}
+    for i, station in enumerate(stations):
+        design = station.get('designData') or {}
+        for item in design.get('calcItems') or []:
+            item_idx.append(i)
+            qty.append(item.get('quantity'))
+            power.append(item.get('powerRatedW'))
+            volt.append(item.get('voltage'))
+            kind.append(item.get('type') or 'DC')
+        for eq in design.get('equipments') or []:
+            eq_idx.append(i)
+            eq_power.append(eq.get('powerW'))
+            eq_kind.append(eq.get('type') or 'DC')
+        rect = design.get('rectParams') or {}
+        batt = design.get('batteryParams') or {}
+        module_size.append(rect.get('rectifierModuleSize') or DEFAULT_MODULE_SIZE)
+        batt_ah.append(rect.get('batteryAh') or batt.get('batteryAh') or 0)
+        sys_voltage.append(batt.get('batteryVoltage') or DEFAULT_VOLTAGE)
+        batt_load.append(batt.get('dcLoadW'))
+        backup_time.append(batt.get('targetBackupTime') or DEFAULT_BACKUP_TIME)
+        efficiency.append(batt.get('efficiency') or DEFAULT_EFFICIENCY)
+        string_ah.append(batt.get('batteryAh'))
+        room_params = design.get('roomParams') or {}
+        for key in room:
+            room[key].append(room_params.get(key))
+        rated.append(station.get('power'))
+
+    item_idx = np.asarray(item_idx, dtype=np.intp)
+    qty, power, volt = _num(qty), _num(power), _num(volt)
+    is_dc = np.asarray([k == 'DC' for k in kind], dtype=bool)
+    load = qty * power
+    current = qty * item_currents(power, volt)
+
+    total_load = np.bincount(item_idx, weights=load, minlength=n)
+    dc_load = np.bincount(item_idx, weights=load * is_dc, minlength=n)
+    # Dòng DC (48V) và AC (220V) tính riêng: cộng chung hai loại không có ý nghĩa
+    dc_current = np.bincount(item_idx, weights=current * is_dc, minlength=n)
+    ac_current = np.bincount(item_idx, weights=current * ~is_dc, minlength=n)
+
+    # Trạm chưa lập bảng công suất: lấy tải từ thiết bị đã bố trí trong rack
+    eq_idx = np.asarray(eq_idx, dtype=np.intp)
+    eq_power = _num(eq_power)
+    eq_dc = np.asarray([k == 'DC' for k in eq_kind], dtype=bool)
+    eq_total = np.bincount(eq_idx, weights=eq_power, minlength=n)
+    eq_dc_load = np.bincount(eq_idx, weights=eq_power * eq_dc, minlength=n)
+    no_items = np.bincount(item_idx, minlength=n) == 0
+    total_load = np.where(no_items, eq_total, total_load)
+    dc_load = np.where(no_items, eq_dc_load, dc_load)
+
+    # Chỉnh lưu: tải DC + dòng nạp ắc quy, dự phòng N+1
+    sys_voltage = _num(sys_voltage)
+    module_size = _num(module_size)
+    rect_load = dc_load + sys_voltage * CHARGE_RATE * _num(batt_ah)
+    safe_module = np.where(module_size > 0, module_size, DEFAULT_MODULE_SIZE)
+    modules = np.where(rect_load > 0, np.ceil(rect_load / safe_module) + 1, 0)
+
+    # Tải lạnh: nhiệt thiết bị + nhiệt truyền qua vỏ (tường + mái)
+    width, length, height = _num(room['width']), _num(room['length']), _num(room['height'])
+    delta_t = np.clip(_num(room['tempOutside']) - _num(room['tempInside']), 0, None)
+    envelope_area = 2 * (width + length) * height + width * length
+    envelope_heat = ENVELOPE_U * envelope_area * delta_t
+    equipment_heat = _num(room['equipmentHeatW'])
+    equipment_heat = np.where(equipment_heat > 0, equipment_heat, total_load)
+    cooling = equipment_heat + envelope_heat
+
+    # Tải cho ắc quy: lấy theo cấu hình ắc quy đã lưu, nếu trống thì dùng tải DC tính được
+    batt_load = _num(batt_load)
+    batt_load = np.where(batt_load > 0, batt_load, dc_load)
+
+    rated_kw = _num(rated)
+    return pd.DataFrame({
+        'totalLoadW': total_load,
+        'dcLoadW': dc_load,
+        'acLoadW': total_load - dc_load,
+        'dcCurrentA': np.round(dc_current, 2),
+        'acCurrentA': np.round(ac_current, 2),
+        'rectifierLoadW': rect_load,
+        'rectifierModules': modules.astype(int),
+        'equipmentHeatW': equipment_heat,
+        'envelopeHeatW': np.round(envelope_heat, 1),
+        'coolingLoadW': np.round(cooling, 1),
+        'coolingBTU': np.round(cooling * W_TO_BTU),
+        'ratedPowerKW': rated_kw,
+        'shortfallKW': np.round(total_load / 1000 - rated_kw, 3),
+        'batteryLoadW': batt_load,
+        'backupTimeH': _num(backup_time),
+        'batteryVoltage': sys_voltage,
+        'batteryEfficiency': _num(efficiency),
+        'batteryAh': _num(string_ah),
+    }, index=pd.Index(ids, name='id'))
+
+
+def spare_kw(results):
+    # Công suất còn dư (kW) = danh định - tổng tải. NaN nếu trạm chưa khai công suất
+    # danh định hoặc chưa có bảng công suất (tổng tải 0 không có nghĩa là còn dư hết)
+    known = (results['ratedPowerKW'] > 0) & (results['totalLoadW'] > 0)
+    return (-results['shortfallKW']).where(known)
+
+
+# --- ĐỊNH CỠ ẮC QUY THEO LÔ ---
+def required_ah(dc_load_w, backup_time_h, voltage=DEFAULT_VOLTAGE, efficiency=DEFAULT_EFFICIENCY):
+    # Công thức: Ah = (P * t) / (V * eff), áp dụng theo từng phần tử
+    dc_load_w = np.asarray(dc_load_w, dtype=float)
+    backup_time_h = np.asarray(backup_time_h, dtype=float)
+    denom = np.asarray(voltage, dtype=float) * np.asarray(efficiency, dtype=float)
+    denom = np.where(denom > 0, denom, DEFAULT_VOLTAGE * DEFAULT_EFFICIENCY)
+    return dc_load_w * backup_time_h / denom
+
+
+def battery_sweep(dc_loads, backup_times, capacities=BATTERY_CAPACITIES, voltage=DEFAULT_VOLTAGE,
+                  efficiency=DEFAULT_EFFICIENCY, prices=BATTERY_STRING_PRICES):
+    # Lưới tải (n) x thời gian backup (t) x dung lượng tổ (c) trong một phép tính
+    # broadcast. voltage/efficiency có thể là số hoặc mảng theo tải (n).
+    dc_loads = np.asarray(dc_loads, dtype=float)
+    backup_times = np.asarray(backup_times, dtype=float)
+    capacities = np.asarray(capacities, dtype=float)
+    voltage = np.broadcast_to(np.asarray(voltage, dtype=float), dc_loads.shape)
+    efficiency = np.broadcast_to(np.asarray(efficiency, dtype=float), dc_loads.shape)
+
+    ah = required_ah(dc_loads[:, None], backup_times[None, :], voltage[:, None], efficiency[:, None])
+    strings = np.ceil(ah[:, :, None] / capacities[None, None, :])
+    cost = strings * np.asarray([prices.get(int(c), np.inf) for c in capacities])[None, None, :]
+    # Chọn dung lượng rẻ nhất; bằng giá thì ưu tiên ít tổ hơn
+    best = np.lexsort((strings, cost), axis=-1)[..., 0]
+    pick = lambda arr: np.take_along_axis(arr, best[..., None], axis=-1)[..., 0]
+    return {
+        "requiredAh": ah,
+        "strings": strings,
+        "cost": cost,
+        "bestCapacity": capacities[best],
+        "bestStrings": pick(strings),
+        "bestCost": pick(cost),
+    }
+
+
+def fleet_battery_plan(results, backup_time=None, capacities=BATTERY_CAPACITIES, prices=BATTERY_STRING_PRICES):
+    # Khuyến nghị ắc quy cho mọi trạm từ kết quả DesignCalcEngine.
+    # backup_time=None: dùng thời gian backup mục tiêu đã lưu của từng trạm.
+    loads = results['batteryLoadW'].to_numpy(dtype=float)
+    if backup_time is None:
+        # Mỗi trạm một mục tiêu -> tính theo từng nhóm thời gian backup
+        times = results['backupTimeH'].to_numpy(dtype=float)
+        unique_times, time_idx = np.unique(times, return_inverse=True)
+    else:
+        unique_times, time_idx = np.asarray([backup_time], dtype=float), np.zeros(len(results), dtype=np.intp)
+    sweep = battery_sweep(
+        loads, unique_times, capacities,
+        voltage=results['batteryVoltage'].to_numpy(dtype=float),
+        efficiency=results['batteryEfficiency'].to_numpy(dtype=float),
+        prices=prices,
+    )
+    rows = np.arange(len(results))
+    return pd.DataFrame({
+        'dcLoadW': loads,
+        'backupTimeH': unique_times[time_idx] if len(results) else [],
+        'requiredAh': np.round(sweep['requiredAh'][rows, time_idx], 2),
+        'bestCapacityAh': sweep['bestCapacity'][rows, time_idx].astype(int),
+        'strings': sweep['bestStrings'][rows, time_idx].astype(int),
+        'cost': sweep['bestCost'][rows, time_idx],
+    }, index=results.index)
+
+
+class DesignCalcEngine(IncrementalView):
+    # Kết quả được giữ theo trạm; khi kho đổi chỉ tính lại các trạm có phiên bản mới
+    def __init__(self):
+        super().__init__()
+        self._results = compute_designs([])
+
+    def _attach_design(self, store, stations, station_ids=None):
+        designs = store.design_sections(DESIGN_SECTIONS, station_ids)
+        for station in stations:
+            station['designData'] = designs.get(station['id'], {})
+        return stations
+
+    def _load_all(self, store):
+        return self._attach_design(store, store.list_stations())
+
+    def _load(self, store, station_ids):
+        return self._attach_design(store, store.get_summaries(station_ids), station_ids)
+
+    def _size(self):
+        return len(self._results)
+
+    def _rebuild(self, stations):
+        self._results = compute_designs(stations)
+
+    def refresh(self, store):
+        # Gom các trạm đổi để tính lại trong một lượt vector hóa
+        with self._lock:
+            self._pending = []
+            super().refresh(store)
+            if self._pending:
+                patch = compute_designs(self._pending)
+                rest = self._results.drop(index=patch.index, errors='ignore')
+                self._results = pd.concat([rest, patch]) if len(rest) else patch
+                self._pending = []
+        return self
+
+    def _upsert(self, station):
+        self._pending.append(station)
+
+    def _remove(self, station_id):
+        self._results = self._results.drop(index=station_id, errors='ignore')
+
+    def results(self):
+        with self._lock:
+            return self._results
+
+    def station(self, station_id):
+        with self._lock:
+            if station_id in self._results.index:
+                # Một dòng .loc gộp mọi cột về float: trả số module về int để hiển thị
+                row = self._results.loc[station_id].astype(object)
+                row['rectifierModules'] = int(row['rectifierModules'])
+                return row
+        return None
+
+    def shortfalls(self):
+        # Trạm có tổng tải vượt công suất danh định, thiếu nhiều nhất lên đầu
+        with self._lock:
+            df = self._results
+            return df[(df['ratedPowerKW'] > 0) & (df['shortfallKW'] > 0)].sort_values('shortfallKW', ascending=False)
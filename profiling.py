@@ -0,0 +1,262 @@
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+# --- ĐO THỜI GIAN TỪNG LƯỢT CHẠY LẠI ---
+# Mỗi lượt Streamlit chạy lại script là một "run"; các đoạn được bọc bằng span()
+# (render_*, dựng biểu đồ, data_editor, gọi AI...) ghi thời gian và, khi bật
+# tracemalloc, lượng bộ nhớ cấp phát thêm. Run hiện tại nằm trong thread-local vì
+# mỗi phiên Streamlit chạy trên một thread riêng.
+
+PROFILE_HISTORY = int(os.getenv("PMB_PROFILE_HISTORY", "50"))
+PROFILE_LOG = os.getenv("PMB_PROFILE_LOG")          # file JSON lines, mỗi lượt một dòng
+METRICS_FILE = os.getenv("PMB_METRICS_FILE")        # textfile cho Prometheus node_exporter
+# tracemalloc áp dụng cho cả tiến trình và làm chậm mọi phiên nhiều lần, nên chỉ bật
+# (và chỉ cho phép bật/tắt trên giao diện) khi người quản trị đặt PMB_PROFILE_MEMORY=1
+PROFILE_MEMORY = os.getenv("PMB_PROFILE_MEMORY") == "1"
+RERUN_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+log = logging.getLogger(__name__)
+
+_local = threading.local()
+# Các run đang chạy (mọi phiên), theo thread: bộ nhớ đo bằng tracemalloc là số toàn
+# cục nên run chạy chồng lên run khác không có số cấp phát riêng
+_active = {}
+_active_lock = threading.Lock()
+
+
+class Run:
+    def __init__(self):
+        self.started = time.time()
+        self.page = None
+        self.seconds = None
+        self.alloc_kb = None
+        self.peak_kb = None
+        self.spans = []      # (tên, độ sâu, bắt đầu sau (s), thời gian (s), cấp phát (KB) hoặc None)
+        self.overlapped = False
+        self._t0 = time.perf_counter()
+        self._depth = 0
+        self._mem0 = None
+
+    def to_dict(self):
+        return {
+            "ts": round(self.started, 3),
+            "page": self.page,
+            "seconds": round(self.seconds, 6),
+            "overlapped": self.overlapped,
+            "allocKB": self.alloc_kb,
+            "peakKB": self.peak_kb,
+            "spans": [
+                {"name": name, "depth": depth, "start": round(start, 6), "seconds": round(seconds, 6), "allocKB": alloc}
+                for name, depth, start, seconds, alloc in self.spans
+            ],
+        }
+
+
+def current_run():
+    return getattr(_local, "run", None)
+
+
+@contextmanager
+def span(name):
+    # Không có run đang mở (vd. gọi từ thread nền) thì không ghi gì
+    run = current_run()
+    if run is None:
+        yield
+        return
+    tracing = tracemalloc.is_tracing()
+    mem0 = tracemalloc.get_traced_memory()[0] if tracing else None
+    start = time.perf_counter()
+    index = len(run.spans)
+    run.spans.append(None)   # giữ chỗ để span cha đứng trước span con
+    run._depth += 1
+    try:
+        yield
+    finally:
+        run._depth -= 1
+        seconds = time.perf_counter() - start
+        alloc = round((tracemalloc.get_traced_memory()[0] - mem0) / 1024, 1) if tracing and mem0 is not None else None
+        run.spans[index] = (name, run._depth, start - run._t0, seconds, alloc)
+
+
+def profiled(name=None):
+    # Decorator: bọc cả hàm trong một span
+    def decorate(fn):
+        label = name or fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _quantile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Profiler:
+    # Lưu N lượt gần nhất (cho bảng điều khiển) và histogram cộng dồn từ lúc khởi động
+    # (cho Prometheus); dùng chung cho mọi phiên trong tiến trình
+    def __init__(self, history=PROFILE_HISTORY, log_path=PROFILE_LOG, metrics_path=METRICS_FILE,
+                 memory=PROFILE_MEMORY, buckets=RERUN_BUCKETS):
+        self.log_path = log_path
+        self.metrics_path = metrics_path
+        self.buckets = list(buckets)
+        self._runs = deque(maxlen=history)
+        self._histograms = {}   # trang -> [đếm theo bucket..., tổng giây, số lượt]
+        self._spans = {}        # tên span -> [tổng giây, số lần]
+        # RLock: _export giữ khóa và gọi prometheus_text (cũng lấy khóa)
+        self._lock = threading.RLock()
+        if memory:
+            self.set_memory(True)
+
+    @staticmethod
+    def memory_allowed():
+        return PROFILE_MEMORY
+
+    @staticmethod
+    def set_memory(enabled):
+        # Chỉ người quản trị (PMB_PROFILE_MEMORY=1) mới được bật tracemalloc
+        if enabled and not PROFILE_MEMORY:
+            raise PermissionError("Đo cấp phát bộ nhớ cần PMB_PROFILE_MEMORY=1")
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not enabled and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @staticmethod
+    def memory_enabled():
+        return tracemalloc.is_tracing()
+
+    def begin(self):
+        run = _local.run = Run()
+        thread = threading.current_thread()
+        with _active_lock:
+            # Bỏ run bị ngắt trước khi kịp end() (thread đã kết thúc hoặc bắt đầu run mới)
+            for other_thread in [t for t in _active if t is thread or not t.is_alive()]:
+                del _active[other_thread]
+            if _active:
+                run.overlapped = True
+                for other in _active.values():
+                    other.overlapped = True
+            elif tracemalloc.is_tracing():
+                # Đỉnh bộ nhớ là số toàn cục: chỉ đặt lại khi không run nào khác đang chạy
+                tracemalloc.reset_peak()
+            _active[thread] = run
+        if tracemalloc.is_tracing():
+            run._mem0 = tracemalloc.get_traced_memory()[0]
+        return run
+
+    def end(self, page):
+        run = current_run()
+        if run is None:
+            return None
+        _local.run = None
+        with _active_lock:
+            if _active.get(threading.current_thread()) is run:
+                del _active[threading.current_thread()]
+        run.page = page
+        run.seconds = time.perf_counter() - run._t0
+        run.spans = [s for s in run.spans if s is not None]
+        if run.overlapped:
+            # Cấp phát đo được lẫn của run khác: không báo để khỏi gây hiểu nhầm
+            run.spans = [(name, depth, start, seconds, None) for name, depth, start, seconds, _ in run.spans]
+        elif run._mem0 is not None and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            run.alloc_kb = round((current - run._mem0) / 1024, 1)
+            run.peak_kb = round(peak / 1024, 1)
+        with self._lock:
+            self._runs.append(run)
+            hist = self._histograms.setdefault(page, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if run.seconds <= bound:
+                    hist[i] += 1
+            hist[-2] += run.seconds
+            hist[-1] += 1
+            for name, _, _, seconds, _ in run.spans:
+                total = self._spans.setdefault(name, [0.0, 0])
+                total[0] += seconds
+                total[1] += 1
+        # Lỗi ghi file đo (đầy đĩa, sai quyền...) chỉ ghi log, không làm hỏng trang
+        try:
+            self._export(run)
+        except OSError:
+            log.exception("Không ghi được số liệu hiệu năng")
+        return run
+
+    def _export(self, run):
+        # Các phiên chạy trên nhiều thread: ghi tuần tự dưới khóa
+        with self._lock:
+            if self.log_path:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(run.to_dict(), ensure_ascii=False) + "\n")
+            if self.metrics_path:
+                # Ghi ra file tạm riêng cho mỗi lần rồi đổi tên để node_exporter không đọc
+                # phải file dở dang
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.metrics_path)), suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "w", encoding="utf-8") as f:
+                        f.write(self.prometheus_text())
+                    os.replace(tmp, self.metrics_path)
+                except BaseException:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+                    raise
+
+    def runs(self):
+        with self._lock:
+            return list(self._runs)
+
+    def summary(self):
+        # {trang: {"runs", "p50", "p95", "max"}} trên N lượt gần nhất
+        by_page = {}
+        for run in self.runs():
+            by_page.setdefault(run.page, []).append(run.seconds)
+        return {
+            page: {"runs": len(v), "p50": _quantile(v, 0.5), "p95": _quantile(v, 0.95), "max": max(v)}
+            for page, v in by_page.items()
+        }
+
+    def to_jsonl(self):
+        return "".join(json.dumps(run.to_dict(), ensure_ascii=False) + "\n" for run in self.runs())
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP pmb_rerun_seconds Thoi gian moi luot chay lai script Streamlit",
+            "# TYPE pmb_rerun_seconds histogram",
+        ]
+        with self._lock:
+            histograms = {page: list(h) for page, h in self._histograms.items()}
+            spans = {name: list(v) for name, v in self._spans.items()}
+        for page, hist in sorted(histograms.items(), key=lambda x: str(x[0])):
+            page = _label(page)
+            for bound, count in zip(self.buckets, hist):
+                lines.append(f'pmb_rerun_seconds_bucket{{page="{page}",le="{bound:g}"}} {count}')
+            lines.append(f'pmb_rerun_seconds_bucket{{page="{page}",le="+Inf"}} {hist[-1]}')
+            lines.append(f'pmb_rerun_seconds_sum{{page="{page}"}} {hist[-2]:.6f}')
+            lines.append(f'pmb_rerun_seconds_count{{page="{page}"}} {hist[-1]}')
+        lines += [
+            "# HELP pmb_span_seconds Tong thoi gian theo tung doan duoc do",
+            "# TYPE pmb_span_seconds summary",
+        ]
+        for name, (total, count) in sorted(spans.items()):
+            lines.append(f'pmb_span_seconds_sum{{span="{_label(name)}"}} {total:.6f}')
+            lines.append(f'pmb_span_seconds_count{{span="{_label(name)}"}} {count}')
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,261 @@
+import bisect
+
+import numpy as np
+import pandas as pd
+
+from calc import spare_kw
+from views import IncrementalView
+
+# --- BỐ TRÍ RACK ---
+# Mỗi rack giữ một bitmap (số nguyên Python, bit u-1 bật khi U thứ u đã có thiết bị).
+# Thiết bị chiếm từ startU lên startU + uHeight - 1; kiểm tra chồng lấn, tràn rack
+# và tìm chỗ trống đều là phép toán bit, không duyệt từng U.
+
+DEFAULT_TOTAL_U = 42
+RACK_SECTIONS = ['racks', 'equipments']
+
+
+def _int(value, default=None):
+    if type(value) is int:
+        return value
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return default
+    if number != number or not number.is_integer():
+        return default
+    return int(number)
+
+
+def _mask(start_u, height):
+    return ((1 << height) - 1) << (start_u - 1)
+
+
+def _tightest(runs, height):
+    # (số U thừa, startU) của đoạn trống vừa khít nhất, hòa thì lấy đoạn thấp hơn
+    fits = [(length - height, start) for start, length in runs if length >= height]
+    return min(fits) if fits else None
+
+
+class RackOccupancy:
+    def __init__(self, total_u=DEFAULT_TOTAL_U):
+        self.total_u = total_u
+        self.bits = 0
+
+    def overlaps(self, start_u, height):
+        return bool(self.bits & _mask(start_u, height))
+
+    def fits(self, start_u, height):
+        return start_u >= 1 and height >= 1 and start_u + height - 1 <= self.total_u
+
+    def occupy(self, start_u, height):
+        self.bits |= _mask(start_u, height)
+
+    def release(self, start_u, height):
+        self.bits &= ~_mask(start_u, height)
+
+    @property
+    def used_u(self):
+        return bin(self.bits & ((1 << self.total_u) - 1)).count("1")
+
+    def free_runs(self):
+        # Các đoạn U trống liên tiếp [(startU, số U)], từ dưới lên
+        runs = []
+        free = ~self.bits & ((1 << self.total_u) - 1)
+        while free:
+            start = (free & -free).bit_length()          # bit trống thấp nhất (1-based)
+            shifted = free >> (start - 1)
+            length = ((shifted + 1) & ~shifted).bit_length() - 1   # số bit 1 liên tiếp từ đó
+            runs.append((start, length))
+            free &= ~_mask(start, length)
+        return runs
+
+    def largest_free(self):
+        return max((length for _, length in self.free_runs()), default=0)
+
+    def first_fit(self, height):
+        # Vị trí thấp nhất còn đủ chỗ, None nếu không có
+        for start, length in self.free_runs():
+            if length >= height:
+                return start
+        return None
+
+    def best_fit(self, height):
+        # Đoạn trống vừa khít nhất (ít U thừa nhất)
+        fit = _tightest(self.free_runs(), height)
+        return None if fit is None else fit[1]
+
+
+def rack_layout(design_data):
+    # Trả về ({id rack: RackOccupancy}, danh sách lỗi bố trí)
+    racks = {}
+    names = {}
+    for rack in design_data.get('racks') or []:
+        racks[rack.get('id')] = RackOccupancy(_int(rack.get('totalU'), DEFAULT_TOTAL_U))
+        names[rack.get('id')] = rack.get('name') or rack.get('id')
+    issues = []
+    owners = {}   # id rack -> [(mask, tên thiết bị)] để chỉ ra thiết bị bị chồng lấn
+    for eq in design_data.get('equipments') or []:
+        label = eq.get('name') or eq.get('id') or '?'
+        rack_id = eq.get('rackId')
+        occupancy = racks.get(rack_id)
+        if occupancy is None:
+            issues.append({"type": "unknown_rack", "equipment": label, "rackId": rack_id,
+                           "message": f"{label}: không tìm thấy rack '{rack_id}'"})
+            continue
+        start_u, height = _int(eq.get('startU')), _int(eq.get('uHeight'), 1)
+        if start_u is None or height is None or not occupancy.fits(start_u, height):
+            issues.append({"type": "out_of_bounds", "equipment": label, "rackId": rack_id,
+                           "message": f"{label}: vị trí U{eq.get('startU')} cao {eq.get('uHeight')}U nằm ngoài rack {names[rack_id]} ({occupancy.total_u}U)"})
+            continue
+        mask = _mask(start_u, height)
+        if occupancy.bits & mask:
+            others = [name for other, name in owners.get(rack_id, []) if other & mask]
+            issues.append({"type": "overlap", "equipment": label, "rackId": rack_id,
+                           "message": f"{label}: U{start_u}-U{start_u + height - 1} chồng lấn với {', '.join(others)} trong {names[rack_id]}"})
+        occupancy.occupy(start_u, height)
+        owners.setdefault(rack_id, []).append((mask, label))
+    return racks, issues
+
+
+def rack_summary(design_data):
+    racks, issues = rack_layout(design_data)
+    names = {r.get('id'): r.get('name') or r.get('id') for r in design_data.get('racks') or []}
+    rows = []
+    for rack_id, occupancy in racks.items():
+        runs = occupancy.free_runs()
+        rows.append({
+            "rackId": rack_id,
+            "name": names[rack_id],
+            "totalU": occupancy.total_u,
+            "usedU": occupancy.used_u,
+            "freeU": occupancy.total_u - occupancy.used_u,
+            "largestFreeU": max((length for _, length in runs), default=0),
+            "freeRanges": ", ".join(f"U{s}-U{s + n - 1}" for s, n in runs),
+        })
+    return pd.DataFrame(rows, columns=["rackId", "name", "totalU", "usedU", "freeU", "largestFreeU", "freeRanges"]), issues
+
+
+def place_equipment(design_data, height, strategy="best"):
+    # (id rack, startU) cho thiết bị mới cao `height` U, None nếu trạm hết chỗ
+    racks, _ = rack_layout(design_data)
+    best = None
+    for rack_id, occupancy in racks.items():
+        if strategy == "first":
+            start = occupancy.first_fit(height)
+            if start is not None:
+                return rack_id, start
+            continue
+        fit = _tightest(occupancy.free_runs(), height)
+        if fit is not None and (best is None or fit[0] < best[0]):
+            best = (fit[0], rack_id, fit[1])
+    return None if best is None else best[1:]
+
+
+# --- CHỈ MỤC U TRỐNG TOÀN MẠNG ---
+class RackIndex(IncrementalView):
+    # Mỗi trạm một mục (đoạn U trống liên tiếp dài nhất trong các rack, id trạm) trong
+    # danh sách đã sắp xếp: tìm trạm còn >= h U liên tiếp là một lần tìm nhị phân
+    def __init__(self):
+        super().__init__()
+        self._entries = []    # [(U trống liên tiếp dài nhất, id trạm)] đã sắp xếp
+        self._stations = {}   # id trạm -> (mã, tên, mục của trạm, {id rack: (tên, các đoạn U trống)})
+        self._issues = {}     # id trạm -> số lỗi bố trí
+        self._arrays = None   # (U trống, id trạm) dạng mảng, dựng lại khi có thay đổi
+
+    def _attach_design(self, store, stations, station_ids=None):
+        designs = store.design_sections(RACK_SECTIONS, station_ids)
+        for station in stations:
+            station['designData'] = designs.get(station['id'], {})
+        return stations
+
+    def _load_all(self, store):
+        return self._attach_design(store, store.list_stations())
+
+    def _load(self, store, station_ids):
+        return self._attach_design(store, store.get_summaries(station_ids), station_ids)
+
+    def _size(self):
+        return len(self._stations)
+
+    def _rebuild(self, stations):
+        self._entries = []
+        self._stations = {}
+        self._issues = {}
+        self._arrays = None
+        for station in stations:
+            self._entries.append(self._add(station))
+        self._entries.sort()
+
+    def _add(self, station):
+        station_id = station['id']
+        design = station.get('designData') or {}
+        racks, issues = rack_layout(design)
+        names = {r.get('id'): r.get('name') or r.get('id') for r in design.get('racks') or []}
+        rack_runs = {}
+        largest = 0
+        for rack_id, occupancy in racks.items():
+            runs = occupancy.free_runs()
+            rack_runs[rack_id] = (names[rack_id], runs)
+            largest = max([largest] + [n for _, n in runs])
+        entry = (largest, station_id)
+        self._stations[station_id] = (station.get('code') or '', station.get('name') or '', entry, rack_runs)
+        self._issues[station_id] = len(issues)
+        return entry
+
+    def _upsert(self, station):
+        self._remove(station['id'])
+        bisect.insort(self._entries, self._add(station))
+
+    def _remove(self, station_id):
+        self._arrays = None
+        station = self._stations.pop(station_id, None)
+        self._issues.pop(station_id, None)
+        if station is None:
+            return
+        i = bisect.bisect_left(self._entries, station[2])
+        if i < len(self._entries) and self._entries[i] == station[2]:
+            del self._entries[i]
+
+    def stations_with_issues(self):
+        with self._lock:
+            return {sid: n for sid, n in self._issues.items() if n}
+
+    def _sorted_arrays(self):
+        if self._arrays is None:
+            self._arrays = (
+                np.array([free for free, _ in self._entries], dtype=np.int64),
+                np.array([sid for _, sid in self._entries], dtype=object),
+            )
+        return self._arrays
+
+    def candidates(self, height, power_w=0.0, engine=None, limit=None):
+        # Trạm còn rack trống >= height U liên tiếp và (nếu có engine) còn dư >= power_w.
+        # Trạm có chỗ trống vừa khít nhất (ít U thừa nhất) lên trước; trả về (bảng tối đa
+        # `limit` dòng, tổng số trạm đáp ứng). Chỉ dòng được trả về mới tính vị trí lắp.
+        # Công suất dư đọc trước (khóa của engine); phần còn lại trong một lần giữ khóa để
+        # refresh chen giữa không làm lệch id với self._stations
+        spare_by_id = spare_kw(engine.results()) if engine is not None else None
+        rows = []
+        with self._lock:
+            free, ids = self._sorted_arrays()
+            ids = ids[np.searchsorted(free, height):]
+            spare = None
+            if spare_by_id is not None:
+                spare = spare_by_id.reindex(ids).to_numpy(dtype=float)
+                keep = spare >= power_w / 1000
+                ids, spare = ids[keep], spare[keep]
+            total = len(ids)
+            if limit:
+                ids, spare = ids[:limit], None if spare is None else spare[:limit]
+            for station_id in ids:
+                code, name, entry, rack_runs = self._stations[station_id]
+                slack, start, rack_name = min(
+                    _tightest(runs, height) + (rack_name,)
+                    for rack_name, runs in rack_runs.values() if any(n >= height for _, n in runs)
+                )
+                rows.append((station_id, code, name, rack_name, start, entry[0]))
+        rows = pd.DataFrame(rows, columns=['id', 'code', 'name', 'rack', 'startU', 'largestFreeU']).set_index('id')
+        if spare is not None:
+            rows['spareKW'] = spare
+        return rows, total
@@ -0,0 +1,228 @@
+import bisect
+import heapq
+import re
+import unicodedata
+from collections import OrderedDict
+
+from views import IncrementalView
+
+# --- CHỈ MỤC TÌM KIẾM TRẠM ---
+# Từ khóa được chuẩn hóa (chữ thường, bỏ dấu tiếng Việt) rồi tra theo tiền tố
+# trên từ điển đã sắp xếp; không dùng regex nên ký tự như "(" không gây lỗi.
+
+# Trọng số theo trường: khớp mã trạm quan trọng hơn khớp tên vật tư
+FIELD_WEIGHTS = {"code": 8, "name": 5, "province": 3, "manager": 2, "inventory": 1}
+EXACT_BONUS = 2
+RESULT_CACHE_SIZE = 256
+SCORE_CACHE_SIZE = 16     # bảng điểm đủ cả tập khớp (có thể cả mạng) nên giữ ít hơn
+CANDIDATE_SCAN_LIMIT = 2000
+# Từ khóa 1-2 ký tự không mở rộng tiền tố trên cả từ điển (mã trạm được đánh mọi hậu
+# tố nên "h" ra hàng chục nghìn token): đứng một mình thì chỉ khớp nguyên từ; đi kèm
+# từ khóa dài hơn ("lao c") thì khớp tiền tố trên tối đa SHORT_TERM_SCAN_LIMIT trạm đã
+# lọc, nhiều hơn thì cũng chỉ khớp nguyên từ.
+SHORT_TERM_CHARS = 2
+SHORT_TERM_SCAN_LIMIT = 5000
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def fold(text):
+    text = unicodedata.normalize("NFD", str(text).lower()).replace("đ", "d")
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(fold(text))
+
+
+def _station_tokens(station):
+    tokens = {}
+
+    def add(token, weight):
+        if weight > tokens.get(token, 0):
+            tokens[token] = weight
+
+    code = station.get('code')
+    if code:
+        # Mọi hậu tố của mã trạm, để "002" hay "hw002" cũng tìm ra "QNHW002"
+        for token in tokenize(code):
+            for i in range(len(token)):
+                add(token[i:], FIELD_WEIGHTS['code'] if i == 0 else FIELD_WEIGHTS['code'] // 2)
+    for field in ('name', 'province', 'manager'):
+        for token in tokenize(station.get(field) or ''):
+            add(token, FIELD_WEIGHTS[field])
+    for item_name in station.get('inventoryNames', []):
+        for token in tokenize(item_name):
+            add(token, FIELD_WEIGHTS['inventory'])
+    return tokens
+
+
+class SearchIndex(IncrementalView):
+    def __init__(self):
+        super().__init__()
+        self._vocab = []      # các token đã sắp xếp, tra tiền tố bằng bisect
+        self._postings = {}   # token -> {id trạm: trọng số}
+        self._docs = {}       # id trạm -> {token: trọng số}, dùng khi gỡ trạm
+        self._labels = {}     # id trạm -> (mã, tên) đã chuẩn hóa, cộng điểm khớp nguyên cụm
+        # Mỗi lần rerun Streamlit lặp lại cùng từ khóa -> nhớ kết quả đến khi chỉ mục đổi
+        self._results = OrderedDict()
+        self._scored = OrderedDict()
+
+    def _load_all(self, store):
+        stations = store.list_stations()
+        names = store.inventory_names()
+        for station in stations:
+            station['inventoryNames'] = names.get(station['id'], [])
+        return stations
+
+    def _load(self, store, station_ids):
+        stations = store.get_summaries(station_ids)
+        names = store.inventory_names(station_ids)
+        for station in stations:
+            station['inventoryNames'] = names.get(station['id'], [])
+        return stations
+
+    def _size(self):
+        return len(self._docs)
+
+    def _rebuild(self, stations):
+        self._results.clear()
+        self._scored.clear()
+        self._postings = {}
+        self._docs = {}
+        self._labels = {}
+        for station in stations:
+            self._index(station)
+        self._vocab = sorted(self._postings)
+
+    def _index(self, station):
+        station_id = station['id']
+        tokens = _station_tokens(station)
+        self._docs[station_id] = tokens
+        self._labels[station_id] = (" ".join(tokenize(station.get('code') or '')), " ".join(tokenize(station.get('name') or '')))
+        new_tokens = []
+        for token, weight in tokens.items():
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = {}
+                new_tokens.append(token)
+            posting[station_id] = weight
+        return new_tokens
+
+    def _upsert(self, station):
+        self._remove(station['id'])
+        for token in self._index(station):
+            bisect.insort(self._vocab, token)
+
+    def _remove(self, station_id):
+        self._results.clear()
+        self._scored.clear()
+        tokens = self._docs.pop(station_id, None)
+        self._labels.pop(station_id, None)
+        if not tokens:
+            return
+        for token in tokens:
+            posting = self._postings.get(token)
+            if posting is None:
+                continue
+            posting.pop(station_id, None)
+            if not posting:
+                del self._postings[token]
+                i = bisect.bisect_left(self._vocab, token)
+                if i < len(self._vocab) and self._vocab[i] == token:
+                    del self._vocab[i]
+
+    def _prefix_scores(self, term):
+        # Điểm tốt nhất của mỗi trạm cho một từ khóa (khớp nguyên từ được cộng thêm)
+        if len(term) <= SHORT_TERM_CHARS:
+            return {sid: weight * EXACT_BONUS for sid, weight in self._postings.get(term, {}).items()}
+        scores = {}
+        i = bisect.bisect_left(self._vocab, term)
+        while i < len(self._vocab) and self._vocab[i].startswith(term):
+            token = self._vocab[i]
+            factor = EXACT_BONUS if token == term else 1
+            for station_id, weight in self._postings[token].items():
+                score = weight * factor
+                if score > scores.get(station_id, 0):
+                    scores[station_id] = score
+            i += 1
+        return scores
+
+    def search(self, query, limit=None, where=None):
+        # Id trạm khớp mọi từ khóa, xếp theo điểm giảm dần. `limit` chỉ xếp hạng top-k
+        # (không sắp xếp cả tập khớp); `where(id)` lọc thêm, vd. theo khu vực.
+        phrase = " ".join(tokenize(query))
+        if not phrase:
+            return []
+        key = (phrase, limit)
+        with self._lock:
+            if where is None and key in self._results:
+                self._results.move_to_end(key)
+                return list(self._results[key])
+            scores = self._scores(phrase)
+            ids = scores if where is None else [sid for sid in scores if where(sid)]
+            rank_key = lambda sid: (-scores[sid], self._labels[sid][0])
+            ranked = heapq.nsmallest(limit, ids, key=rank_key) if limit else sorted(ids, key=rank_key)
+            if where is None:
+                self._results[key] = ranked
+                if len(self._results) > RESULT_CACHE_SIZE:
+                    self._results.popitem(last=False)
+        return list(ranked)
+
+    def count(self, query, where=None):
+        # Số trạm khớp, không xếp hạng
+        phrase = " ".join(tokenize(query))
+        if not phrase:
+            return 0
+        with self._lock:
+            scores = self._scores(phrase)
+            return len(scores) if where is None else sum(1 for sid in scores if where(sid))
+
+    def matches(self, query):
+        # Id mọi trạm khớp, không theo thứ tự (để lọc/sắp xếp theo cột ở nơi khác)
+        phrase = " ".join(tokenize(query))
+        if not phrase:
+            return []
+        with self._lock:
+            return list(self._scores(phrase))
+
+    def _scores(self, phrase):
+        # {id trạm: điểm} của mọi trạm khớp, nhớ theo cụm từ khóa; gọi khi đang giữ khóa
+        if phrase in self._scored:
+            self._scored.move_to_end(phrase)
+            return self._scored[phrase]
+        terms = sorted(set(phrase.split()), key=len, reverse=True)
+        scores = self._score(terms, phrase)
+        self._scored[phrase] = scores
+        if len(self._scored) > SCORE_CACHE_SIZE:
+            self._scored.popitem(last=False)
+        return scores
+
+    def _score(self, terms, phrase):
+        total = None
+        for term in terms:
+            if total is None:
+                total = self._prefix_scores(term)
+            elif len(total) <= (SHORT_TERM_SCAN_LIMIT if len(term) <= SHORT_TERM_CHARS else CANDIDATE_SCAN_LIMIT):
+                # Ít ứng viên: đối chiếu thẳng với token của từng trạm thay vì mở rộng tiền tố
+                narrowed = {}
+                for station_id, score in total.items():
+                    best = 0
+                    for token, weight in self._docs[station_id].items():
+                        if token.startswith(term):
+                            best = max(best, weight * (EXACT_BONUS if token == term else 1))
+                    if best:
+                        narrowed[station_id] = score + best
+                total = narrowed
+            else:
+                scores = self._prefix_scores(term)
+                total = {sid: total[sid] + score for sid, score in scores.items() if sid in total}
+            if not total:
+                return {}
+        for station_id in total:
+            code, name = self._labels[station_id]
+            if phrase == code or phrase == name:
+                total[station_id] += 100
+            elif name.startswith(phrase):
+                total[station_id] += 10
+        return total
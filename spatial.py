@@ -0,0 +1,211 @@
+import heapq
+import math
+
+import numpy as np
+import pandas as pd
+
+from calc import spare_kw
+from views import IncrementalView
+
+# --- CHỈ MỤC KHÔNG GIAN TRẠM ---
+# Tọa độ trạm được chia vào lưới ô vuông theo độ (lat/lng). Truy vấn chỉ xét các
+# ô quanh điểm cần tìm rồi lọc bằng khoảng cách haversine, không quét cả mạng.
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG = math.pi * EARTH_RADIUS_KM / 180
+CELL_DEG = 0.25                 # ~28 km mỗi cạnh ô theo vĩ độ
+MAX_MAP_POINTS = 1500           # Vượt ngưỡng này thì gom cụm thay vì vẽ từng trạm
+CLUSTER_PX = 60                 # Kích thước ô gom cụm trên màn hình (pixel)
+MAP_SIZE_PX = (900, 550)        # Khung bản đồ giả định khi suy ra vùng nhìn từ mức zoom
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    # Dùng được cho số hoặc mảng NumPy
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _distance_km(lat1, lng1, lat2, lng2):
+    # Bản vô hướng của haversine_km cho vòng lặp từng trạm
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def _coords(station):
+    coords = station.get('coordinates') or {}
+    try:
+        lat, lng = float(coords.get('lat')), float(coords.get('lng'))
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+
+def _cell(lat, lng):
+    return math.floor(lat / CELL_DEG), math.floor(lng / CELL_DEG)
+
+
+def viewport(lat, lng, zoom, size_px=MAP_SIZE_PX):
+    # Vùng nhìn (lat_min, lng_min, lat_max, lng_max) của bản đồ Web Mercator 256px/ô
+    width, height = size_px
+    deg_per_px = 360 / (256 * 2 ** zoom)
+    half_lng = width * deg_per_px / 2
+    half_lat = height * deg_per_px * math.cos(math.radians(lat)) / 2
+    return lat - half_lat, lng - half_lng, lat + half_lat, lng + half_lng
+
+
+class SpatialIndex(IncrementalView):
+    def __init__(self):
+        super().__init__()
+        self._cells = {}      # (ô lat, ô lng) -> {id trạm: (lat, lng)}
+        self._points = {}     # id trạm -> (lat, lng, ô)
+        self._info = {}       # id trạm -> (mã, tên, trạng thái)
+        self._arrays = None   # mảng tọa độ dựng lại khi có thay đổi, dùng để gom cụm
+        self._cell_keys = None  # danh sách ô đang có trạm, theo thứ tự dùng khi tính cận dưới
+
+    def _size(self):
+        return len(self._points)
+
+    def _rebuild(self, stations):
+        self._cells = {}
+        self._points = {}
+        self._info = {}
+        self._arrays = None
+        self._cell_keys = None
+        for station in stations:
+            self._upsert(station)
+
+    def _upsert(self, station):
+        station_id = station['id']
+        self._remove(station_id)
+        self._info[station_id] = (station.get('code') or '', station.get('name') or '', station.get('status') or '')
+        coords = _coords(station)
+        if coords is None:
+            return
+        cell = _cell(*coords)
+        self._cells.setdefault(cell, {})[station_id] = coords
+        self._points[station_id] = (coords[0], coords[1], cell)
+
+    def _remove(self, station_id):
+        self._arrays = None
+        self._cell_keys = None
+        self._info.pop(station_id, None)
+        point = self._points.pop(station_id, None)
+        if point is None:
+            return
+        members = self._cells.get(point[2])
+        if members is not None:
+            members.pop(station_id, None)
+            if not members:
+                del self._cells[point[2]]
+
+    def location(self, station_id):
+        with self._lock:
+            point = self._points.get(station_id)
+        return None if point is None else point[:2]
+
+    def within(self, lat, lng, radius_km, where=None):
+        # Các trạm cách điểm (lat, lng) không quá radius_km, gần nhất lên đầu: [(id, km)]
+        dlat = radius_km / KM_PER_DEG
+        cos_lat = math.cos(math.radians(min(89.0, abs(lat) + dlat)))
+        dlng = min(180.0, radius_km / (KM_PER_DEG * max(cos_lat, 1e-6)))
+        lat0, lng0 = _cell(lat - dlat, lng - dlng)
+        lat1, lng1 = _cell(lat + dlat, lng + dlng)
+        ids, lats, lngs = [], [], []
+        with self._lock:
+            if (lat1 - lat0 + 1) * (lng1 - lng0 + 1) > len(self._cells):
+                cells = [m for (i, j), m in self._cells.items() if lat0 <= i <= lat1 and lng0 <= j <= lng1]
+            else:
+                cells = [self._cells[(i, j)] for i in range(lat0, lat1 + 1) for j in range(lng0, lng1 + 1) if (i, j) in self._cells]
+            for members in cells:
+                for station_id, (p_lat, p_lng) in members.items():
+                    if where is None or where(station_id):
+                        ids.append(station_id)
+                        lats.append(p_lat)
+                        lngs.append(p_lng)
+        if not ids:
+            return []
+        dist = haversine_km(lat, lng, np.array(lats), np.array(lngs))
+        order = np.argsort(dist, kind='stable')
+        return [(ids[k], float(dist[k])) for k in order if dist[k] <= radius_km]
+
+    def _cell_bounds(self, lat, lng):
+        # Cận dưới khoảng cách (km) từ điểm tới từng ô: số hạng vĩ độ và kinh độ của
+        # công thức haversine đều chỉ nhỏ hơn khi lấy điểm gần nhất và cos nhỏ nhất của ô
+        if self._cell_keys is None:
+            self._cell_keys = list(self._cells)
+        keys = np.array(self._cell_keys, dtype=float).reshape(-1, 2) * CELL_DEG
+        lat_lo, lng_lo = keys[:, 0], keys[:, 1]
+        dlat = np.maximum(0, np.maximum(lat_lo - lat, lat - (lat_lo + CELL_DEG)))
+        dlng = np.abs((np.clip(lng, lng_lo, lng_lo + CELL_DEG) - lng + 180) % 360 - 180)
+        cos_cell = np.minimum(np.cos(np.radians(lat_lo)), np.cos(np.radians(lat_lo + CELL_DEG)))
+        a = np.sin(np.radians(dlat) / 2) ** 2 + math.cos(math.radians(lat)) * cos_cell * np.sin(np.radians(dlng) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+    def nearest(self, lat, lng, n=5, where=None):
+        # n trạm gần nhất: duyệt ô theo cận dưới khoảng cách tăng dần, dừng khi ô kế tiếp chắc chắn xa hơn
+        best = []   # heap (-km, id) giữ n trạm gần nhất
+        with self._lock:
+            if not self._cells:
+                return []
+            bounds = self._cell_bounds(lat, lng)
+            for k in np.argsort(bounds, kind='stable'):
+                if len(best) == n and bounds[k] > -best[0][0]:
+                    break
+                for station_id, (p_lat, p_lng) in self._cells[self._cell_keys[k]].items():
+                    if where is not None and not where(station_id):
+                        continue
+                    km = _distance_km(lat, lng, p_lat, p_lng)
+                    if len(best) < n:
+                        heapq.heappush(best, (-km, station_id))
+                    elif km < -best[0][0]:
+                        heapq.heapreplace(best, (-km, station_id))
+        return [(station_id, -neg_km) for neg_km, station_id in sorted(best, reverse=True)]
+
+    def nearest_with_spare(self, lat, lng, engine, min_spare_kw=0.0, n=1):
+        # Trạm gần nhất đã có bảng công suất và còn dư (danh định trừ tổng tải) >= min_spare_kw
+        spare = spare_kw(engine.results())
+        eligible = set(spare.index[spare >= min_spare_kw])
+        found = self.nearest(lat, lng, n, where=eligible.__contains__)
+        return [(station_id, km, float(spare[station_id])) for station_id, km in found]
+
+    def _coordinate_arrays(self):
+        if self._arrays is None:
+            ids = list(self._points)
+            self._arrays = (
+                np.array(ids, dtype=object),
+                np.array([self._points[i][0] for i in ids], dtype=float),
+                np.array([self._points[i][1] for i in ids], dtype=float),
+            )
+        return self._arrays
+
+    def clusters(self, bounds, zoom, max_points=MAX_MAP_POINTS):
+        # Điểm vẽ trong vùng nhìn: từng trạm nếu ít, ngược lại gom theo ô lưới cỡ CLUSTER_PX
+        lat_min, lng_min, lat_max, lng_max = bounds
+        with self._lock:
+            ids, lats, lngs = self._coordinate_arrays()
+            mask = (lats >= lat_min) & (lats <= lat_max) & (lngs >= lng_min) & (lngs <= lng_max)
+            ids, lats, lngs = ids[mask], lats[mask], lngs[mask]
+            info = [self._info[i] for i in ids] if len(ids) <= max_points else None
+        if info is not None:
+            return pd.DataFrame({
+                'id': ids, 'lat': lats, 'lng': lngs, 'count': 1,
+                'code': [x[0] for x in info], 'name': [x[1] for x in info], 'status': [x[2] for x in info],
+            })
+        size = CLUSTER_PX * 360 / (256 * 2 ** zoom)
+        keys = np.floor(lats / size).astype(np.int64) * 4_000_000 + np.floor(lngs / size).astype(np.int64)
+        _, group, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        return pd.DataFrame({
+            'id': None,
+            'lat': np.bincount(group, weights=lats) / counts,
+            'lng': np.bincount(group, weights=lngs) / counts,
+            'count': counts,
+            'code': [f"{c:,} trạm" for c in counts], 'name': '', 'status': 'CLUSTER',
+        })
+
+    def label(self, station_id):
+        with self._lock:
+            return self._info.get(station_id, ('', '', ''))
@@ -0,0 +1,167 @@
+import heapq
+
+import pandas as pd
+
+from views import IncrementalView, _to_float
+
+# --- CHỈ MỤC VẬT TƯ TOÀN MẠNG ---
+# Mỗi dòng vật tư được quy về khóa (mã VT, loại, trạng thái, đã điều chuyển). Tổng
+# theo khóa, theo khu vực và vị trí từng mã VT được cộng/trừ khi vá từng trạm, nên
+# câu hỏi "MPD-100 đang ở đâu" hay "bao nhiêu mục chờ điều chuyển" không quét lại kho.
+
+UNCODED = "(không mã)"
+
+
+def _item_code(code, name):
+    code = (code or "").strip().upper()
+    return code or f"{UNCODED} {(name or '').strip()}".strip()
+
+
+def _add(totals, key, lines, quantity):
+    entry = totals.get(key)
+    if entry is None:
+        entry = totals[key] = [0, 0.0]
+    entry[0] += lines
+    entry[1] += quantity
+    if entry[0] <= 0:
+        del totals[key]
+
+
+class InventoryIndex(IncrementalView):
+    def __init__(self):
+        super().__init__()
+        self._stations = {}     # id trạm -> (mã, tên, tỉnh, khu vực, [dòng vật tư đã chuẩn hóa])
+        self._totals = {}       # (mã VT, loại, trạng thái, đã điều chuyển) -> [số dòng, số lượng]
+        self._regions = {}      # (khu vực, mã VT) -> [số dòng, số lượng]
+        self._locations = {}    # mã VT -> {id trạm: [số dòng, số lượng]}
+        self._names = {}        # mã VT -> (tên, đơn vị) gặp đầu tiên, để hiển thị
+
+    def _load_all(self, store):
+        stations = store.list_stations()
+        facts = store.inventory_facts()
+        for station in stations:
+            station['inventoryFacts'] = facts.get(station['id'], [])
+        return stations
+
+    def _load(self, store, station_ids):
+        stations = store.get_summaries(station_ids)
+        facts = store.inventory_facts(station_ids)
+        for station in stations:
+            station['inventoryFacts'] = facts.get(station['id'], [])
+        return stations
+
+    def _size(self):
+        return len(self._stations)
+
+    def _rebuild(self, stations):
+        self._stations = {}
+        self._totals = {}
+        self._regions = {}
+        self._locations = {}
+        self._names = {}
+        for station in stations:
+            self._upsert(station)
+
+    def _count(self, station_id, region, lines, sign):
+        for code, item_type, status, transferred, quantity in lines:
+            _add(self._totals, (code, item_type, status, transferred), sign, sign * quantity)
+            _add(self._regions, (region, code), sign, sign * quantity)
+            holders = self._locations.setdefault(code, {})
+            _add(holders, station_id, sign, sign * quantity)
+            if not holders:
+                del self._locations[code]
+                self._names.pop(code, None)
+
+    def _upsert(self, station):
+        station_id = station['id']
+        self._remove(station_id)
+        lines = []
+        for code, name, item_type, status, transferred, quantity, unit in station.get('inventoryFacts', []):
+            key = _item_code(code, name)
+            self._names.setdefault(key, (name or '', unit or ''))
+            lines.append((key, item_type or '', status or '', bool(transferred), _to_float(quantity) or 0.0))
+        region = station.get('region') or ''
+        self._stations[station_id] = (
+            station.get('code') or '', station.get('name') or '', station.get('province') or '', region, lines
+        )
+        self._count(station_id, region, lines, 1)
+
+    def _remove(self, station_id):
+        entry = self._stations.pop(station_id, None)
+        if entry is not None:
+            self._count(station_id, entry[3], entry[4], -1)
+
+    # --- TRUY VẤN ---
+    def options(self):
+        # Các giá trị loại / trạng thái đang có, dùng cho bộ lọc
+        with self._lock:
+            types = sorted({k[1] for k in self._totals})
+            statuses = sorted({k[2] for k in self._totals})
+        return types, statuses
+
+    def _matches(self, key, item_type, status, transferred):
+        return ((item_type is None or key[1] == item_type) and (status is None or key[2] == status)
+                and (transferred is None or key[3] == transferred))
+
+    def item_totals(self, item_type=None, status=None, transferred=None):
+        # Tổng theo mã VT: số trạm, số dòng, số lượng, số lượng chưa điều chuyển
+        rows = {}
+        with self._lock:
+            for key, (lines, quantity) in self._totals.items():
+                if not self._matches(key, item_type, status, transferred):
+                    continue
+                row = rows.get(key[0])
+                if row is None:
+                    name, unit = self._names.get(key[0], ('', ''))
+                    row = rows[key[0]] = {"itemCode": key[0], "itemName": name, "unit": unit,
+                                          "stations": len(self._locations.get(key[0], {})),
+                                          "lines": 0, "quantity": 0.0, "pendingQuantity": 0.0}
+                row["lines"] += lines
+                row["quantity"] += quantity
+                if not key[3]:
+                    row["pendingQuantity"] += quantity
+        columns = ["itemCode", "itemName", "unit", "stations", "lines", "quantity", "pendingQuantity"]
+        return pd.DataFrame(list(rows.values()), columns=columns).sort_values("quantity", ascending=False, kind="stable")
+
+    def region_totals(self, item_code=None):
+        # Số lượng theo khu vực x mã VT (hoặc chỉ một mã VT)
+        with self._lock:
+            rows = [(region, code, lines, quantity) for (region, code), (lines, quantity) in self._regions.items()
+                    if item_code is None or code == item_code]
+        return pd.DataFrame(rows, columns=["region", "itemCode", "lines", "quantity"])
+
+    def transfer_summary(self):
+        # {đã điều chuyển: [số dòng, số lượng]} toàn mạng
+        summary = {True: [0, 0.0], False: [0, 0.0]}
+        with self._lock:
+            for key, (lines, quantity) in self._totals.items():
+                summary[key[3]][0] += lines
+                summary[key[3]][1] += quantity
+        return summary
+
+    def locations(self, item_code, limit=None):
+        # Các trạm đang giữ một mã VT, nhiều nhất lên đầu
+        with self._lock:
+            holders = self._locations.get(item_code, {})
+            rank = lambda sid: (-holders[sid][1], self._stations[sid][0])
+            ids = heapq.nsmallest(limit, holders, key=rank) if limit else sorted(holders, key=rank)
+            rows = [(sid, *self._stations[sid][:4], *holders[sid]) for sid in ids]
+        return pd.DataFrame(rows, columns=["id", "code", "name", "province", "region", "lines", "quantity"]).set_index("id")
+
+    def holder_count(self, item_code):
+        with self._lock:
+            return len(self._locations.get(item_code, {}))
+
+    def pending_transfers(self, limit=None):
+        # Các dòng vật tư chưa điều chuyển theo trạm (id trạm, mã VT, loại, trạng thái, số lượng)
+        rows = []
+        with self._lock:
+            for station_id, (code, name, _, region, lines) in self._stations.items():
+                for item_code, item_type, status, transferred, quantity in lines:
+                    if not transferred:
+                        rows.append((station_id, code, name, region, item_code, item_type, status, quantity))
+                        if limit and len(rows) >= limit:
+                            break
+                if limit and len(rows) >= limit:
+                    break
+        return pd.DataFrame(rows, columns=["id", "code", "name", "region", "itemCode", "type", "status", "quantity"])
@@ -0,0 +1,585 @@
+import json
+import os
+import sqlite3
+import threading
+
+# --- KHO DỮ LIỆU TRẠM (SQLite) ---
+# Mỗi trạm là một dòng trong bảng `stations`; designData và inventory được tách
+# thành bảng con để tra cứu/cập nhật theo chỉ mục thay vì quét cả danh sách.
+
+DB_PATH = os.getenv("PMB_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "pmb.db"))
+
+# Khóa dict trạm (camelCase như constants.ts) -> cột SQL
+STATION_COLUMNS = {
+    "id": "id", "code": "code", "name": "name", "region": "region", "status": "status",
+    "province": "province", "buildYear": "build_year", "power": "power", "racks": "racks",
+    "manager": "manager", "branchManager": "branch_manager",
+    "buildingType": "building_type", "category": "category",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stations (
+    id TEXT PRIMARY KEY,
+    code TEXT, name TEXT, region TEXT, status TEXT, province TEXT,
+    build_year TEXT, power NUMERIC, racks NUMERIC,
+    manager TEXT, branch_manager TEXT, building_type TEXT, category TEXT,
+    lat REAL, lng REAL,
+    extra TEXT,
+    revision INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_stations_code ON stations(code);
+CREATE INDEX IF NOT EXISTS idx_stations_region ON stations(region);
+CREATE INDEX IF NOT EXISTS idx_stations_province ON stations(province);
+CREATE INDEX IF NOT EXISTS idx_stations_status ON stations(status);
+CREATE INDEX IF NOT EXISTS idx_stations_revision ON stations(revision);
+
+-- Số hiệu phiên bản toàn cục, tăng dần sau mỗi lần ghi
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('revision', 0);
+
+-- Trạm đã xóa, để các view dẫn xuất cập nhật tăng dần
+CREATE TABLE IF NOT EXISTS tombstones (
+    station_id TEXT PRIMARY KEY,
+    revision INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS design_data (
+    station_id TEXT NOT NULL REFERENCES stations(id) ON DELETE CASCADE,
+    section TEXT NOT NULL,
+    payload TEXT,
+    PRIMARY KEY (station_id, section)
+);
+
+CREATE TABLE IF NOT EXISTS inventory (
+    station_id TEXT NOT NULL REFERENCES stations(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    id TEXT,
+    item_code TEXT,
+    type TEXT,
+    status TEXT,
+    is_transferred INTEGER,
+    payload TEXT,
+    PRIMARY KEY (station_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_inventory_item_code ON inventory(item_code);
+"""
+
+
+class ConflictError(Exception):
+    # Dữ liệu trạm đã bị phiên khác thay đổi kể từ lúc tải
+    def __init__(self, station_id, expected, actual):
+        super().__init__(f"Trạm {station_id} đã được cập nhật (phiên bản {actual}, đang sửa từ {expected})")
+        self.station_id = station_id
+        self.expected = expected
+        self.actual = actual
+
+
+def _json_default(o):
+    # Giá trị numpy/pandas từ data_editor (int64, float64, Timestamp...)
+    if hasattr(o, 'item'):
+        return o.item()
+    if hasattr(o, 'isoformat'):
+        return o.isoformat()
+    return str(o)
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, default=_json_default)
+
+
+def _batches(station_ids, size=500):
+    # Chia danh sách id thành lô nhỏ cho mệnh đề IN (giới hạn tham số của SQLite);
+    # None nghĩa là không lọc theo trạm
+    if station_ids is None:
+        return [None]
+    station_ids = list(station_ids)
+    return [station_ids[i:i + size] for i in range(0, len(station_ids), size)]
+
+
+def _placeholders(values):
+    return ", ".join("?" for _ in values)
+
+
+class StationStore:
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        # Streamlit chạy mỗi phiên trên một thread riêng -> dùng chung kết nối có khóa
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            if path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            self._migrate()
+            self._conn.executescript(SCHEMA)
+            self._conn.commit()
+
+    def _migrate(self):
+        # Kho tạo trước khi có cột revision
+        cols = [r[1] for r in self._conn.execute("PRAGMA table_info(stations)")]
+        if cols and 'revision' not in cols:
+            self._conn.execute("ALTER TABLE stations ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # --- CHUYỂN ĐỔI DÒNG <-> DICT ---
+    def _station_row(self, station):
+        row = {col: station.get(key) for key, col in STATION_COLUMNS.items()}
+        row['id'] = str(station['id'])
+        coords = station.get('coordinates') or {}
+        row['lat'] = coords.get('lat')
+        row['lng'] = coords.get('lng')
+        known = set(STATION_COLUMNS) | {'coordinates', 'designData', 'inventory', 'revision'}
+        extra = {k: v for k, v in station.items() if k not in known}
+        row['extra'] = _dumps(extra) if extra else None
+        return row
+
+    def _station_dict(self, row):
+        station = {}
+        for key, col in STATION_COLUMNS.items():
+            if row[col] is not None:
+                station[key] = row[col]
+        if row['lat'] is not None and row['lng'] is not None:
+            station['coordinates'] = {"lat": row['lat'], "lng": row['lng']}
+        if row['extra']:
+            station.update(json.loads(row['extra']))
+        station['revision'] = row['revision']
+        return station
+
+    @staticmethod
+    def _inventory_row(station_id, position, item):
+        transfer = item.get('transfer') or {}
+        return (
+            station_id, position, item.get('id'), item.get('itemCode'), item.get('type'),
+            item.get('status'), 1 if transfer.get('isTransferred') else 0, _dumps(item),
+        )
+
+    # --- ĐỌC ---
+    @property
+    def revision(self):
+        with self._lock:
+            return self._conn.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()[0]
+
+    def station_revision(self, station_id):
+        with self._lock:
+            row = self._conn.execute("SELECT revision FROM stations WHERE id = ?", (station_id,)).fetchone()
+        return row[0] if row else None
+
+    def station_revisions(self, station_ids):
+        # {id trạm: phiên bản} cho các trạm còn tồn tại
+        result = {}
+        with self._lock:
+            for chunk in _batches(station_ids):
+                rows = self._conn.execute(
+                    f"SELECT id, revision FROM stations WHERE id IN ({_placeholders(chunk)})", chunk
+                )
+                result.update(rows.fetchall())
+        return result
+
+    def changed_since(self, revision):
+        # (id trạm thay đổi, id trạm đã xóa) sau phiên bản `revision`
+        with self._lock:
+            changed = [r[0] for r in self._conn.execute("SELECT id FROM stations WHERE revision > ?", (revision,))]
+            deleted = [r[0] for r in self._conn.execute("SELECT station_id FROM tombstones WHERE revision > ?", (revision,))]
+        return changed, deleted
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM stations").fetchone()[0]
+
+    def list_stations(self, region=None, status=None, province=None):
+        # Chỉ trả về thông tin tóm tắt (không kèm designData/inventory)
+        where, params = [], []
+        for col, value in (("region", region), ("status", status), ("province", province)):
+            if value is not None:
+                where.append(f"{col} = ?")
+                params.append(value)
+        sql = "SELECT * FROM stations"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY rowid"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [self._station_dict(r) for r in rows]
+
+    def get_summaries(self, station_ids):
+        # Thông tin tóm tắt của nhiều trạm, truy vấn theo lô qua khóa chính
+        result = []
+        with self._lock:
+            for chunk in _batches(station_ids):
+                rows = self._conn.execute(
+                    f"SELECT * FROM stations WHERE id IN ({_placeholders(chunk)})", chunk
+                ).fetchall()
+                result.extend(self._station_dict(r) for r in rows)
+        return result
+
+    def get_design_data(self, station_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT section, payload FROM design_data WHERE station_id = ?", (station_id,)
+            ).fetchall()
+        return {r['section']: json.loads(r['payload']) for r in rows}
+
+    def design_sections(self, sections, station_ids=None):
+        # {id trạm: {mục: giá trị}} cho các mục designData được chọn, một truy vấn mỗi lô
+        sections = list(sections)
+        section_sql = f"section IN ({_placeholders(sections)})"
+        result = {}
+        with self._lock:
+            for chunk in _batches(station_ids):
+                if chunk is None:
+                    rows = self._conn.execute(
+                        f"SELECT station_id, section, payload FROM design_data WHERE {section_sql}", sections
+                    )
+                else:
+                    rows = self._conn.execute(
+                        f"SELECT station_id, section, payload FROM design_data WHERE {section_sql} "
+                        f"AND station_id IN ({_placeholders(chunk)})", sections + chunk
+                    )
+                for station_id, section, payload in rows:
+                    result.setdefault(station_id, {})[section] = json.loads(payload)
+        return result
+
+    def get_inventory(self, station_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM inventory WHERE station_id = ? ORDER BY position", (station_id,)
+            ).fetchall()
+        return [json.loads(r['payload']) for r in rows]
+
+    def inventories(self, station_ids):
+        # {id trạm: [vật tư]} của nhiều trạm, một truy vấn mỗi lô
+        result = {station_id: [] for station_id in station_ids}
+        with self._lock:
+            for chunk in _batches(station_ids):
+                rows = self._conn.execute(
+                    f"SELECT station_id, payload FROM inventory WHERE station_id IN ({_placeholders(chunk)}) "
+                    "ORDER BY station_id, position", chunk
+                )
+                for station_id, payload in rows:
+                    result[station_id].append(json.loads(payload))
+        return result
+
+    def inventory_count(self, station_id):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM inventory WHERE station_id = ?", (station_id,)).fetchone()[0]
+
+    def inventory_page(self, station_id, offset=0, limit=50):
+        # Một trang vật tư của trạm, đi theo khóa chính (station_id, position)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM inventory WHERE station_id = ? ORDER BY position LIMIT ? OFFSET ?",
+                (station_id, limit, offset),
+            ).fetchall()
+        return [json.loads(r['payload']) for r in rows]
+
+    def inventory_names(self, station_ids=None):
+        # {id trạm: [tên vật tư]} phục vụ chỉ mục tìm kiếm, không giải mã cả payload
+        sql = "SELECT station_id, json_extract(payload, '$.itemName') FROM inventory"
+        result = {}
+        with self._lock:
+            for chunk in _batches(station_ids):
+                if chunk is None:
+                    rows = self._conn.execute(sql + " ORDER BY station_id, position")
+                else:
+                    rows = self._conn.execute(
+                        sql + f" WHERE station_id IN ({_placeholders(chunk)}) ORDER BY station_id, position", chunk
+                    )
+                for station_id, name in rows:
+                    if name:
+                        result.setdefault(station_id, []).append(name)
+        return result
+
+    def inventory_facts(self, station_ids=None):
+        # {id trạm: [(mã VT, tên, loại, trạng thái, đã điều chuyển, số lượng, đơn vị)]}
+        # cho chỉ mục vật tư toàn mạng; chỉ lấy các trường cần tổng hợp
+        sql = (
+            "SELECT station_id, item_code, json_extract(payload, '$.itemName'), type, status, is_transferred, "
+            "json_extract(payload, '$.quantity'), json_extract(payload, '$.unit') FROM inventory"
+        )
+        result = {}
+        with self._lock:
+            for chunk in _batches(station_ids):
+                if chunk is None:
+                    rows = self._conn.execute(sql + " ORDER BY station_id, position")
+                else:
+                    rows = self._conn.execute(
+                        sql + f" WHERE station_id IN ({_placeholders(chunk)}) ORDER BY station_id, position", chunk
+                    )
+                for row in rows:
+                    result.setdefault(row[0], []).append(tuple(row[1:]))
+        return result
+
+    def ids_by_code(self, codes):
+        # {mã trạm: id trạm} cho các mã được hỏi
+        result = {}
+        with self._lock:
+            for chunk in _batches(codes):
+                rows = self._conn.execute(
+                    f"SELECT code, id FROM stations WHERE code IN ({_placeholders(chunk)})", chunk
+                )
+                result.update(dict(rows.fetchall()))
+        return result
+
+    def existing_ids(self, station_ids):
+        found = set()
+        with self._lock:
+            for chunk in _batches(station_ids):
+                rows = self._conn.execute(f"SELECT id FROM stations WHERE id IN ({_placeholders(chunk)})", chunk)
+                found.update(r[0] for r in rows)
+        return found
+
+    def iter_inventory_rows(self, batch_size=50000):
+        # Duyệt (mã trạm, id trạm, payload) theo lô cho xuất dữ liệu, không nạp toàn bộ.
+        # Phân trang theo khóa (station_id, position) để không giữ khóa giữa các lô.
+        last = ("", -1)
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT s.code, i.station_id, i.payload, i.position FROM inventory i "
+                    "JOIN stations s ON s.id = i.station_id "
+                    "WHERE (i.station_id, i.position) > (?, ?) ORDER BY i.station_id, i.position LIMIT ?",
+                    (last[0], last[1], batch_size),
+                ).fetchall()
+            if not rows:
+                break
+            last = (rows[-1][1], rows[-1][3])
+            yield [r[:3] for r in rows]
+
+    def iter_design_rows(self, section, batch_size=1000):
+        # Duyệt (mã trạm, id trạm, payload) của một mục designData theo lô trạm, phân
+        # trang theo khóa station_id như iter_inventory_rows
+        last = ""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT s.code, d.station_id, d.payload FROM design_data d "
+                    "JOIN stations s ON s.id = d.station_id "
+                    "WHERE d.section = ? AND d.station_id > ? ORDER BY d.station_id LIMIT ?",
+                    (section, last, batch_size),
+                ).fetchall()
+            if not rows:
+                break
+            last = rows[-1][1]
+            yield [tuple(r) for r in rows]
+
+    def get(self, station_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM stations WHERE id = ?", (station_id,)).fetchone()
+            if row is None:
+                return None
+            station = self._station_dict(row)
+            station['designData'] = self.get_design_data(station_id)
+            station['inventory'] = self.get_inventory(station_id)
+        return station
+
+    def get_by_code(self, code):
+        with self._lock:
+            row = self._conn.execute("SELECT id FROM stations WHERE code = ?", (code,)).fetchone()
+        return self.get(row['id']) if row else None
+
+    def iter_stations(self):
+        # Duyệt toàn bộ trạm kèm chi tiết, từng trạm một
+        with self._lock:
+            ids = [r[0] for r in self._conn.execute("SELECT id FROM stations ORDER BY rowid")]
+        for station_id in ids:
+            station = self.get(station_id)
+            if station is not None:
+                yield station
+
+    # --- GHI ---
+    def _next_revision(self):
+        self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'revision'")
+        return self._conn.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()[0]
+
+    def _check_revision(self, station_id, expected_revision):
+        if expected_revision is None:
+            return
+        row = self._conn.execute("SELECT revision FROM stations WHERE id = ?", (station_id,)).fetchone()
+        actual = row[0] if row else None
+        if actual != expected_revision:
+            raise ConflictError(station_id, expected_revision, actual)
+
+    def _touch(self, station_id, revision):
+        self._conn.execute("UPDATE stations SET revision = ? WHERE id = ?", (revision, station_id))
+
+    def _write_design_data(self, station_id, design_data):
+        self._conn.execute("DELETE FROM design_data WHERE station_id = ?", (station_id,))
+        self._conn.executemany(
+            "INSERT INTO design_data (station_id, section, payload) VALUES (?, ?, ?)",
+            [(station_id, section, _dumps(value)) for section, value in (design_data or {}).items()],
+        )
+
+    def _write_inventory(self, station_id, inventory):
+        self._conn.execute("DELETE FROM inventory WHERE station_id = ?", (station_id,))
+        self._conn.executemany(
+            "INSERT INTO inventory (station_id, position, id, item_code, type, status, is_transferred, payload) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [self._inventory_row(station_id, i, item) for i, item in enumerate(inventory or [])],
+        )
+
+    def _write_station(self, station, revision):
+        row = self._station_row(station)
+        row['revision'] = revision
+        cols = list(row)
+        updates = ", ".join(f"{c} = excluded.{c}" for c in cols if c != 'id')
+        self._conn.execute(
+            f"INSERT INTO stations ({', '.join(cols)}) VALUES ({_placeholders(cols)}) "
+            f"ON CONFLICT(id) DO UPDATE SET {updates}",
+            [row[c] for c in cols],
+        )
+        station_id = row['id']
+        self._conn.execute("DELETE FROM tombstones WHERE station_id = ?", (station_id,))
+        if 'designData' in station:
+            self._write_design_data(station_id, station['designData'])
+        if 'inventory' in station:
+            self._write_inventory(station_id, station['inventory'])
+
+    # Mọi hàm ghi trả về phiên bản mới; truyền expected_revision (phiên bản trạm lúc
+    # bắt đầu sửa) để từ chối ghi đè lên thay đổi của phiên khác.
+    def upsert(self, station, expected_revision=None):
+        with self._lock, self._conn:
+            self._check_revision(str(station['id']), expected_revision)
+            revision = self._next_revision()
+            self._write_station(station, revision)
+        return revision
+
+    def upsert_many(self, stations):
+        with self._lock, self._conn:
+            revision = self._next_revision()
+            for station in stations:
+                self._write_station(station, revision)
+        return revision
+
+    def merge_stations(self, stations):
+        # Upsert từng phần (nhập file): trạm đã có chỉ nhận các trường có trong bản ghi,
+        # các cột và trường mở rộng (extra) khác được giữ nguyên
+        with self._lock, self._conn:
+            current = {s['id']: s for s in self.get_summaries([str(s['id']) for s in stations])}
+            revision = self._next_revision()
+            for station in stations:
+                merged = {k: v for k, v in current.get(str(station['id']), {}).items() if k != 'revision'}
+                merged.update(station)
+                self._write_station(merged, revision)
+        return revision
+
+    def _apply_field(self, station_id, key, value, revision):
+        if key == 'designData':
+            self._write_design_data(station_id, value)
+            self._touch(station_id, revision)
+        elif key == 'inventory':
+            self._write_inventory(station_id, value)
+            self._touch(station_id, revision)
+        else:
+            station = self.get(station_id)
+            if station is None:
+                return
+            station = {k: v for k, v in station.items() if k not in ('designData', 'inventory')}
+            station[key] = value
+            self._write_station(station, revision)
+
+    def update_field(self, station_id, key, value, expected_revision=None):
+        with self._lock, self._conn:
+            self._check_revision(station_id, expected_revision)
+            revision = self._next_revision()
+            self._apply_field(station_id, key, value, revision)
+        return revision
+
+    def update_fields(self, changes):
+        # Ghi hàng loạt [(id trạm, khóa, giá trị)] trong một giao dịch, một phiên bản
+        with self._lock, self._conn:
+            revision = self._next_revision()
+            for station_id, key, value in changes:
+                self._apply_field(station_id, key, value, revision)
+        return revision
+
+    def update_sections(self, changes, expected_revisions):
+        # Ghi một lô {id trạm: {mục designData hoặc 'inventory': giá trị}} trong một giao dịch.
+        # Trạm có phiên bản khác expected_revisions (phiên khác vừa sửa) bị bỏ qua;
+        # trả về (phiên bản mới hoặc None nếu không ghi gì, [id trạm xung đột])
+        with self._lock, self._conn:
+            current = self.station_revisions(list(changes))
+            conflicts = [sid for sid in changes if current.get(sid) != expected_revisions.get(sid)]
+            writable = [sid for sid in changes if current.get(sid) == expected_revisions.get(sid)]
+            if not writable:
+                return None, conflicts
+            revision = self._next_revision()
+            for station_id in writable:
+                for key, value in changes[station_id].items():
+                    if key == 'inventory':
+                        self._write_inventory(station_id, value)
+                    else:
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO design_data (station_id, section, payload) VALUES (?, ?, ?)",
+                            (station_id, key, _dumps(value)),
+                        )
+                self._touch(station_id, revision)
+        return revision, conflicts
+
+    def save_design_data(self, station_id, design_data, expected_revision=None):
+        return self.update_field(station_id, 'designData', design_data, expected_revision)
+
+    def save_inventory(self, station_id, inventory, expected_revision=None):
+        return self.update_field(station_id, 'inventory', inventory, expected_revision)
+
+    def delete(self, station_id):
+        with self._lock, self._conn:
+            revision = self._next_revision()
+            self._conn.execute("DELETE FROM stations WHERE id = ?", (station_id,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tombstones (station_id, revision) VALUES (?, ?)", (station_id, revision)
+            )
+        return revision
+
+    def append_inventory(self, items_by_station, replace=False):
+        # Thêm vật tư hàng loạt vào cuối danh sách của từng trạm (replace=True: thay cả danh sách)
+        with self._lock, self._conn:
+            revision = self._next_revision()
+            station_ids = list(items_by_station)
+            next_pos = {}
+            if not replace:
+                for chunk in _batches(station_ids):
+                    next_pos.update(self._conn.execute(
+                        f"SELECT station_id, MAX(position) + 1 FROM inventory WHERE station_id IN ({_placeholders(chunk)}) "
+                        "GROUP BY station_id", chunk
+                    ).fetchall())
+            rows = []
+            for station_id, items in items_by_station.items():
+                if replace:
+                    self._conn.execute("DELETE FROM inventory WHERE station_id = ?", (station_id,))
+                start = next_pos.get(station_id, 0)
+                rows.extend(self._inventory_row(station_id, start + i, item) for i, item in enumerate(items))
+                self._touch(station_id, revision)
+            self._conn.executemany(
+                "INSERT INTO inventory (station_id, position, id, item_code, type, status, is_transferred, payload) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        return revision
+
+    def append_design_items(self, section, items_by_station, replace=False):
+        # Thêm dòng vào một mục dạng danh sách của designData (calcItems, costEstimateItems...)
+        with self._lock, self._conn:
+            revision = self._next_revision()
+            current = {} if replace else {
+                station_id: sections.get(section) or []
+                for station_id, sections in self.design_sections([section], list(items_by_station)).items()
+            }
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO design_data (station_id, section, payload) VALUES (?, ?, ?)",
+                [(station_id, section, _dumps(current.get(station_id, []) + items))
+                 for station_id, items in items_by_station.items()],
+            )
+            for station_id in items_by_station:
+                self._touch(station_id, revision)
+        return revision
+
+    def seed_if_empty(self, stations):
+        if self.count() == 0:
+            self.upsert_many(stations)
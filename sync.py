@@ -0,0 +1,255 @@
+import hashlib
+import math
+import numbers
+
+from search import fold
+
+# --- ĐỒNG BỘ CÔNG SUẤT -> DỰ TOÁN -> VẬT TƯ ---
+# Mỗi mục được nhận diện bằng khóa ổn định (mã VT, hoặc phân loại + tên đã chuẩn
+# hóa), đánh chỉ mục băm rồi upsert: thêm mục mới, cập nhật mục lệch, xóa dòng do
+# đồng bộ tạo ra mà nguồn không còn, giữ nguyên phần còn lại. Chạy lại nhiều lần
+# cho cùng kết quả.
+
+
+def _clean(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    return str(value).strip()
+
+
+def item_key(item, name_field='itemName', category=True, code=True):
+    item_code = _clean(item.get('itemCode')).upper() if code else ""
+    if item_code:
+        return ('code', item_code)
+    name = " ".join(fold(_clean(item.get(name_field))).split())
+    if not name:
+        return None
+    return ('name', _clean(item.get('category')) if category else '', name)
+
+
+def _same(a, b):
+    if isinstance(a, numbers.Real) and isinstance(b, numbers.Real):
+        return math.isclose(a, b)
+    return a == b
+
+
+def merge_items(existing, incoming, key_fn, fields, removable=None):
+    # Trả về (danh sách đã gộp, thống kê added/updated/unchanged/removed).
+    # Chỉ các trường trong `fields` được ghi đè; dữ liệu người dùng nhập thêm
+    # (đơn giá, ghi chú, vị trí...) trên mục đã có được giữ nguyên. Dòng có
+    # removable(dòng) đúng (do đồng bộ tạo, chưa bị khóa) mà khóa không còn trong
+    # `incoming` thì bị xóa.
+    merged = [dict(item) for item in existing]
+    index = {}
+    for pos, item in enumerate(merged):
+        key = key_fn(item)
+        if key is not None:
+            index.setdefault(key, pos)
+    stats = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0}
+    seen = set()
+    for item in incoming:
+        key = key_fn(item)
+        if key is None:
+            continue
+        seen.add(key)
+        pos = index.get(key)
+        if pos is None:
+            index[key] = len(merged)
+            merged.append(dict(item))
+            stats["added"] += 1
+            continue
+        target = merged[pos]
+        diff = {f: item[f] for f in fields if f in item and not _same(target.get(f), item[f])}
+        if diff:
+            target.update(diff)
+            stats["updated"] += 1
+        else:
+            stats["unchanged"] += 1
+    if removable is not None:
+        kept = [item for item in merged if not removable(item) or key_fn(item) in seen]
+        stats["removed"] = len(merged) - len(kept)
+        merged = kept
+    return merged, stats
+
+
+def changed(stats):
+    return bool(stats["added"] or stats["updated"] or stats["removed"])
+
+
+def _aggregate(items, key_fn):
+    # Gộp các dòng trùng khóa trong nguồn, cộng dồn số lượng
+    grouped = {}
+    for item in items:
+        key = key_fn(item)
+        if key is None:
+            continue
+        if key in grouped:
+            grouped[key]['quantity'] = _quantity(grouped[key].get('quantity')) + _quantity(item.get('quantity'))
+        else:
+            grouped[key] = dict(item)
+    return list(grouped.values())
+
+
+def _quantity(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return 0
+    if math.isnan(number):
+        return 0
+    return int(number) if number.is_integer() else number
+
+
+# --- BẢNG CÔNG SUẤT -> DỰ TOÁN ---
+# Dòng dự toán do đồng bộ tạo ra mang dấu syncedFrom; khớp theo phân loại + tên (bỏ
+# qua mã VT) để người dùng điền mã VT xong đồng bộ lại không sinh dòng thứ hai.
+# Dòng đã nhập đơn giá coi như người dùng giữ lại, không bị xóa khi mất nguồn.
+SYNCED_FROM_CALC = "calcItems"
+
+
+def cost_key(item):
+    return item_key(item, 'itemName', category=True, code=False)
+
+
+def _removable_cost(item):
+    return item.get('syncedFrom') == SYNCED_FROM_CALC and not _quantity(item.get('unitPrice'))
+
+
+def calc_to_cost_items(calc_items):
+    items = [{
+        "category": "MAIN", # Vật tư chính
+        "itemCode": "",
+        "itemName": _clean(item.get('name')),
+        "unit": "Cái",
+        "quantity": _quantity(item.get('quantity')),
+        "unitPrice": 0,
+        "condition": "Mới",
+        "note": "Đồng bộ từ bảng CS",
+        "syncedFrom": SYNCED_FROM_CALC,
+    } for item in calc_items]
+    return _aggregate(items, cost_key)
+
+
+def sync_calc_to_cost(design_data):
+    return merge_items(
+        design_data.get('costEstimateItems', []),
+        calc_to_cost_items(design_data.get('calcItems', [])),
+        cost_key,
+        fields=['quantity'],
+        removable=_removable_cost,
+    )
+
+
+# --- DỰ TOÁN -> VẬT TƯ THIẾT BỊ ---
+# Dự toán chỉ là kế hoạch: đồng bộ thêm dòng PLANNED có id "sync_<băm>" và chỉ cập nhật
+# hoặc xóa đúng các dòng đó. Vật tư thật (nhập tay, đang dùng, đã điều chuyển) không bị
+# đụng tới.
+SYNC_PREFIX = "sync_"
+
+
+def inventory_key(item):
+    return item_key(item, 'itemName', category=False)
+
+
+def inventory_id(key):
+    # Id ổn định theo khóa: đồng bộ lại không sinh dòng mới
+    return SYNC_PREFIX + hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:12]
+
+
+def synced_key(item):
+    # Khóa upsert: chỉ các dòng do đồng bộ tạo ra
+    item_id = _clean(item.get('id'))
+    return item_id if item_id.startswith(SYNC_PREFIX) else None
+
+
+def _locked(item):
+    # Dòng đồng bộ đã được đưa vào sử dụng hoặc điều chuyển thì thành vật tư thật
+    return item.get('status') != "PLANNED" or bool((item.get('transfer') or {}).get('isTransferred'))
+
+
+def _removable_inventory(item):
+    return synced_key(item) is not None and not _locked(item)
+
+
+def cost_to_inventory_items(cost_items):
+    items = []
+    for row in _aggregate(cost_items, inventory_key):
+        items.append({
+            "id": inventory_id(inventory_key(row)),
+            "itemCode": _clean(row.get('itemCode')),
+            "itemName": _clean(row.get('itemName')),
+            "quantity": _quantity(row.get('quantity')),
+            "unit": _clean(row.get('unit')),
+            "type": "OFFLINE",
+            "status": "PLANNED",
+            "note": f"Đồng bộ từ Dự toán. {_clean(row.get('note'))}",
+            "transfer": {"isTransferred": False}
+        })
+    return items
+
+
+def sync_cost_to_inventory(inventory, cost_items):
+    locked = {synced_key(item) for item in inventory if synced_key(item) and _locked(item)}
+    incoming = cost_to_inventory_items(cost_items)
+    merged, stats = merge_items(
+        inventory,
+        [item for item in incoming if item['id'] not in locked],
+        synced_key,
+        fields=['itemCode', 'itemName', 'quantity', 'unit'],
+        removable=_removable_inventory,
+    )
+    # Dòng nguồn trùng với dòng đã khóa được tính là giữ nguyên
+    stats["unchanged"] += len(incoming) - stats["added"] - stats["updated"] - stats["unchanged"]
+    return merged, stats
+
+
+# --- ĐỒNG BỘ HÀNG LOẠT ---
+SYNC_BATCH = 500
+SYNC_SECTIONS = ['calcItems', 'costEstimateItems']
+
+
+def _count(totals, stats):
+    for k in ('added', 'updated', 'unchanged', 'removed'):
+        totals[k] += stats[k]
+
+
+def bulk_sync(store, station_ids, to_cost=True, to_inventory=True, batch_size=SYNC_BATCH):
+    # Đồng bộ nhiều trạm theo lô: mỗi lô đọc bằng vài truy vấn và ghi trong một giao dịch
+    # ngắn, không giữ khóa kho suốt cả lượt. Trạm bị phiên khác sửa giữa lúc đọc và ghi
+    # không bị ghi đè mà được trả về trong "conflicts"; trả về thống kê cộng dồn.
+    totals = {"stations": 0, "added": 0, "updated": 0, "unchanged": 0, "removed": 0, "conflicts": []}
+    station_ids = list(station_ids)
+    for start in range(0, len(station_ids), batch_size):
+        chunk = station_ids[start:start + batch_size]
+        # Đọc phiên bản trước dữ liệu: mọi lần ghi xen giữa đều bị phát hiện khi ghi
+        revisions = store.station_revisions(chunk)
+        designs = store.design_sections(SYNC_SECTIONS, chunk)
+        inventories = store.inventories(chunk) if to_inventory else {}
+        changes, batch_stats = {}, {}
+        for station_id in chunk:
+            if station_id not in revisions:
+                continue
+            design_data = designs.get(station_id, {})
+            change, counted = {}, {"added": 0, "updated": 0, "unchanged": 0, "removed": 0}
+            if to_cost:
+                cost_items, stats = sync_calc_to_cost(design_data)
+                if changed(stats):
+                    design_data['costEstimateItems'] = change['costEstimateItems'] = cost_items
+                _count(counted, stats)
+            if to_inventory:
+                inventory, stats = sync_cost_to_inventory(
+                    inventories.get(station_id, []), design_data.get('costEstimateItems', [])
+                )
+                if changed(stats):
+                    change['inventory'] = inventory
+                _count(counted, stats)
+            if change:
+                changes[station_id] = change
+            batch_stats[station_id] = counted
+        conflicts = store.update_sections(changes, revisions)[1] if changes else []
+        for station_id, counted in batch_stats.items():
+            if station_id not in conflicts:
+                _count(totals, counted)
+        totals["stations"] += len(changes) - len(conflicts)
+        totals["conflicts"].extend(conflicts)
+    return totals
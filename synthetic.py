@@ -0,0 +1,187 @@
+import argparse
+import random
+
+# --- SINH DỮ LIỆU TRẠM GIẢ LẬP ---
+# Mỗi trạm được sinh từ bộ sinh số ngẫu nhiên riêng gieo theo (seed, thứ tự trạm):
+# cùng seed luôn cho cùng dữ liệu, và trạm thứ i không phụ thuộc tổng số trạm N.
+
+# (tên tỉnh, mã viết tắt, khu vực, vĩ độ, kinh độ)
+PROVINCES = [
+    ("Hà Nội", "HNI", "Miền Bắc", 21.03, 105.85), ("Quảng Ninh", "QNH", "Miền Bắc", 21.01, 107.29),
+    ("Hải Phòng", "HPG", "Miền Bắc", 20.84, 106.69), ("Ninh Bình", "NBH", "Miền Bắc", 20.25, 105.97),
+    ("Lào Cai", "LCI", "Miền Bắc", 22.48, 103.97), ("Thanh Hóa", "THA", "Miền Bắc", 19.81, 105.78),
+    ("Nghệ An", "NAN", "Miền Trung", 18.68, 105.68), ("Huế", "HUE", "Miền Trung", 16.46, 107.59),
+    ("Đà Nẵng", "DNG", "Miền Trung", 16.05, 108.20), ("Quảng Ngãi", "QNI", "Miền Trung", 15.12, 108.80),
+    ("Gia Lai", "GLI", "Miền Trung", 13.98, 108.00), ("Khánh Hòa", "KHA", "Miền Trung", 12.24, 109.19),
+    ("TP. Hồ Chí Minh", "HCM", "Miền Nam", 10.78, 106.70), ("Đồng Nai", "DNI", "Miền Nam", 10.95, 106.82),
+    ("Cần Thơ", "CTO", "Miền Nam", 10.03, 105.78), ("An Giang", "AGG", "Miền Nam", 10.52, 105.13),
+    ("Cà Mau", "CMU", "Miền Nam", 9.18, 105.15), ("Bình Dương", "BDG", "Miền Nam", 11.17, 106.65),
+]
+STATUSES = [("ACTIVE", 0.75), ("PLANNED", 0.15), ("OFFLINE", 0.10)]
+BUILDING_TYPES = ["Cont", "Nhà xây", "Nhà lắp ghép", "Thuê tòa nhà"]
+CATEGORIES = ["Quốc tế", "Liên tỉnh", "Nội tỉnh"]
+SURNAMES = ["Nguyễn", "Trần", "Lê", "Phạm", "Hoàng", "Vũ", "Đặng", "Bùi"]
+GIVEN_NAMES = ["Văn Quyền", "Văn Linh", "Thị Hoa", "Minh Tuấn", "Quốc Huy", "Thu Trang", "Đức Anh", "Hải Nam"]
+PLACES = ["Trung tâm", "Bắc", "Nam", "Đông", "Tây", "Cảng", "Khu công nghiệp", "Cửa khẩu", "Ga", "Chợ"]
+
+# Thiết bị trong rack: (tên, model, loại, công suất W, chiều cao U)
+RACK_EQUIPMENTS = [
+    ("Nguồn Emerson 701", "Netsure 701", "DC", 200, 5),
+    ("Router lõi", "ASR 9006", "DC", 1200, 10),
+    ("Switch truy nhập", "S5735", "AC", 150, 1),
+    ("OLT", "MA5800-X7", "DC", 600, 6),
+    ("Thiết bị truyền dẫn", "OSN 8800", "DC", 900, 8),
+    ("ODF 96FO", "ODF-96", "PASSIVE", 0, 2),
+    ("Máy chủ giám sát", "R650", "AC", 450, 2),
+]
+EQUIPMENT_COLORS = {"DC": "#3B82F6", "AC": "#10B981", "PASSIVE": "#9CA3AF"}
+# Thiết bị bảng công suất: (tên, model, công suất W, điện áp V, loại)
+CALC_EQUIPMENTS = [
+    ("Router lõi", "ASR 9006", 1200, 48, "DC"), ("Thiết bị truyền dẫn", "OSN 8800", 900, 48, "DC"),
+    ("OLT", "MA5800-X7", 600, 48, "DC"), ("Switch truy nhập", "S5735", 150, 220, "AC"),
+    ("Điều hòa", "FTKC50", 1600, 220, "AC"), ("Đèn chiếu sáng", "LED 36W", 36, 220, "AC"),
+    ("Máy chủ giám sát", "R650", 450, 220, "AC"), ("Camera", "DS-2CD", 12, 48, "DC"),
+]
+WIRE_TYPES = ["1 pha 2 dây: 2x... mm2 - Cu/PVC", "3 pha 4 dây 3x... + 1x... mm2 -Cu/PVC/PVC"]
+# Danh mục vật tư: (mã VT, tên, đơn vị, đơn giá VNĐ, công suất kW)
+CATALOG = [
+    ("MPD-100", "Máy phát điện Cummins 100kVA", "Cái", 450_000_000, 40),
+    ("MPD-050", "Máy phát điện Denyo 50kVA", "Cái", 260_000_000, 20),
+    ("ACQ-100", "Ắc quy 12V 100Ah", "Bình", 4_500_000, 0),
+    ("ACQ-150", "Ắc quy 12V 150Ah", "Bình", 6_200_000, 0),
+    ("RECT-3K", "Module chỉnh lưu 3kW", "Cái", 18_000_000, 3),
+    ("DH-18K", "Điều hòa 18000 BTU", "Bộ", 22_000_000, 1.6),
+    ("ATS-200", "Tủ ATS 200A", "Tủ", 65_000_000, 0),
+    ("CAP-16", "Cáp nguồn 16mm2", "m", 120_000, 0),
+    ("ODF-96", "ODF 96FO", "Cái", 7_500_000, 0),
+    ("CB-63", "Aptomat 63A", "Cái", 850_000, 0),
+]
+INVENTORY_STATUSES = [("IN_USE", 0.6), ("PLANNED", 0.2), ("SPARE", 0.15), ("BROKEN", 0.05)]
+
+
+def _pick(rng, weighted):
+    return rng.choices([v for v, _ in weighted], weights=[w for _, w in weighted])[0]
+
+
+def _person(rng):
+    return f"{rng.choice(SURNAMES)} {rng.choice(GIVEN_NAMES)}"
+
+
+def _racks_and_equipments(rng, n_racks):
+    racks, equipments = [], []
+    for r in range(n_racks):
+        rack_id = f"r{r + 1}"
+        racks.append({"id": rack_id, "name": f"Rack {r + 1}", "totalU": 42})
+        next_u = 1
+        for e in range(rng.randint(1, 6)):
+            name, model, kind, power, height = rng.choice(RACK_EQUIPMENTS)
+            next_u += rng.randint(0, 2)
+            if next_u + height - 1 > 42:
+                break
+            equipments.append({
+                "id": f"eq{r + 1}_{e + 1}", "rackId": rack_id, "name": name, "model": model, "type": kind,
+                "powerW": power, "startU": next_u, "uHeight": height, "color": EQUIPMENT_COLORS[kind],
+            })
+            next_u += height
+    return racks, equipments
+
+
+def _calc_items(rng):
+    items = []
+    for name, model, power, voltage, kind in rng.sample(CALC_EQUIPMENTS, rng.randint(2, len(CALC_EQUIPMENTS))):
+        items.append({
+            "name": name, "model": model, "quantity": rng.randint(1, 4), "powerRatedW": float(power),
+            "voltage": float(voltage), "current": round(power / voltage, 2), "wireSection": rng.choice(["2x6", "2x10", "2x16"]),
+            "wireType": rng.choice(WIRE_TYPES), "type": kind, "note": "",
+        })
+    return items
+
+
+def _cost_items(rng, calc_items):
+    # Một phần bảng CS đã được đồng bộ sang dự toán, cộng vài vật tư phụ có mã
+    items = [{
+        "category": "MAIN", "itemCode": "", "itemName": c["name"], "unit": "Cái", "quantity": c["quantity"],
+        "unitPrice": 0, "condition": "Mới", "note": "Đồng bộ từ bảng CS",
+    } for c in calc_items if rng.random() < 0.6]
+    for code, name, unit, price, _ in rng.sample(CATALOG, rng.randint(0, 4)):
+        items.append({
+            "category": "AUX", "itemCode": code, "itemName": name, "unit": unit, "quantity": rng.randint(1, 10),
+            "unitPrice": price, "condition": rng.choice(["Mới", "Sử dụng lại"]), "note": "",
+        })
+    return items
+
+
+def _inventory(rng, station_id):
+    items = []
+    for k, (code, name, unit, _, rated) in enumerate(rng.sample(CATALOG, rng.randint(0, 8))):
+        items.append({
+            "id": f"{station_id}_inv{k + 1}", "itemCode": code, "itemName": name, "quantity": rng.randint(1, 12),
+            "ratedPower": rated, "type": rng.choice(["OFFLINE", "ONLINE"]), "unit": unit,
+            "location1": rng.choice(["Sân trạm", "Phòng máy", "Kho"]), "status": _pick(rng, INVENTORY_STATUSES),
+            "transfer": {"isTransferred": rng.random() < 0.3},
+        })
+    return items
+
+
+def generate_station(index, seed=42):
+    rng = random.Random(f"{seed}:{index}")
+    province, abbr, region, lat, lng = rng.choice(PROVINCES)
+    station_id = f"syn{index:06d}"
+    n_racks = rng.randint(1, 4)
+    racks, equipments = _racks_and_equipments(rng, n_racks)
+    calc_items = _calc_items(rng)
+    dc_load = sum(c["quantity"] * c["powerRatedW"] for c in calc_items if c["type"] == "DC")
+    return {
+        "id": station_id,
+        "code": f"{abbr}HW{index:06d}",
+        "name": f"{rng.choice(PLACES)} {province} {index}",
+        "region": region,
+        "status": _pick(rng, STATUSES),
+        "province": province,
+        "buildYear": str(rng.randint(2005, 2026)),
+        "power": rng.choice([10, 15, 20, 30, 40, 60, 80]),
+        "racks": n_racks,
+        "manager": _person(rng),
+        "branchManager": _person(rng),
+        "buildingType": rng.choice(BUILDING_TYPES),
+        "category": rng.choice(CATEGORIES),
+        "coordinates": {"lat": round(lat + rng.uniform(-0.6, 0.6), 6), "lng": round(lng + rng.uniform(-0.6, 0.6), 6)},
+        "designData": {
+            "racks": racks,
+            "equipments": equipments,
+            "calcItems": calc_items,
+            "costEstimateItems": _cost_items(rng, calc_items),
+            "roomParams": {"width": rng.choice([3, 4, 6]), "length": rng.choice([5, 6, 8]), "height": 3,
+                           "tempInside": 25, "tempOutside": rng.choice([35, 38, 40]), "equipmentHeatW": 0},
+            "batteryParams": {"dcLoadW": dc_load, "targetBackupTime": rng.choice([2, 4, 8]), "batteryVoltage": 48,
+                              "batteryAh": rng.choice([100, 150, 200]), "efficiency": 0.9},
+            "rectParams": {"dcLoadW": dc_load, "batteryAh": 0, "rectifierModuleSize": 3000},
+        },
+        "inventory": _inventory(rng, station_id),
+    }
+
+
+def generate_fleet(n, seed=42, start=0):
+    for index in range(start, start + n):
+        yield generate_station(index, seed)
+
+
+def populate(store, n, seed=42, batch_size=2000):
+    # Ghi N trạm vào kho theo lô, mỗi lô một giao dịch; trả về phiên bản kho cuối cùng
+    revision = store.revision
+    for start in range(0, n, batch_size):
+        revision = store.upsert_many(list(generate_fleet(min(batch_size, n - start), seed, start)))
+    return revision
+
+
+if __name__ == "__main__":
+    from store import StationStore
+
+    parser = argparse.ArgumentParser(description="Sinh dữ liệu trạm giả lập vào kho SQLite")
+    parser.add_argument("n", type=int, help="Số trạm cần sinh")
+    parser.add_argument("--db", default=None, help="Đường dẫn file SQLite (mặc định PMB_DB_PATH / pmb.db)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    store = StationStore(args.db) if args.db else StationStore()
+    populate(store, args.n, args.seed)
+    print(f"Đã ghi {args.n:,} trạm vào {store.path} (tổng {store.count():,} trạm)")
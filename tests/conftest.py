@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# Các module của app nằm phẳng ở thư mục gốc repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from store import StationStore  # noqa: E402
+
+
+@pytest.fixture
+def store():
+    store = StationStore(":memory:")
+    yield store
+    store.close()
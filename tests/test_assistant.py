@@ -0,0 +1,18 @@
+import pytest
+
+from assistant import GeminiBackend
+
+pytest.importorskip("google.ai.generativelanguage")
+
+
+def test_each_backend_keeps_its_own_api_key():
+    first, second = GeminiBackend("key-a"), GeminiBackend("key-b")
+    assert first._client._transport._credentials.token == "key-a"
+    assert second._client._transport._credentials.token == "key-b"
+
+
+def test_request_sends_context_and_prompt_as_one_user_turn():
+    request = GeminiBackend("key-a", model_name="gemini-1.5-flash")._request(["ngữ cảnh", "câu hỏi"])
+    assert request.model == "models/gemini-1.5-flash"
+    assert [part.text for part in request.contents[0].parts] == ["ngữ cảnh", "câu hỏi"]
+    assert request.contents[0].role == "user"
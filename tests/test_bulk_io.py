@@ -0,0 +1,82 @@
+import io
+
+import pandas as pd
+
+from bulk_io import STATION_SCHEMA, import_file, iter_export_frames, validate_chunk
+
+
+def csv_file(text):
+    return io.BytesIO(text.encode("utf-8"))
+
+
+# --- KIỂM TRA THEO LƯỢC ĐỒ ---
+def test_validate_chunk_reports_each_bad_cell_with_its_row():
+    df = pd.DataFrame({
+        "id": ["s1", "", "s3", "s4"],
+        "code": ["A", "B", "C", "D"],
+        "power": ["10", "abc", "12.5", ""],
+        "racks": ["2", "1", "1.5", ""],
+        "status": ["ACTIVE", "ACTIVE", "ACTIVE", "BROKEN"],
+    })
+    values, ok, errors = validate_chunk(df, STATION_SCHEMA, first_row=101)
+    assert ok.tolist() == [True, False, False, False]
+    assert {(e["row"], e["field"], e["error"]) for e in errors} == {
+        (102, "id", "Thiếu giá trị bắt buộc"),
+        (102, "power", "Không phải số"),
+        (103, "racks", "Phải là số nguyên"),
+        (104, "status", "Phải là một trong ACTIVE, PLANNED, OFFLINE"),
+    }
+    parsed, present = values["power"]
+    assert parsed[0] == 10 and parsed[2] == 12.5
+    assert present.tolist() == [True, True, True, False]
+
+
+def test_import_skips_invalid_rows_and_keeps_the_rest(store):
+    report = import_file(store, csv_file("id,code,power\ns1,A,10\ns2,,5\ns3,C,x\n"), "stations", "csv")
+    assert (report["rows"], report["imported"], report["errorCount"]) == (3, 1, 2)
+    assert [s["id"] for s in store.list_stations()] == ["s1"]
+
+
+def test_child_rows_need_a_known_station(store):
+    store.upsert_many([{"id": "s1", "code": "A"}])
+    source = csv_file("stationCode,name,quantity\nA,Tủ nguồn,2\nZZ,Điều hòa,1\n")
+    report = import_file(store, source, "calcItems", "csv")
+    assert report["imported"] == 1
+    assert report["errors"] == [{"row": 2, "field": "stationCode/stationId", "error": "Không tìm thấy trạm"}]
+    assert store.get_design_data("s1")["calcItems"] == [{"name": "Tủ nguồn", "quantity": 2}]
+
+
+# --- CẬP NHẬT TỪNG PHẦN ---
+def test_partial_station_import_keeps_other_columns(store):
+    store.upsert_many([{
+        "id": "s1", "code": "A", "name": "Trạm A", "manager": "Nguyễn Văn A", "power": 10,
+        "coordinates": {"lat": 21.0, "lng": 105.8}, "designData": {"calcItems": [{"name": "Tủ nguồn"}]},
+    }])
+    report = import_file(store, csv_file("id,code,power\ns1,A,15\ns2,B,\n"), "stations", "csv")
+    assert report["imported"] == 2
+    updated = store.get("s1")
+    assert updated["power"] == 15
+    assert (updated["name"], updated["manager"]) == ("Trạm A", "Nguyễn Văn A")
+    assert updated["coordinates"] == {"lat": 21.0, "lng": 105.8}
+    assert updated["designData"]["calcItems"] == [{"name": "Tủ nguồn"}]
+    assert store.get("s2")["code"] == "B"
+
+
+def test_child_import_appends_unless_replace(store):
+    store.upsert_many([{"id": "s1", "code": "A", "designData": {"calcItems": [{"name": "Cũ"}]}}])
+    import_file(store, csv_file("stationId,name\ns1,Mới\n"), "calcItems", "csv")
+    assert [i["name"] for i in store.get_design_data("s1")["calcItems"]] == ["Cũ", "Mới"]
+    import_file(store, csv_file("stationId,name\ns1,Thay\n"), "calcItems", "csv", replace=True)
+    assert [i["name"] for i in store.get_design_data("s1")["calcItems"]] == ["Thay"]
+
+
+# --- XUẤT DỮ LIỆU ---
+def test_design_export_pages_through_every_station(store):
+    store.upsert_many([
+        {"id": f"s{i}", "code": f"C{i}", "designData": {"calcItems": [{"name": f"TB {i}"}, {"name": f"TB {i}b"}]}}
+        for i in range(5)
+    ])
+    assert sum(len(batch) for batch in store.iter_design_rows("calcItems", batch_size=2)) == 5
+    frame = pd.concat(list(iter_export_frames(store, "calcItems", batch_size=3)))
+    assert len(frame) == 10
+    assert frame.groupby("stationCode").size().to_dict() == {f"C{i}": 2 for i in range(5)}
@@ -0,0 +1,43 @@
+import json
+import threading
+
+from profiling import Profiler, span
+
+
+def record_runs(profiler, runs):
+    for _ in range(runs):
+        profiler.begin()
+        with span("render"):
+            pass
+        profiler.end("page")
+
+
+def test_concurrent_exports_do_not_collide(tmp_path):
+    profiler = Profiler(log_path=str(tmp_path / "runs.jsonl"), metrics_path=str(tmp_path / "pmb.prom"))
+    errors = []
+
+    def worker():
+        try:
+            record_runs(profiler, 100)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["pmb.prom", "runs.jsonl"]
+    lines = (tmp_path / "runs.jsonl").read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 800
+    assert all(json.loads(line)["page"] == "page" for line in lines)
+    assert 'pmb_rerun_seconds_count{page="page"} 800' in (tmp_path / "pmb.prom").read_text(encoding="utf-8")
+
+
+def test_export_errors_do_not_reach_the_page(tmp_path):
+    profiler = Profiler(metrics_path=str(tmp_path / "missing" / "pmb.prom"))
+    profiler.begin()
+    run = profiler.end("page")
+    assert run.page == "page"
+    assert len(profiler.runs()) == 1
@@ -0,0 +1,35 @@
+import pytest
+
+from search import SearchIndex
+
+
+@pytest.fixture
+def idx(store):
+    store.upsert_many([
+        {"id": "s1", "code": "HNIHW001", "name": "Hà Nội 1", "province": "Hà Nội"},
+        {"id": "s2", "code": "LCIHW002", "name": "Lào Cai 2", "province": "Lào Cai"},
+        {"id": "s3", "code": "HCMHW003", "name": "Hồ Chí Minh 3", "province": "TP HCM",
+         "inventory": [{"id": "inv_1", "itemName": "Máy phát Cummins"}]},
+    ])
+    return SearchIndex().refresh(store)
+
+
+def test_search_ignores_diacritics(idx):
+    assert idx.search("ha noi") == ["s1"]
+    assert idx.search("hw002") == ["s2"]
+    assert idx.search("cummins") == ["s3"]
+    assert idx.search("(") == []
+
+
+def test_short_terms_match_whole_words_only(idx):
+    assert idx.search("h") == []
+    assert idx.search("ha") == ["s1"]
+    assert idx.search("hni") == ["s1"]
+    assert idx.search("lao c") == ["s2"]
+
+
+def test_count_and_top_k_agree_with_the_full_ranking(idx):
+    assert idx.count("hw") == 0
+    assert idx.count("hw0") == 3
+    assert idx.search("hw0", limit=2) == idx.search("hw0")[:2]
+    assert idx.search("hw0", where={"s2", "s3"}.__contains__) == [s for s in idx.search("hw0") if s != "s1"]
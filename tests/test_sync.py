@@ -0,0 +1,147 @@
+from sync import SYNC_PREFIX, bulk_sync, sync_calc_to_cost, sync_cost_to_inventory
+
+CALC_ITEMS = [
+    {"name": "Tủ nguồn DC", "quantity": 2, "powerRatedW": 500, "voltage": 48, "type": "DC"},
+    {"name": "Điều hòa", "quantity": 1, "powerRatedW": 2200, "voltage": 220, "type": "AC"},
+]
+
+
+def station(station_id, inventory=None):
+    return {
+        "id": station_id, "code": station_id.upper(), "name": f"Trạm {station_id}",
+        "designData": {"calcItems": [dict(item) for item in CALC_ITEMS]},
+        "inventory": inventory or [],
+    }
+
+
+def synced_lines(inventory):
+    return [item for item in inventory if str(item.get("id", "")).startswith(SYNC_PREFIX)]
+
+
+# --- GỘP TỪNG TRẠM ---
+def test_sync_twice_adds_and_updates_nothing():
+    design_data = {"calcItems": CALC_ITEMS}
+    cost_items, stats = sync_calc_to_cost(design_data)
+    assert stats["added"] == 2
+    inventory, stats = sync_cost_to_inventory([], cost_items)
+    assert stats["added"] == 2
+
+    again, stats = sync_calc_to_cost({**design_data, "costEstimateItems": cost_items})
+    assert (stats["added"], stats["updated"], stats["unchanged"]) == (0, 0, 2)
+    assert again == cost_items
+    again, stats = sync_cost_to_inventory(inventory, cost_items)
+    assert (stats["added"], stats["updated"], stats["unchanged"]) == (0, 0, 2)
+    assert again == inventory
+
+
+def test_sync_keeps_user_fields_on_cost_lines():
+    cost_items, _ = sync_calc_to_cost({"calcItems": CALC_ITEMS})
+    cost_items[0]["unitPrice"] = 1_500_000
+    calc_items = [dict(CALC_ITEMS[0], quantity=3), CALC_ITEMS[1]]
+    merged, stats = sync_calc_to_cost({"calcItems": calc_items, "costEstimateItems": cost_items})
+    assert stats["updated"] == 1
+    assert merged[0]["quantity"] == 3
+    assert merged[0]["unitPrice"] == 1_500_000
+
+
+def test_sync_never_overwrites_real_inventory_lines():
+    real = {"id": "inv_1", "itemName": "Tủ nguồn DC", "quantity": 1, "status": "IN_USE",
+            "location1": "Rack 1", "transfer": {"isTransferred": True}}
+    cost_items, _ = sync_calc_to_cost({"calcItems": CALC_ITEMS})
+    inventory, stats = sync_cost_to_inventory([dict(real)], cost_items)
+    assert inventory[0] == real
+    assert stats["added"] == 2
+    assert len(synced_lines(inventory)) == 2
+
+
+def test_sync_leaves_locked_synced_lines_untouched():
+    cost_items, _ = sync_calc_to_cost({"calcItems": CALC_ITEMS})
+    inventory, _ = sync_cost_to_inventory([], cost_items)
+    inventory[0] = dict(inventory[0], status="IN_USE")
+    locked = dict(inventory[0])
+    cost_items[0]["quantity"] = 5
+    merged, stats = sync_cost_to_inventory(inventory, cost_items)
+    assert merged[0] == locked
+    assert len(merged) == len(inventory)
+    assert (stats["added"], stats["updated"], stats["unchanged"]) == (0, 0, 2)
+
+
+def test_setting_an_item_code_on_a_cost_line_does_not_duplicate_it():
+    cost_items, _ = sync_calc_to_cost({"calcItems": CALC_ITEMS})
+    cost_items[0]["itemCode"] = "TN-01"
+    merged, stats = sync_calc_to_cost({"calcItems": CALC_ITEMS, "costEstimateItems": cost_items})
+    assert (stats["added"], stats["removed"]) == (0, 0)
+    assert [(i["itemCode"], i["itemName"]) for i in merged] == [("TN-01", "Tủ nguồn DC"), ("", "Điều hòa")]
+
+
+def test_cost_lines_dropped_from_the_calc_table_are_removed_unless_priced():
+    cost_items, _ = sync_calc_to_cost({"calcItems": CALC_ITEMS})
+    manual = {"category": "AUX", "itemName": "Cáp nguồn", "quantity": 10}
+    cost_items.append(manual)
+    merged, stats = sync_calc_to_cost({"calcItems": CALC_ITEMS[:1], "costEstimateItems": cost_items})
+    assert stats["removed"] == 1
+    assert [i["itemName"] for i in merged] == ["Tủ nguồn DC", "Cáp nguồn"]
+
+    cost_items[1]["unitPrice"] = 12_000_000
+    merged, stats = sync_calc_to_cost({"calcItems": CALC_ITEMS[:1], "costEstimateItems": cost_items})
+    assert stats["removed"] == 0
+    assert [i["itemName"] for i in merged] == ["Tủ nguồn DC", "Điều hòa", "Cáp nguồn"]
+
+
+def test_changed_inventory_key_replaces_the_planned_line():
+    cost_items = [{"category": "MAIN", "itemName": "Tủ nguồn", "quantity": 2}]
+    inventory, _ = sync_cost_to_inventory([], cost_items)
+    cost_items[0]["itemCode"] = "TN-01"
+    merged, stats = sync_cost_to_inventory(inventory, cost_items)
+    assert (stats["added"], stats["removed"]) == (1, 1)
+    assert [(i["itemCode"], i["itemName"], i["quantity"]) for i in merged] == [("TN-01", "Tủ nguồn", 2)]
+
+
+def test_empty_cost_list_removes_only_unlocked_synced_lines():
+    real = {"id": "inv_1", "itemName": "Ắc quy", "status": "IN_USE"}
+    cost_items, _ = sync_calc_to_cost({"calcItems": CALC_ITEMS})
+    inventory, _ = sync_cost_to_inventory([dict(real)], cost_items)
+    inventory[1] = dict(inventory[1], status="IN_USE")
+    merged, stats = sync_cost_to_inventory(inventory, [])
+    assert stats["removed"] == 1
+    assert merged == inventory[:2]
+
+
+# --- ĐỒNG BỘ HÀNG LOẠT ---
+def test_bulk_sync_twice_is_idempotent(store):
+    store.upsert_many([station("a"), station("b")])
+    first = bulk_sync(store, ["a", "b"])
+    assert (first["stations"], first["added"], first["removed"], first["conflicts"]) == (2, 8, 0, [])
+
+    revision = store.revision
+    second = bulk_sync(store, ["a", "b"])
+    assert (second["stations"], second["added"], second["updated"], second["removed"]) == (0, 0, 0, 0)
+    assert store.revision == revision
+
+
+def test_bulk_sync_skips_stations_changed_during_the_batch(store):
+    store.upsert_many([station("a"), station("b")])
+    design_sections = store.design_sections
+
+    def edited_by_other_session(sections, station_ids=None):
+        # Phiên khác sửa trạm "b" sau khi bulk_sync đã đọc phiên bản
+        store.save_inventory("b", [{"id": "inv_b", "itemName": "Ắc quy", "status": "IN_USE"}])
+        return design_sections(sections, station_ids)
+
+    store.design_sections = edited_by_other_session
+    totals = bulk_sync(store, ["a", "b"])
+    assert totals["conflicts"] == ["b"]
+    assert totals["stations"] == 1
+    assert len(synced_lines(store.get_inventory("a"))) == 2
+    assert store.get_inventory("b") == [{"id": "inv_b", "itemName": "Ắc quy", "status": "IN_USE"}]
+    assert "costEstimateItems" not in store.get_design_data("b")
+
+
+def test_bulk_sync_removes_lines_whose_source_is_gone(store):
+    store.upsert_many([station("a")])
+    bulk_sync(store, ["a"])
+    store.save_design_data("a", {**store.get_design_data("a"), "calcItems": []})
+    totals = bulk_sync(store, ["a"])
+    assert totals["removed"] == 4
+    assert store.get_design_data("a")["costEstimateItems"] == []
+    assert store.get_inventory("a") == []
@@ -0,0 +1,13 @@
+from views import StationFrame
+
+
+def test_total_power_does_not_drift_after_patches(store):
+    store.upsert_many([{"id": f"s{i}", "code": f"C{i}", "power": 0.1} for i in range(10)])
+    frame = StationFrame().refresh(store)
+    for i in range(10):
+        store.update_field(f"s{i}", "power", 8.7)
+        frame.refresh(store)
+    store.delete("s0")
+    frame.refresh(store)
+    assert frame.aggregates()["total_power"] == 78.3
+    assert frame.aggregates()["total"] == 9
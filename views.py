@@ -0,0 +1,192 @@
+import threading
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+# --- VIEW DẪN XUẤT CẬP NHẬT TĂNG DẦN ---
+# Một view giữ dữ liệu dẫn xuất từ kho (DataFrame, chỉ mục...) và chỉ cập nhật
+# khi phiên bản kho thay đổi: vá từng trạm đã sửa/xóa thay vì dựng lại toàn bộ.
+
+
+class IncrementalView:
+    # Nếu số trạm thay đổi vượt ngưỡng này (tỉ lệ trên tổng) thì dựng lại cả view
+    rebuild_ratio = 0.1
+    min_rebuild = 100
+
+    def __init__(self):
+        self.revision = -1
+        self._lock = threading.RLock()
+
+    def refresh(self, store):
+        with self._lock:
+            revision = store.revision
+            if revision == self.revision:
+                return self
+            if self.revision < 0:
+                self._rebuild(self._load_all(store))
+            else:
+                changed, deleted = store.changed_since(self.revision)
+                if len(changed) + len(deleted) > max(self.min_rebuild, self.rebuild_ratio * self._size()):
+                    self._rebuild(self._load_all(store))
+                else:
+                    for station_id in deleted:
+                        self._remove(station_id)
+                    for station in self._load(store, changed):
+                        self._upsert(station)
+            self.revision = revision
+        return self
+
+    # Các view cần designData/inventory ghi đè hai hàm nạp dữ liệu này
+    def _load_all(self, store):
+        return store.list_stations()
+
+    def _load(self, store, station_ids):
+        return store.get_summaries(station_ids)
+
+    def _size(self):
+        raise NotImplementedError
+
+    def _rebuild(self, stations):
+        raise NotImplementedError
+
+    def _upsert(self, station):
+        raise NotImplementedError
+
+    def _remove(self, station_id):
+        raise NotImplementedError
+
+
+# --- BẢNG TRẠM DẠNG CỘT ---
+FRAME_COLUMNS = [
+    'code', 'name', 'province', 'region', 'status', 'power', 'racks',
+    'buildingType', 'manager', 'branchManager', 'category', 'buildYear', 'lat', 'lng',
+]
+CATEGORY_COLUMNS = ['region', 'status', 'province', 'buildingType']
+NUMERIC_COLUMNS = ['power', 'racks', 'lat', 'lng']
+
+
+def _to_float(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if number != number else number
+
+
+def _frame_record(station):
+    coords = station.get('coordinates') or {}
+    record = {c: station.get(c) for c in FRAME_COLUMNS}
+    record['lat'] = coords.get('lat')
+    record['lng'] = coords.get('lng')
+    for col in NUMERIC_COLUMNS:
+        record[col] = _to_float(record[col])
+    return record
+
+
+class StationFrame(IncrementalView):
+    def __init__(self):
+        super().__init__()
+        self.df = self._typed(pd.DataFrame(columns=FRAME_COLUMNS, index=pd.Index([], name='id')))
+        self.status_counts = Counter()
+        self.region_counts = Counter()
+        self._orders = {}   # (cột, tăng dần) -> vị trí dòng đã sắp xếp, xóa khi bảng đổi
+
+    @staticmethod
+    def _typed(df):
+        for col in NUMERIC_COLUMNS:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+        for col in CATEGORY_COLUMNS:
+            df[col] = df[col].astype('category')
+        return df
+
+    def _size(self):
+        return len(self.df)
+
+    # Đếm theo trạng thái/khu vực được cộng/trừ theo từng dòng khi vá, không quét lại bảng
+    def _count(self, record, sign):
+        if record['status'] is not None:
+            self.status_counts[record['status']] += sign
+        if record['region'] is not None:
+            self.region_counts[record['region']] += sign
+
+    def _row_record(self, station_id):
+        row = self.df.loc[station_id]
+        return {c: (None if pd.isna(row[c]) else row[c]) for c in ('status', 'region')}
+
+    def _rebuild(self, stations):
+        self._orders = {}
+        records = [_frame_record(s) for s in stations]
+        df = pd.DataFrame(records, columns=FRAME_COLUMNS, index=pd.Index([s['id'] for s in stations], name='id'))
+        self.df = self._typed(df)
+        self.status_counts = Counter()
+        self.region_counts = Counter()
+        for record in records:
+            self._count(record, 1)
+
+    def _upsert(self, station):
+        self._orders = {}
+        station_id = station['id']
+        record = _frame_record(station)
+        if station_id in self.df.index:
+            self._count(self._row_record(station_id), -1)
+            for col in CATEGORY_COLUMNS:
+                value = record[col]
+                if value is not None and value not in self.df[col].cat.categories:
+                    self.df[col] = self.df[col].cat.add_categories([value])
+            for col in FRAME_COLUMNS:
+                self.df.at[station_id, col] = record[col]
+        else:
+            row = self._typed(pd.DataFrame([record], columns=FRAME_COLUMNS, index=pd.Index([station_id], name='id')))
+            df = pd.concat([self.df.astype({c: object for c in CATEGORY_COLUMNS}), row.astype({c: object for c in CATEGORY_COLUMNS})])
+            self.df = self._typed(df)
+        self._count(record, 1)
+
+    def _remove(self, station_id):
+        self._orders = {}
+        if station_id in self.df.index:
+            self._count(self._row_record(station_id), -1)
+            self.df = self.df.drop(index=station_id)
+
+    def aggregates(self):
+        with self._lock:
+            return {
+                "total": len(self.df),
+                "status_counts": {k: v for k, v in self.status_counts.items() if v > 0},
+                "region_counts": {k: v for k, v in self.region_counts.items() if v > 0},
+                # Cộng/trừ số thực từng trạm bị trôi (86.99999999): tính lại bằng một phép
+                # cộng vector trên cột power, làm tròn tới W
+                "total_power": round(float(self.df['power'].sum()), 3),
+            }
+
+    def _order(self, sort_by, ascending):
+        # Thứ tự sắp xếp theo một cột, tính một lần cho mỗi phiên bản bảng
+        key = (sort_by, ascending)
+        if key not in self._orders:
+            col = self.df[sort_by].reset_index(drop=True)
+            if col.dtype == 'category':
+                col = col.astype(object)
+            self._orders[key] = col.sort_values(ascending=ascending, na_position='last', kind='stable').index.to_numpy()
+        return self._orders[key]
+
+    def page(self, ids=None, region=None, sort_by=None, ascending=True, offset=0, limit=50):
+        # Một trang dòng đã lọc/sắp xếp và tổng số dòng khớp. `ids` là danh sách id
+        # (vd. kết quả tìm kiếm đã xếp hạng), giữ nguyên thứ tự nếu không chọn cột sắp xếp.
+        with self._lock:
+            df = self.df
+            if ids is not None:
+                positions = df.index.get_indexer(ids)
+                positions = positions[positions >= 0]
+                if sort_by:
+                    keep = np.zeros(len(df), dtype=bool)
+                    keep[positions] = True
+                    order = self._order(sort_by, ascending)
+                    positions = order[keep[order]]
+            elif sort_by:
+                positions = self._order(sort_by, ascending)
+            else:
+                positions = np.arange(len(df))
+            if region is not None:
+                match = (df['region'] == region).to_numpy()
+                positions = positions[match[positions]]
+            return df.iloc[positions[offset:offset + limit]], len(positions)